@@ -0,0 +1,560 @@
+# dlcommon: naver-dl.py와 yt-dl.py가 함께 쓰는 쿠키 캐시, 속도 제한, 공유 큐, 메트릭 기록
+# (두 스크립트가 같은 디스크 형식을 공유하므로 이 파일 하나에만 구현하고, 스크립트와 같은 디렉터리에 둡니다)
+
+import os
+import re
+import json
+import time
+import glob
+import atexit
+import shutil
+import sqlite3
+import tempfile
+import platform
+import argparse
+import threading
+import contextlib
+from urllib.parse import urlparse
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+# Firefox 쿠키 캐시 (naver-dl과 yt-dl이 함께 사용)
+COOKIE_CACHE_DIR = os.path.expanduser("~/.cache/yt-dlp-plugins")
+COOKIE_CACHE_FILE = os.path.join(COOKIE_CACHE_DIR, "firefox_cookies.txt")
+COOKIE_CACHE_META = os.path.join(COOKIE_CACHE_DIR, "firefox_cookies.json")
+COOKIE_DOMAINS = ('naver.com', 'youtube.com', 'google.com')
+
+# 호스트별 속도 제한 상태
+RATE_LIMIT_DIR = os.path.join(COOKIE_CACHE_DIR, "ratelimit")
+DEFAULT_REQUEST_RATE = 10.0  # 호스트당 초당 요청 수
+
+QUEUE_LEASE_TTL = 120       # 공유 큐: 하트비트가 이만큼(초) 끊기면 다른 노드가 작업을 회수
+QUEUE_POLL_INTERVAL = 5     # 공유 큐: 다른 노드가 임대 중인 작업이 끝나길 기다리는 간격
+QUEUE_MAX_ATTEMPTS = 3      # 공유 큐: 실패/회수된 작업을 다시 시도하는 횟수
+
+# Firefox 쿠키 캐시: cookies.sqlite가 바뀌거나 도메인 쿠키가 만료될 때만 다시 추출
+def find_firefox_cookie_db():
+    """가장 최근에 사용된 Firefox 프로필의 cookies.sqlite 경로"""
+    system = platform.system()
+    if system == "Darwin":
+        roots = [os.path.expanduser("~/Library/Application Support/Firefox/Profiles")]
+    elif system == "Windows":
+        roots = [os.path.join(os.environ.get("APPDATA", ""), "Mozilla", "Firefox", "Profiles")]
+    else:
+        roots = [os.path.expanduser("~/.mozilla/firefox"),
+                 os.path.expanduser("~/snap/firefox/common/.mozilla/firefox")]
+
+    candidates = []
+    for root in roots:
+        candidates.extend(glob.glob(os.path.join(root, "*", "cookies.sqlite")))
+    if not candidates:
+        return None
+    return max(candidates, key=os.path.getmtime)
+
+def cookie_db_signature(db_path):
+    """cookies.sqlite(및 WAL)의 mtime"""
+    wal = db_path + "-wal"
+    return [os.path.getmtime(db_path),
+            os.path.getmtime(wal) if os.path.exists(wal) else None]
+
+def is_tracked_domain(host):
+    """캐시 만료 판단에 쓰는 도메인인지"""
+    host = host.lstrip('.')
+    return any(host == d or host.endswith('.' + d) for d in COOKIE_DOMAINS)
+
+def write_cookie_cache(lines, meta):
+    """쿠키 캐시와 메타데이터를 원자적으로 저장 (쿠키 파일은 본인만 읽을 수 있게)"""
+    write_atomic(COOKIE_CACHE_FILE, "# Netscape HTTP Cookie File\n" + ''.join(lines), mode=0o600)
+    write_atomic(COOKIE_CACHE_META, json.dumps(meta))
+
+def extract_firefox_cookies(db_path):
+    """Firefox cookies.sqlite를 복사해 읽고 캐시에 저장"""
+    now = time.time()
+    lines = []
+    expires_at = None
+    with tempfile.TemporaryDirectory(prefix='dl-cookies-') as tmp_dir:
+        # 브라우저가 DB를 잠그고 있으므로 WAL과 함께 복사해서 읽음
+        tmp_db = os.path.join(tmp_dir, "cookies.sqlite")
+        shutil.copyfile(db_path, tmp_db)
+        if os.path.exists(db_path + "-wal"):
+            shutil.copyfile(db_path + "-wal", tmp_db + "-wal")
+        conn = sqlite3.connect(tmp_db)
+        try:
+            rows = conn.execute(
+                "SELECT host, name, value, path, expiry, isSecure FROM moz_cookies").fetchall()
+        finally:
+            conn.close()
+
+    for host, name, value, path, expiry, is_secure in rows:
+        expiry = int(expiry or 0)
+        if expiry > 10 ** 11:
+            expiry //= 1000  # 최신 Firefox는 밀리초 단위로 저장
+        if expiry and expiry < now:
+            continue
+        if expiry and is_tracked_domain(host):
+            expires_at = expiry if expires_at is None else min(expires_at, expiry)
+        subdomains = 'TRUE' if host.startswith('.') else 'FALSE'
+        secure = 'TRUE' if is_secure else 'FALSE'
+        lines.append(f"{host}\t{subdomains}\t{path}\t{secure}\t{expiry}\t{name}\t{value}\n")
+
+    write_cookie_cache(lines, {
+        'source': 'firefox',
+        'db_path': db_path,
+        'db_signature': cookie_db_signature(db_path),
+        'expires_at': expires_at,
+        'created_at': now,
+    })
+    return len(lines)
+
+def read_cookie_cache_meta():
+    """쿠키 캐시 메타데이터 (없으면 None)"""
+    try:
+        with open(COOKIE_CACHE_META, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+def cookie_cache_valid(meta, db_path):
+    """캐시가 아직 유효한지 (DB mtime 변경 또는 도메인 쿠키 만료 시 무효)"""
+    if not meta or not os.path.exists(COOKIE_CACHE_FILE):
+        return False
+    if meta.get('expires_at') and meta['expires_at'] <= time.time():
+        return False
+    if meta.get('source') != 'firefox':
+        return False  # 예전 버전이 가져온(--import-cookies) 쿠키를 넣어 둔 캐시
+    if not db_path or meta.get('db_path') != db_path:
+        return False
+    return meta.get('db_signature') == cookie_db_signature(db_path)
+
+def get_cached_cookie_file(refresh=False):
+    """Firefox 쿠키 캐시 경로 (필요할 때만 재추출, 실패 시 None)"""
+    db_path = find_firefox_cookie_db()
+    if not refresh and cookie_cache_valid(read_cookie_cache_meta(), db_path):
+        return COOKIE_CACHE_FILE
+    if not db_path:
+        return None
+    try:
+        extract_firefox_cookies(db_path)
+    except (OSError, sqlite3.Error) as e:
+        print(f"Firefox 쿠키 추출 실패: {e}")
+        return None
+    return COOKIE_CACHE_FILE
+
+# yt-dlp는 끝날 때 쿠키 파일에 다시 저장(원자적이지 않음)하므로 공유 캐시나 쿠키 파일을 직접 넘기지 않고
+# 사용할 때마다 개인 사본(0600)을 넘김: 다른 프로세스가 읽는 도중 잘리거나 캐시 수정 시각이 바뀌지 않음
+_cookie_copy_dir = None
+_cookie_copy_lock = threading.Lock()
+
+def copy_cookie_file(path):
+    """쿠키 파일의 개인 사본 경로 (없으면 None, 남은 사본은 프로세스가 끝날 때 지움)"""
+    global _cookie_copy_dir
+    if not path or not os.path.exists(path):
+        return None
+    with _cookie_copy_lock:
+        if _cookie_copy_dir is None:
+            _cookie_copy_dir = tempfile.mkdtemp(prefix='dl-cookie-copies-')
+            atexit.register(shutil.rmtree, _cookie_copy_dir, True)
+    fd, copy = tempfile.mkstemp(dir=_cookie_copy_dir, suffix='.txt')
+    with os.fdopen(fd, 'wb') as dst, open(path, 'rb') as src:
+        shutil.copyfileobj(src, dst)
+    return copy
+
+@contextlib.contextmanager
+def private_cookie_file(path):
+    """with 블록 동안만 쓰는 쿠키 파일 사본 (yt-dlp 프로세스 하나에 넘길 때)"""
+    copy = copy_cookie_file(path)
+    try:
+        yield copy
+    finally:
+        if copy:
+            with contextlib.suppress(OSError):
+                os.remove(copy)
+
+# 상태 파일: 여러 프로세스가 함께 읽고 쓰는 파일의 잠금과 원자적 저장
+def lock_file(f):
+    """다른 프로세스와 공유하는 상태 파일 잠금"""
+    if fcntl:
+        fcntl.flock(f, fcntl.LOCK_EX)
+    else:
+        f.seek(0)
+        msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+
+def unlock_file(f):
+    if fcntl:
+        fcntl.flock(f, fcntl.LOCK_UN)
+    else:
+        f.seek(0)
+        msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+
+def write_atomic(path, content, mode=0o644):
+    """임시 파일에 쓴 뒤 교체 (읽는 쪽이 반쯤 쓴 파일을 보지 않도록, 쿠키가 든 파일은 mode=0o600)"""
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix='.tmp-')
+    try:
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            f.write(content)
+        os.chmod(tmp_path, mode)
+        os.replace(tmp_path, path)
+    except OSError:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+# 호스트별 속도 제한: 모든 naver-dl/yt-dl 프로세스가 파일 잠금으로 공유하는 토큰 버킷
+def parse_rate(text):
+    """'8M', '500K', '1.5M' 같은 초당 바이트 수 해석"""
+    match = re.fullmatch(r'\s*([\d.]+)\s*([KMG]?)i?B?\s*', text, re.IGNORECASE)
+    if not match:
+        raise argparse.ArgumentTypeError(f"잘못된 속도: {text}")
+    scale = {'': 1, 'K': 1024, 'M': 1024 ** 2, 'G': 1024 ** 3}[match.group(2).upper()]
+    return int(float(match.group(1)) * scale)
+
+def rate_limit_host(url):
+    """속도 제한을 묶는 단위 (youtu.be 등 YouTube 주소는 하나로)"""
+    host = (urlparse(url).hostname or 'unknown').lower()
+    if host == 'youtu.be' or host == 'youtube.com' or host.endswith('.youtube.com'):
+        return 'youtube.com'
+    return host
+
+class HostRateLimiter:
+    """요청 수/대역폭 토큰 버킷 (호스트마다 JSON 상태 파일 하나)
+
+    토큰이 모자라면 빚을 지고 그만큼 기다리는 방식이라, 여러 프로세스가 함께 써도
+    전체 속도가 한도 바로 아래에서 일정하게 유지됩니다. 버스트는 1초 분량까지만 허용합니다.
+    """
+
+    def __init__(self, request_rate=DEFAULT_REQUEST_RATE, bandwidth=None,
+                 state_dir=RATE_LIMIT_DIR):
+        self.request_rate = request_rate
+        self.bandwidth = bandwidth
+        self.state_dir = state_dir
+        self.lock = threading.Lock()  # 같은 프로세스 안의 스레드끼리는 flock이 배타적이지 않음
+
+    @contextlib.contextmanager
+    def _state(self, host):
+        """잠금을 잡은 채로 호스트 상태를 읽고, 블록이 끝나면 저장"""
+        os.makedirs(self.state_dir, exist_ok=True)
+        path = os.path.join(self.state_dir, re.sub(r'[^\w.-]', '_', host) + ".json")
+        with self.lock, open(path, 'a+', encoding='utf-8') as f:
+            lock_file(f)
+            try:
+                f.seek(0)
+                try:
+                    state = json.loads(f.read() or '{}')
+                except ValueError:
+                    state = {}
+                yield state
+                f.seek(0)
+                f.truncate()
+                json.dump(state, f)
+                f.flush()
+            finally:
+                unlock_file(f)
+
+    def _take(self, host, requests=0, nbytes=0):
+        """토큰을 가져가고 기다려야 할 시간(초) 반환"""
+        budgets = (('requests', self.request_rate, requests), ('bytes', self.bandwidth, nbytes))
+        if not any(rate and amount for _, rate, amount in budgets):
+            return 0
+        with self._state(host) as state:
+            now = time.time()
+            wait = 0
+            for name, rate, amount in budgets:
+                if not rate or not amount:
+                    continue
+                bucket = state.get(name) or {'tokens': rate, 'at': now}
+                tokens = min(rate, bucket['tokens'] + (now - bucket['at']) * rate) - amount
+                state[name] = {'tokens': tokens, 'at': now}
+                if tokens < 0:
+                    wait = max(wait, -tokens / rate)
+            return wait
+
+    def take(self, url, requests=0, nbytes=0):
+        """요청 수/바이트만큼 토큰을 차감하고 모자라면 기다림"""
+        if requests > 0 or nbytes > 0:
+            time.sleep(self._take(rate_limit_host(url), requests, nbytes))
+
+    def acquire(self, url):
+        """요청 하나를 보내기 전에 호출"""
+        self.take(url, requests=1)
+
+    def consume(self, url, nbytes):
+        """받은 바이트만큼 대역폭 토큰 차감"""
+        self.take(url, nbytes=nbytes)
+
+class StreamMeter:
+    """yt-dlp 프로세스의 진행 출력으로 받은 바이트와 조각 요청을 토큰 버킷에 차감
+
+    --limit-rate는 프로세스를 시작할 때 정해져 나중에 다운로드 수가 바뀌어도 다시 나눌 수 없습니다.
+    대신 진행 줄을 읽는 쪽이 토큰을 기다리면 파이프가 차고, 진행 줄을 쓰던 yt-dlp 다운로드 스레드가
+    멈추므로 프로세스 수와 관계없이 실제로 받은 양이 호스트 한도 안에 머뭅니다.
+    """
+    PIPE_BUFFER = 4096  # 기다리는 동안 yt-dlp가 더 받을 수 있는 진행 줄 수를 줄이는 파이프 크기
+
+    def __init__(self, limiter, url):
+        self.limiter = limiter
+        self.url = url
+        self.files = {}  # 파일 → (차감한 바이트, 차감한 조각 번호)
+
+    def limit_rate(self):
+        """프로세스 하나에 넘길 --limit-rate (파이프가 찰 때까지 한도를 넘겨 몰아 받지 않도록)"""
+        return self.limiter.bandwidth
+
+    def attach(self, pipe):
+        """yt-dlp 출력 파이프 버퍼를 줄임 (Linux만, 실패해도 무시)"""
+        if fcntl and hasattr(fcntl, 'F_SETPIPE_SZ'):
+            with contextlib.suppress(OSError):
+                fcntl.fcntl(pipe.fileno(), fcntl.F_SETPIPE_SZ, self.PIPE_BUFFER)
+
+    def update(self, d):
+        """진행 dict 하나만큼 토큰을 차감하고 모자라면 기다림"""
+        filename = d.get('filename') or d.get('tmpfilename')
+        done = d.get('downloaded_bytes') or 0
+        index = d.get('fragment_index') or 0
+        charged, fragments = self.files.get(filename, (0, 0))
+        self.files[filename] = (max(done, charged), max(index, fragments))
+        self.limiter.take(self.url, requests=max(0, index - fragments),
+                          nbytes=max(0, done - charged))
+
+# 진행 메트릭: Prometheus textfile(.prom) 또는 JSON
+class MetricsExporter:
+    """진행 이벤트를 모아 Prometheus textfile(.prom) 또는 JSON 파일로 원자적으로 기록
+
+    node_exporter의 textfile collector가 읽을 수 있도록 확장자가 .prom이면 텍스트 형식,
+    그 밖에는 JSON으로 씁니다. 다운로드 하나는 labels 순서의 값 튜플로 구분하며(naver-dl은 작업/variant,
+    yt-dl은 URL), 끝난 다운로드는 최근 KEEP_FINISHED개만 남깁니다.
+    """
+    GAUGES = (
+        ('downloaded_bytes', 'downloaded_bytes', '받은 바이트'),
+        ('total_bytes', 'total_bytes', '전체(추정) 바이트'),
+        ('fragments_done', 'fragment_index', '받은 조각 수'),
+        ('fragments_total', 'fragment_count', '전체 조각 수'),
+        ('speed_bytes_per_second', 'speed', '순간 속도'),
+        ('average_speed_bytes_per_second', 'average_speed', '평균 속도'),
+        ('retries', 'retries', '재시도 횟수'),
+        ('eta_seconds', 'eta', '남은 시간'),
+        ('last_update_timestamp_seconds', 'updated_at', '마지막 이벤트 시각'),
+    )
+    KEEP_FINISHED = 200
+
+    def __init__(self, path, prefix, labels, interval=2):
+        self.path = path
+        self.prefix = prefix
+        self.labels = labels
+        self.interval = interval
+        self.lock = threading.Lock()  # 동시 다운로드 스레드들이 함께 보고
+        self.downloads = {}
+        self.last_write = 0
+
+    def on_progress(self, key, fields):
+        status = fields.get('status')
+        with self.lock:
+            entry = self.downloads.setdefault(key, {'status': 'downloading'})
+            entry.update({k: v for k, v in fields.items() if v is not None})
+            entry['updated_at'] = time.time()
+            finished = [k for k, v in self.downloads.items() if v['status'] != 'downloading']
+            for old in finished[:-self.KEEP_FINISHED]:
+                del self.downloads[old]
+            if status is None and time.monotonic() - self.last_write < self.interval:
+                return
+            self.last_write = time.monotonic()
+            content = self.render()
+        write_atomic(self.path, content)
+
+    def render(self):
+        if not self.path.endswith('.prom'):
+            return json.dumps({
+                'updated_at': time.time(),
+                'downloads': [dict(entry, **dict(zip(self.labels, key)))
+                              for key, entry in self.downloads.items()],
+            }, ensure_ascii=False, indent=2)
+
+        lines = []
+        selectors = {key: ','.join(f'{label}="{prom_label(str(value))}"'
+                                   for label, value in zip(self.labels, key))
+                     for key in self.downloads}
+        for name, field, help_text in self.GAUGES:
+            metric = f"{self.prefix}_{name}"
+            lines.append(f"# HELP {metric} {help_text}")
+            lines.append(f"# TYPE {metric} gauge")
+            for key, entry in self.downloads.items():
+                if entry.get(field) is not None:
+                    lines.append(f'{metric}{{{selectors[key]}}} {entry[field]}')
+        metric = f"{self.prefix}_download_active"
+        lines.append(f"# HELP {metric} 다운로드 중이면 1")
+        lines.append(f"# TYPE {metric} gauge")
+        for key, entry in self.downloads.items():
+            active = int(entry['status'] == 'downloading')
+            lines.append(f'{metric}{{{selectors[key]},status="{entry["status"]}"}} {active}')
+        return '\n'.join(lines) + '\n'
+
+    def flush(self):
+        with self.lock:
+            content = self.render()
+        write_atomic(self.path, content)
+
+def prom_label(value):
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+# 공유 큐: 여러 머신의 워커가 공유 디렉터리에서 작업을 임대해 처리
+class SharedQueue:
+    """공유 디렉터리(NFS/SMB 등) 작업 큐
+
+    작업 파일을 pending/ → leased/ → done/ 또는 failed/로 os.rename 해서 옮깁니다. rename은 원자적이라
+    같은 작업을 두 노드가 함께 가져가지 못합니다. 임대 파일의 수정 시각이 하트비트이며, lease_ttl 동안
+    갱신되지 않으면 노드가 죽은 것으로 보고 아무 노드나 pending/으로 되돌립니다.
+    """
+    STATES = ('pending', 'leased', 'done', 'failed')
+
+    def __init__(self, root, node=None, lease_ttl=QUEUE_LEASE_TTL):
+        self.root = root
+        self.node = re.sub(r'[^\w-]', '_', node or f"{platform.node() or 'node'}-{os.getpid()}")
+        self.lease_ttl = lease_ttl
+        for state in self.STATES:
+            os.makedirs(os.path.join(root, state), exist_ok=True)
+
+    def path(self, state, name):
+        return os.path.join(self.root, state, name)
+
+    def names(self, state):
+        """상태 디렉터리의 작업 파일 이름 (<작업 ID>[.<노드>].json)"""
+        try:
+            return [n for n in os.listdir(os.path.join(self.root, state)) if n.endswith('.json')]
+        except FileNotFoundError:
+            return []
+
+    def active(self):
+        """대기 중이거나 어느 노드가 임대 중인 작업이 있는지"""
+        return bool(self.names('pending') or self.names('leased'))
+
+    def enqueue(self, job_id, data):
+        """작업 추가 (같은 작업이 대기/임대/완료 상태면 False)"""
+        known = {n.split('.', 1)[0] for state in ('pending', 'leased', 'done')
+                 for n in self.names(state)}
+        if job_id in known:
+            return False
+        job = {'id': job_id, 'data': data, 'attempts': 0, 'enqueued_at': time.time()}
+        write_atomic(self.path('pending', f"{job_id}.json"), json.dumps(job, ensure_ascii=False))
+        return True
+
+    def reclaim(self):
+        """하트비트가 끊긴 임대를 pending/으로 되돌림"""
+        now = time.time()
+        for name in self.names('leased'):
+            lease_path = self.path('leased', name)
+            try:
+                if now - os.path.getmtime(lease_path) < self.lease_ttl:
+                    continue
+                os.rename(lease_path, self.path('pending', name.split('.', 1)[0] + '.json'))
+            except OSError:
+                continue  # 다른 노드가 먼저 회수했거나 작업이 끝남
+            print(f"[queue] 만료된 임대 회수: {name}")
+
+    def claim(self):
+        """가장 오래 기다린 작업 하나를 임대 (없으면 None)"""
+        self.reclaim()
+        pending = []
+        for name in self.names('pending'):
+            try:
+                pending.append((os.path.getmtime(self.path('pending', name)), name))
+            except OSError:
+                pass
+        for _, name in sorted(pending):
+            job_id = name.split('.', 1)[0]
+            lease_path = self.path('leased', f"{job_id}.{self.node}.json")
+            try:
+                # 옮기기 전에 수정 시각을 갱신해야 다른 노드가 바로 만료로 보고 회수하지 않음
+                os.utime(self.path('pending', name))
+                os.rename(self.path('pending', name), lease_path)
+                with open(lease_path, 'r', encoding='utf-8') as f:
+                    job = json.load(f)
+            except (OSError, ValueError):
+                continue  # 다른 노드가 먼저 가져감
+            lease = QueueLease(self, job_id, lease_path, job)
+            if job.get('attempts', 0) >= QUEUE_MAX_ATTEMPTS:
+                lease.finish('failed', error='재시도 횟수 초과')
+                continue
+            job['attempts'] = job.get('attempts', 0) + 1
+            job['node'] = self.node
+            job['leased_at'] = time.time()
+            lease.save()
+            lease.start()
+            return lease
+        return None
+
+class LeaseLost(Exception):
+    """임대가 만료되어 다른 노드로 넘어간 작업 (더 받지 말고 결과도 기록하지 않아야 함)"""
+
+class QueueLease:
+    """임대한 작업 하나 (처리하는 동안 백그라운드 스레드가 하트비트를 보냄)
+
+    하트비트가 임대 파일이 사라진 것을 보면 lost를 세우고, 워커는 check()로 알아채 작업을 멈춥니다.
+    """
+
+    def __init__(self, queue, job_id, path, job):
+        self.queue = queue
+        self.job_id = job_id
+        self.path = path
+        self.job = job
+        self.stopped = threading.Event()
+        self.lost = threading.Event()
+        self.thread = threading.Thread(target=self.heartbeat, daemon=True)
+
+    def start(self):
+        self.thread.start()
+
+    def heartbeat(self):
+        while not self.stopped.wait(self.queue.lease_ttl / 4):
+            try:
+                os.utime(self.path)
+            except FileNotFoundError:
+                self.lost.set()
+                print(f"[queue] 임대가 만료되어 다른 노드로 넘어갔습니다: {self.job_id}")
+                return
+
+    def check(self):
+        """임대를 잃었으면 LeaseLost (다운로드 진행 중에 불러 바로 멈춤)"""
+        if self.lost.is_set():
+            raise LeaseLost(f"임대가 만료되어 작업을 중단합니다: {self.job_id}")
+
+    def save(self):
+        write_atomic(self.path, json.dumps(self.job, ensure_ascii=False))
+
+    def finish(self, status, **result):
+        """done/skipped는 done/으로, failed는 재시도 횟수가 남았으면 pending/으로 되돌림
+
+        임대를 잃었으면 다른 노드의 결과를 덮어쓰지 않도록 아무것도 기록하지 않고 False를 반환합니다.
+        """
+        self.stopped.set()
+        if self.thread.is_alive():
+            self.thread.join()
+        if self.lost.is_set():
+            print(f"[queue] 임대를 잃어 결과를 기록하지 않습니다: {self.job_id}")
+            return False
+        self.job.update(result, status=status, finished_at=time.time())
+        state = 'done' if status != 'failed' else \
+            'pending' if self.job.get('attempts', 0) < QUEUE_MAX_ATTEMPTS else 'failed'
+        # 임대 파일을 먼저 옮겨 두어야 그 사이 회수된 임대를 write_atomic이 되살리지 않음
+        # (중간에 죽어도 .json이라 만료 후 회수됨)
+        finishing = self.queue.path('leased', f"{self.job_id}.{self.queue.node}-finishing.json")
+        try:
+            os.rename(self.path, finishing)
+        except FileNotFoundError:
+            self.lost.set()
+            print(f"[queue] 임대를 잃어 결과를 기록하지 않습니다: {self.job_id}")
+            return False
+        except OSError as e:
+            print(f"[queue] 작업 상태 기록 실패: {self.job_id}: {e}")
+            return False
+        try:
+            write_atomic(finishing, json.dumps(self.job, ensure_ascii=False))
+            os.replace(finishing, self.queue.path(state, f"{self.job_id}.json"))
+        except OSError as e:
+            print(f"[queue] 작업 상태 기록 실패: {self.job_id}: {e}")
+            return False
+        return True
@@ -0,0 +1,476 @@
+#!/usr/bin/env python3
+# naver-bench: 가짜 네이버 VOD 서버로 nvpcon/naver-dl 성능 측정 (실제 서비스에 접속하지 않음)
+
+import os
+import re
+import sys
+import json
+import random
+import struct
+import argparse
+import importlib.util
+import subprocess
+import shutil
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+TOKEN = "bench-token"
+TS_PACKET = 188
+RANGE_RE = re.compile(r'bytes=(\d*)-(\d*)')
+VARIANTS = {
+    # 이름: (가로, 세로, BANDWIDTH)
+    '360p': (640, 360, 800000),
+    '720p': (1280, 720, 2500000),
+    '1080p': (1920, 1080, 5000000),
+}
+
+# 합성 MPEG-TS: PAT/PMT + H.264 SPS(해상도) + AAC PES, PTS는 세그먼트마다 이어짐
+class BitWriter:
+    def __init__(self):
+        self.bits = []
+
+    def u(self, n, value):
+        self.bits.extend((value >> i) & 1 for i in range(n - 1, -1, -1))
+
+    def ue(self, value):
+        value += 1
+        n = value.bit_length()
+        self.u(n - 1, 0)
+        self.u(n, value)
+
+    def to_bytes(self):
+        bits = self.bits + [1]
+        bits += [0] * (-len(bits) % 8)
+        return bytes(int(''.join(map(str, bits[i:i + 8])), 2) for i in range(0, len(bits), 8))
+
+def h264_sps(width, height):
+    """Baseline 프로파일 SPS (가로/세로가 16의 배수가 아니면 cropping 사용)"""
+    w = BitWriter()
+    w.ue(0)                 # seq_parameter_set_id
+    w.ue(0)                 # log2_max_frame_num_minus4
+    w.ue(2)                 # pic_order_cnt_type
+    w.ue(1)                 # max_num_ref_frames
+    w.u(1, 0)
+    mbs_w, mbs_h = (width + 15) // 16, (height + 15) // 16
+    w.ue(mbs_w - 1)
+    w.ue(mbs_h - 1)
+    w.u(1, 1)               # frame_mbs_only_flag
+    w.u(1, 1)               # direct_8x8_inference_flag
+    crop_w, crop_h = mbs_w * 16 - width, mbs_h * 16 - height
+    if crop_w or crop_h:
+        w.u(1, 1)
+        w.ue(0)
+        w.ue(crop_w // 2)
+        w.ue(0)
+        w.ue(crop_h // 2)
+    else:
+        w.u(1, 0)
+    w.u(1, 0)               # vui_parameters_present_flag
+    return bytes([0x67, 66, 0, 30]) + w.to_bytes()
+
+def pes_timestamp(pts):
+    return bytes([0x21 | ((pts >> 29) & 0x0e), (pts >> 22) & 0xff, ((pts >> 14) & 0xfe) | 1,
+                  (pts >> 7) & 0xff, ((pts << 1) & 0xfe) | 1])
+
+def ts_packets(pid, payload, counters):
+    """payload를 188바이트 TS 패킷으로 분할 (마지막 패킷은 adaptation field로 채움)"""
+    packets = []
+    first = True
+    while payload:
+        header = bytearray([0x47, (0x40 if first else 0) | (pid >> 8), pid & 0xff,
+                            0x10 | (counters[pid] & 0x0f)])
+        counters[pid] += 1
+        chunk, payload = payload[:184], payload[184:]
+        if len(chunk) < 184:
+            pad = 184 - len(chunk)
+            header[3] |= 0x20
+            adaptation = bytes([pad - 1]) + (b'\x00' + b'\xff' * (pad - 2) if pad > 1 else b'')
+            packets.append(bytes(header) + adaptation + chunk)
+        else:
+            packets.append(bytes(header) + chunk)
+        first = False
+    return packets
+
+def psi_section(table_id, body):
+    section = struct.pack('>B H', table_id, 0xb000 | (len(body) + 4)) + body + b'\x00' * 4
+    return b'\x00' + section
+
+def ts_segment(width, height, start_pts, seconds, payload_bytes, fps=10):
+    """seconds 길이, 대략 payload_bytes 크기의 TS 세그먼트"""
+    counters = {0: 0, 0x1000: 0, 0x100: 0, 0x101: 0}
+    pat = psi_section(0x00, struct.pack('>HBBBHH', 1, 0xc1, 0, 0, 1, 0xe000 | 0x1000))
+    streams = struct.pack('>BHH', 0x1b, 0xe000 | 0x100, 0xf000)
+    streams += struct.pack('>BHH', 0x0f, 0xe000 | 0x101, 0xf000)
+    pmt = psi_section(0x02, struct.pack('>HBBBHH', 1, 0xc1, 0, 0, 0xe000 | 0x100, 0xf000)
+                      + streams)
+    packets = ts_packets(0, pat, counters) + ts_packets(0x1000, pmt, counters)
+
+    frames = max(1, int(seconds * fps))
+    filler = bytes(max(0, payload_bytes // frames - 64))
+    for i in range(frames):
+        pts = start_pts + i * 90000 // fps
+        es = b'\x00\x00\x00\x01\x09\xf0'
+        if i == 0:
+            es += b'\x00\x00\x00\x01' + h264_sps(width, height) + b'\x00\x00\x00\x01\x68\xce\x38\x80'
+        es += b'\x00\x00\x00\x01\x65' + filler
+        packets += ts_packets(0x100, b'\x00\x00\x01\xe0\x00\x00\x80\x80\x05'
+                              + pes_timestamp(pts) + es, counters)
+        audio = b'\xff\xf1' + bytes(18)
+        packets += ts_packets(0x101, b'\x00\x00\x01\xc0' + struct.pack('>H', 8 + len(audio))
+                              + b'\x80\x80\x05' + pes_timestamp(pts) + audio, counters)
+    return b''.join(packets)
+
+# 가짜 b01-kr-naver-vod.pstatic.net
+class FakeCdn:
+    """토큰 검사, 지연/대역폭 제한/오류 주입을 하는 로컬 HLS 서버"""
+
+    def __init__(self, segments=30, segment_seconds=4.0, latency=0.02, bandwidth=None,
+                 error_rate=0.0, seed=1):
+        self.segments = segments
+        self.segment_seconds = segment_seconds
+        self.latency = latency
+        self.bandwidth = bandwidth
+        self.error_rate = error_rate
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.cache = {}
+        self.stats = {'requests': 0, 'bytes': 0, 'rejected': 0, 'errors': 0}
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), self._handler())
+        self.server.daemon_threads = True
+        self.base_url = f"http://127.0.0.1:{self.server.server_port}"
+
+    def start(self):
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def url(self, path, **query):
+        params = '&'.join(f"{k}={v}" for k, v in query.items())
+        return f"{self.base_url}/{path}?_lsu_sa_={TOKEN}" + (f"&{params}" if params else '')
+
+    def master_playlist(self):
+        lines = ['#EXTM3U', '#EXT-X-VERSION:3']
+        for name, (width, height, bandwidth) in VARIANTS.items():
+            lines.append(f'#EXT-X-STREAM-INF:BANDWIDTH={bandwidth},RESOLUTION={width}x{height}')
+            lines.append(f'{name}/index.m3u8')
+        return '\n'.join(lines) + '\n'
+
+    def media_playlist(self):
+        lines = ['#EXTM3U', '#EXT-X-VERSION:3', '#EXT-X-PLAYLIST-TYPE:VOD',
+                 f'#EXT-X-TARGETDURATION:{int(self.segment_seconds + 0.999)}',
+                 '#EXT-X-MEDIA-SEQUENCE:0']
+        for i in range(self.segments):
+            lines.append(f'#EXTINF:{self.segment_seconds:.3f},')
+            lines.append(f'seg{i}.ts')
+        lines.append('#EXT-X-ENDLIST')
+        return '\n'.join(lines) + '\n'
+
+    def segment(self, variant, index):
+        key = (variant, index)
+        with self.lock:
+            data = self.cache.get(key)
+        if data is None:
+            width, height, bandwidth = VARIANTS[variant]
+            data = ts_segment(width, height, index * int(self.segment_seconds * 90000),
+                              self.segment_seconds, int(bandwidth / 8 * self.segment_seconds))
+            with self.lock:
+                self.cache[key] = data
+        return data
+
+    def _handler(self):
+        cdn = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def log_message(self, format, *args):
+                pass
+
+            def _send(self, status, body=b'', content_type='application/octet-stream',
+                      content_range=None):
+                self.send_response(status)
+                self.send_header('Content-Type', content_type)
+                self.send_header('Content-Length', str(len(body)))
+                if content_range:
+                    self.send_header('Content-Range', content_range)
+                self.end_headers()
+                # 대역폭 제한: 연결마다 64KB씩 나눠 보내며 속도 조절
+                step = 64 * 1024
+                sent = 0
+                try:
+                    for pos in range(0, len(body), step):
+                        chunk = body[pos:pos + step]
+                        self.wfile.write(chunk)
+                        sent += len(chunk)
+                        if cdn.bandwidth:
+                            time.sleep(len(chunk) / cdn.bandwidth)
+                except (BrokenPipeError, ConnectionResetError):
+                    # 클라이언트가 다 읽지 않고 연결을 끊은 경우 (실제로 보낸 만큼만 셈)
+                    self.close_connection = True
+                finally:
+                    with cdn.lock:
+                        cdn.stats['bytes'] += sent
+
+            def _send_ok(self, body, content_type):
+                """Range 헤더가 있으면 그 부분만 206으로 보냄 (해상도 확인/검증용 부분 요청)"""
+                m = RANGE_RE.fullmatch(self.headers.get('Range', '').strip())
+                if not m or not (m.group(1) or m.group(2)):
+                    return self._send(200, body, content_type)
+                if m.group(1):
+                    start = int(m.group(1))
+                    end = min(int(m.group(2)), len(body) - 1) if m.group(2) else len(body) - 1
+                else:
+                    # bytes=-N: 마지막 N바이트
+                    start, end = max(0, len(body) - int(m.group(2))), len(body) - 1
+                if start >= len(body) or start > end:
+                    return self._send(416, content_range=f'bytes */{len(body)}')
+                return self._send(206, body[start:end + 1], content_type,
+                                  f'bytes {start}-{end}/{len(body)}')
+
+            def do_GET(self):
+                parsed = urlparse(self.path)
+                with cdn.lock:
+                    cdn.stats['requests'] += 1
+                    fail = cdn.random.random() < cdn.error_rate
+                if parse_qs(parsed.query).get('_lsu_sa_') != [TOKEN]:
+                    with cdn.lock:
+                        cdn.stats['rejected'] += 1
+                    return self._send(403, b'missing _lsu_sa_', 'text/plain')
+                if cdn.latency:
+                    time.sleep(cdn.latency)
+
+                parts = parsed.path.strip('/').split('/')
+                if parts[-1] == 'master.m3u8':
+                    return self._send_ok(cdn.master_playlist().encode(),
+                                      'application/vnd.apple.mpegurl')
+                if len(parts) >= 2 and parts[-2] in VARIANTS and parts[-1] == 'index.m3u8':
+                    return self._send_ok(cdn.media_playlist().encode(),
+                                      'application/vnd.apple.mpegurl')
+                if len(parts) >= 2 and parts[-2] in VARIANTS and parts[-1].startswith('seg'):
+                    index = int(parts[-1][3:].split('.')[0])
+                    if index >= cdn.segments:
+                        return self._send(404)
+                    if fail:
+                        with cdn.lock:
+                            cdn.stats['errors'] += 1
+                        # 절반은 503, 절반은 잘린 응답 (무결성 검사 경로 확인)
+                        if cdn.random.random() < 0.5:
+                            return self._send(503)
+                        return self._send(200, cdn.segment(parts[-2], index)[:-TS_PACKET // 2],
+                                          'video/mp2t')
+                    return self._send_ok(cdn.segment(parts[-2], index), 'video/mp2t')
+                return self._send(404)
+
+        return Handler
+
+def peak_rss_mb(who):
+    """최대 RSS (MB, resource 모듈이 없으면 None)"""
+    if resource is None:
+        return None
+    rss = resource.getrusage(who).ru_maxrss
+    # Linux는 KB, macOS는 바이트 단위
+    return rss / (1024 * 1024) if sys.platform == 'darwin' else rss / 1024
+
+def load_script(name, filename):
+    """하이픈이 들어간 스크립트 파일을 모듈로 로드"""
+    spec = importlib.util.spec_from_file_location(name, os.path.join(SCRIPT_DIR, filename))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+def bench_rewrite(segments, iterations):
+    """nvpcon 매니페스트 패치(토큰 추가/태그 URI 재작성)와 naver-dl 파서 비용"""
+    results = {}
+    lines = ['#EXTM3U', '#EXT-X-VERSION:6', '#EXT-X-TARGETDURATION:4',
+             '#EXT-X-MAP:URI="init.mp4"']
+    for i in range(segments):
+        if i % 100 == 0:
+            lines.append(f'#EXT-X-KEY:METHOD=AES-128,URI="key{i // 100}.bin",IV=0x{i:032x}')
+        lines.append('#EXTINF:4.000,')
+        lines.append(f'seg{i}.m4s')
+    lines.append('#EXT-X-ENDLIST')
+    playlist = '\n'.join(lines) + '\n'
+    base_url = f"https://b01-kr-naver-vod.pstatic.net/bench/720p/index.m3u8?_lsu_sa_={TOKEN}"
+    size_mb = len(playlist) / (1024 * 1024)
+
+    try:
+        nvpcon = load_script('nvpcon', 'nvpcon.py')
+    except ImportError as e:
+        print(f"  nvpcon 측정 건너뜀 (yt-dlp 필요: {e})")
+    else:
+        started = time.perf_counter()
+        for _ in range(iterations):
+            nvpcon.rewrite_playlist(playlist, base_url, TOKEN)
+        elapsed = (time.perf_counter() - started) / iterations
+        results['nvpcon_rewrite_ms'] = elapsed * 1000
+        results['nvpcon_rewrite_mb_s'] = size_mb / elapsed
+
+    naver_dl = load_script('naver_dl', 'naver-dl.py')
+    started = time.perf_counter()
+    for _ in range(iterations):
+        naver_dl.manifest_fingerprint(naver_dl.parse_m3u8(playlist, base_url))
+    elapsed = (time.perf_counter() - started) / iterations
+    results['parse_m3u8_ms'] = elapsed * 1000
+    results['parse_m3u8_mb_s'] = size_mb / elapsed
+    results['rewrite_peak_rss_mb'] = peak_rss_mb(resource.RUSAGE_SELF) if resource else None
+    return results
+
+def bench_pipeline(cdn, args):
+    """naver-dl --queue 로 다운로드 → 분석 → 선택까지 실행 (HOME은 임시 디렉터리로 격리)"""
+    m3u8_list = [cdn.url(f"bench/{name}/index.m3u8") for name in VARIANTS]
+    # 쿼리만 다른 중복 variant (매니페스트 지문으로 걸러져야 함)
+    m3u8_list += [cdn.url(f"bench/{name}/index.m3u8", dup=i)
+                  for i, name in enumerate(list(VARIANTS)[:args.duplicates], 1)]
+    job = {'title': 'bench', 'referer': cdn.base_url + '/', 'm3u8_list': m3u8_list}
+
+    with tempfile.TemporaryDirectory(prefix='naver-bench-') as work_dir:
+        jobs_file = os.path.join(work_dir, 'jobs.jsonl')
+        metrics_file = os.path.join(work_dir, 'naver-dl.prom')
+        with open(jobs_file, 'w', encoding='utf-8') as f:
+            f.write(json.dumps(job, ensure_ascii=False) + '\n')
+        cmd = [sys.executable, os.path.join(SCRIPT_DIR, 'naver-dl.py'),
+               '--queue', jobs_file, '--engine', 'native', '--no-journal',
+               '--rate-limit', '0', '-j', str(args.concurrency),
+               # 메트릭 기록 경로도 함께 실행해 시작/종료 시 오류가 없는지 확인
+               '--metrics-file', metrics_file]
+        if args.stream_remux:
+            cmd.append('--stream-remux')
+        env = dict(os.environ, HOME=work_dir, USERPROFILE=work_dir, APPDATA=work_dir)
+
+        bytes_before = cdn.stats['bytes']
+        started = time.perf_counter()
+        result = subprocess.run(cmd, cwd=work_dir, env=env, capture_output=True,
+                                text=True, encoding='utf-8', errors='replace')
+        elapsed = time.perf_counter() - started
+        served = cdn.stats['bytes'] - bytes_before
+
+        # ffmpeg가 없으면 remux하지 않은 MPEG-TS가 .ts로 남음
+        final_file = os.path.join(work_dir, 'bench.mp4' if shutil.which('ffmpeg') else 'bench.ts')
+        ok = result.returncode == 0 and os.path.exists(final_file)
+        if not ok:
+            print(result.stdout[-2000:])
+            print(result.stderr[-2000:])
+        try:
+            with open(metrics_file, 'r', encoding='utf-8') as f:
+                metrics_ok = 'naver_dl_downloaded_bytes' in f.read()
+        except OSError:
+            metrics_ok = False
+        return {
+            'pipeline_ok': ok,
+            'metrics_ok': metrics_ok,
+            'pipeline_seconds': elapsed,
+            'pipeline_mb': served / (1024 * 1024),
+            'pipeline_mb_s': served / (1024 * 1024) / elapsed,
+            'final_size_mb': os.path.getsize(final_file) / (1024 * 1024) if ok else None,
+            'pipeline_peak_rss_mb': peak_rss_mb(resource.RUSAGE_CHILDREN) if resource else None,
+        }
+
+# 회귀 판단: 값이 클수록 좋은 항목과 작을수록 좋은 항목
+HIGHER_IS_BETTER = ('nvpcon_rewrite_mb_s', 'parse_m3u8_mb_s', 'pipeline_mb_s')
+LOWER_IS_BETTER = ('pipeline_peak_rss_mb', 'rewrite_peak_rss_mb')
+
+def compare(results, baseline, tolerance):
+    """기준 결과보다 tolerance 이상 나빠진 항목 목록"""
+    regressions = []
+    for key in HIGHER_IS_BETTER + LOWER_IS_BETTER:
+        old, new = baseline.get(key), results.get(key)
+        if not old or new is None:
+            continue
+        change = (new - old) / old
+        worse = -change if key in HIGHER_IS_BETTER else change
+        if worse > tolerance:
+            regressions.append(f"{key}: {old:.2f} → {new:.2f} ({change:+.0%})")
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='가짜 네이버 VOD 서버로 nvpcon/naver-dl 성능 측정',
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        epilog="""
+사용 예시:
+  naver-bench                               # 기본 설정으로 측정
+  naver-bench --latency 50 --bandwidth 4M   # 느린 CDN 흉내
+  naver-bench --error-rate 0.05             # 세그먼트 5%에 503/잘린 응답
+  naver-bench --json out.json               # 결과 저장
+  naver-bench --compare base.json           # 기준보다 20% 이상 나빠지면 실패(종료 코드 1)
+        """
+    )
+    parser.add_argument('--segments', type=int, default=30, metavar='N',
+                        help='variant당 세그먼트 수 (기본: 30)')
+    parser.add_argument('--segment-seconds', type=float, default=4.0, metavar='SEC',
+                        help='세그먼트 길이 (기본: 4)')
+    parser.add_argument('--latency', type=float, default=20, metavar='MS',
+                        help='요청마다 추가할 지연 (기본: 20ms)')
+    parser.add_argument('--bandwidth', metavar='RATE',
+                        help='연결당 대역폭 제한 (예: 4M, 500K)')
+    parser.add_argument('--error-rate', type=float, default=0.0, metavar='P',
+                        help='세그먼트 요청 중 오류를 낼 비율 (기본: 0)')
+    parser.add_argument('--duplicates', type=int, default=2, metavar='N',
+                        help='쿼리만 다른 중복 variant 수 (기본: 2)')
+    parser.add_argument('--concurrency', '-j', type=int, default=3, metavar='N',
+                        help='naver-dl 동시 다운로드 수 (기본: 3)')
+    parser.add_argument('--stream-remux', action='store_true',
+                        help='naver-dl을 --stream-remux로 실행 (ffmpeg 필요)')
+    parser.add_argument('--rewrite-segments', type=int, default=5000, metavar='N',
+                        help='매니페스트 재작성 측정에 쓸 세그먼트 수 (기본: 5000)')
+    parser.add_argument('--iterations', type=int, default=20, metavar='N',
+                        help='매니페스트 재작성 반복 횟수 (기본: 20)')
+    parser.add_argument('--json', metavar='FILE', help='결과를 JSON으로 저장')
+    parser.add_argument('--compare', metavar='FILE', help='기준 결과 JSON과 비교')
+    parser.add_argument('--tolerance', type=float, default=0.2,
+                        help='회귀로 볼 악화 비율 (기본: 0.2)')
+    args = parser.parse_args()
+
+    bandwidth = None
+    if args.bandwidth:
+        bandwidth = load_script('naver_dl', 'naver-dl.py').parse_rate(args.bandwidth)
+
+    print("매니페스트 재작성 측정 중...")
+    results = bench_rewrite(args.rewrite_segments, args.iterations)
+
+    print("전체 파이프라인 측정 중...")
+    cdn = FakeCdn(args.segments, args.segment_seconds, args.latency / 1000, bandwidth,
+                  args.error_rate).start()
+    try:
+        results.update(bench_pipeline(cdn, args))
+    finally:
+        cdn.stop()
+    results.update({f"cdn_{k}": v for k, v in cdn.stats.items()})
+
+    print("\n" + "=" * 50)
+    for key, value in results.items():
+        shown = f"{value:.2f}" if isinstance(value, float) else value
+        print(f"  {key:<26} {shown}")
+    print("=" * 50)
+
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=2)
+
+    failed = not results.get('pipeline_ok') or not results.get('metrics_ok')
+    if args.compare:
+        with open(args.compare, 'r', encoding='utf-8') as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        for line in regressions:
+            print(f"  [회귀] {line}")
+        failed = failed or bool(regressions)
+    sys.exit(1 if failed else 0)
+
+if __name__ == "__main__":
+    try:
+        main()
+    except KeyboardInterrupt:
+        print("\n\n중단되었습니다.")
+        sys.exit(0)
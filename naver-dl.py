@@ -5,12 +5,60 @@ import subprocess
 import os
 import sys
 import json
+import mmap
 import re
+import struct
 import argparse
+import atexit
+import base64
+import collections
+import contextlib
+import filecmp
+import glob
+import hashlib
+import hmac
+import http.client
 import platform
+import shutil
+import socket
+import socketserver
+import sqlite3
+import tempfile
+import threading
+import time
+import unicodedata
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from http.cookiejar import MozillaCookieJar
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
 from pathlib import Path
+from urllib.parse import urlparse, parse_qs, urljoin, unquote, unquote_to_bytes
+
+# 쿠키 캐시, 속도 제한, 공유 큐, 메트릭 기록은 yt-dl.py와 공유 (같은 디렉터리의 dlcommon.py)
+from dlcommon import (
+    DEFAULT_REQUEST_RATE, QUEUE_MAX_ATTEMPTS, QUEUE_POLL_INTERVAL, HostRateLimiter,
+    LeaseLost, MetricsExporter, SharedQueue, StreamMeter, copy_cookie_file,
+    get_cached_cookie_file, parse_rate, private_cookie_file, write_atomic,
+)
 
 DEFAULT_COOKIE_FILE = os.path.expanduser("~/.naver_cookies.txt")
+STATE_DIR = os.path.expanduser("~/.naver-dl")
+JOURNAL_FILE = os.path.join(STATE_DIR, "journal.sqlite")
+LIBRARY_FILE = os.path.join(STATE_DIR, "library.sqlite")
+MEDIA_HASH_SAMPLE = 1024 * 1024  # 미디어 해시에 쓸 앞/가운데/끝 구간 크기
+DEFAULT_CONCURRENCY = 3     # 작업 하나 안에서 동시에 받을 variant 수
+DEFAULT_MAX_DOWNLOADS = 6   # 모든 작업을 합친 동시 다운로드 상한
+DEFAULT_SERVE_ADDRESS = "127.0.0.1:8765"
+DEFAULT_WORKERS = 2         # 데몬에서 동시에 처리할 작업 수
+KEEP_FINISHED_JOBS = 100    # 데몬이 상태를 기억할 끝난 작업 수 (오래된 것부터 버림)
+USER_AGENT = "Mozilla/5.0 (Macintosh; Intel Mac OS X 10.15; rv:146.0) Gecko/20100101 Firefox/146.0"
+HTTP_TIMEOUT = 15
+PROBE_BYTES = 512 * 1024    # 해상도 확인용으로 첫 세그먼트에서 읽을 크기
+VALIDATE_TIMEOUT = 5        # 다운로드 전 검증 요청 하나의 제한 시간(초)
+
+# 전체 작업 공통 다운로드 슬롯
+_download_slots = threading.BoundedSemaphore(DEFAULT_MAX_DOWNLOADS)
 
 def get_clipboard():
     """클립보드 내용 읽기"""
@@ -25,19 +73,27 @@ def get_clipboard():
             return result.stdout
     return None
 
+def store_imported_cookies(content):
+    """가져온 Netscape 쿠키를 naver-dl 쿠키 파일에 저장 (만료된 쿠키만 빼고, Firefox 캐시와는 별도)"""
+    now = time.time()
+    lines = []
+    for line in content.splitlines():
+        fields = line.split('\t')
+        # '#HttpOnly_'로 시작하는 줄은 주석이 아니라 HttpOnly 쿠키
+        is_cookie = len(fields) == 7 and (not line.startswith('#') or line.startswith('#HttpOnly_'))
+        if is_cookie and fields[4].isdigit() and 0 < int(fields[4]) < now:
+            continue
+        lines.append(line + '\n')
+    write_atomic(DEFAULT_COOKIE_FILE, ''.join(lines), mode=0o600)
+
 def export_cookies():
     """Firefox에서 쿠키를 추출하여 파일로 저장"""
     print(f"Firefox에서 쿠키를 추출합니다...")
-    cmd = [
-        "yt-dlp",
-        "--cookies-from-browser", "firefox",
-        "--cookies", DEFAULT_COOKIE_FILE,
-        "--skip-download",
-        "https://naver.com/"
-    ]
-    result = subprocess.run(cmd, capture_output=True, text=True)
+    cache_file = get_cached_cookie_file(refresh=True)
 
-    if os.path.exists(DEFAULT_COOKIE_FILE):
+    if cache_file:
+        with open(cache_file, 'r', encoding='utf-8') as f:
+            write_atomic(DEFAULT_COOKIE_FILE, f.read(), mode=0o600)
         size = os.path.getsize(DEFAULT_COOKIE_FILE)
         print(f"쿠키 파일 저장됨: {DEFAULT_COOKIE_FILE} ({size} bytes)")
         return True
@@ -65,27 +121,490 @@ def import_cookies():
         if input().strip().lower() != 'y':
             return False
 
-    with open(DEFAULT_COOKIE_FILE, 'w', encoding='utf-8') as f:
-        f.write(content)
-        if not content.endswith('\n'):
-            f.write('\n')
+    store_imported_cookies(content)
 
     print(f"\n쿠키 파일 저장됨: {DEFAULT_COOKIE_FILE}")
     return True
 
-def download_url(url, index, total, referer, output_dir, cookie_file=None):
-    """단일 URL 다운로드"""
-    from urllib.parse import urlparse
+# 구간별 시간 기록 (--trace): Chrome/Perfetto에서 열 수 있는 trace JSON
+class Tracer:
+    """구간(span)을 Chrome trace 이벤트로 모으고 실행이 끝나면 요약 표 출력"""
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.events = []
+        self.threads = {}
+        self.origin = time.perf_counter()
+
+    def _tid(self):
+        ident = threading.get_ident()
+        if ident not in self.threads:
+            self.threads[ident] = len(self.threads) + 1
+            self.events.append({'name': 'thread_name', 'ph': 'M', 'pid': os.getpid(),
+                                'tid': self.threads[ident],
+                                'args': {'name': threading.current_thread().name}})
+        return self.threads[ident]
+
+    def add(self, name, cat, start, end, args=None):
+        """perf_counter 기준 [start, end] 구간 기록"""
+        with self.lock:
+            self.events.append({
+                'name': name, 'cat': cat, 'ph': 'X', 'pid': os.getpid(), 'tid': self._tid(),
+                'ts': round((start - self.origin) * 1e6),
+                'dur': round((end - start) * 1e6),
+                'args': args or {},
+            })
+
+    def save(self):
+        with self.lock:
+            content = json.dumps({'traceEvents': self.events, 'displayTimeUnit': 'ms'},
+                                 ensure_ascii=False)
+        write_atomic(self.path, content)
+
+    def summary(self):
+        """구간 이름별 횟수/합계/평균/최대 표"""
+        stats = {}
+        with self.lock:
+            for event in self.events:
+                if event['ph'] != 'X':
+                    continue
+                count, total, longest = stats.get(event['name'], (0, 0, 0))
+                stats[event['name']] = (count + 1, total + event['dur'],
+                                        max(longest, event['dur']))
+        lines = [f"{'구간':<16}{'횟수':>4}{'합계':>10}{'평균':>10}{'최대':>10}"]  # 한글은 두 칸
+        for name, (count, total, longest) in sorted(stats.items(), key=lambda x: -x[1][1]):
+            lines.append(f"{name:<18}{count:>6}{total / 1e6:>11.2f}s"
+                         f"{total / count / 1e6:>11.3f}s{longest / 1e6:>11.2f}s")
+        wall = time.perf_counter() - self.origin
+        lines.append(f"전체 실행 시간 {wall:.2f}s (동시에 실행된 구간은 합계가 더 클 수 있음)")
+        return '\n'.join(lines)
+
+_tracer = None
+
+@contextlib.contextmanager
+def trace_span(name, cat='phase', **args):
+    """--trace일 때만 구간 기록 (yield한 dict에 넣은 값은 이벤트 args로 저장)"""
+    tracer = _tracer
+    if tracer is None:
+        yield args
+        return
+    start = time.perf_counter()
+    try:
+        yield args
+    finally:
+        tracer.add(name, cat, start, time.perf_counter(), args)
+
+def finish_trace():
+    """trace 파일 저장 후 요약 표 출력"""
+    if _tracer is None:
+        return
+    _tracer.save()
+    print(f"\n구간별 시간 (trace: {_tracer.path})")
+    print(_tracer.summary())
+
+# 작업 저널: 작업/variant/완료된 HLS 프래그먼트를 기록해 재실행 시 이어받기
+def url_key(url):
+    """토큰이 바뀌어도 같은 리소스를 가리키도록 쿼리를 뺀 URL"""
     parsed = urlparse(url)
-    base_name = os.path.splitext(os.path.basename(parsed.path))[0]
-    output_file = os.path.join(output_dir, f"download_{index:02d}_{base_name[:8]}.mp4")
+    return f"{parsed.netloc}{parsed.path}"
+
+class Journal:
+    """SQLite 작업 저널 (스레드 간 공유)"""
+
+    SCHEMA = """
+    CREATE TABLE IF NOT EXISTS jobs (
+        job_id TEXT PRIMARY KEY,
+        title TEXT,
+        status TEXT,
+        final_path TEXT,
+        updated_at REAL
+    );
+    CREATE TABLE IF NOT EXISTS variants (
+        job_id TEXT,
+        url_key TEXT,
+        position INTEGER,
+        output_file TEXT,
+        status TEXT,
+        updated_at REAL,
+        PRIMARY KEY (job_id, url_key)
+    );
+    CREATE TABLE IF NOT EXISTS fragments (
+        job_id TEXT,
+        url_key TEXT,
+        idx INTEGER,
+        byte_offset INTEGER,
+        size INTEGER,
+        sha256 TEXT,
+        PRIMARY KEY (job_id, url_key, idx)
+    );
+    """
+
+    def __init__(self, path=JOURNAL_FILE):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript(self.SCHEMA)
+        columns = [row[1] for row in self.conn.execute("PRAGMA table_info(fragments)")]
+        if 'sha256' not in columns:
+            # 체크섬 열이 없던 이전 저널
+            self.conn.execute("ALTER TABLE fragments ADD COLUMN sha256 TEXT")
+            self.conn.commit()
+
+    def _execute(self, sql, params=()):
+        with self.lock:
+            rows = self.conn.execute(sql, params).fetchall()
+            self.conn.commit()
+            return rows
+
+    @staticmethod
+    def job_id(title, m3u8_list):
+        """제목과 (토큰 제외) m3u8 경로로 만든 작업 ID"""
+        h = hashlib.sha1(title.encode())
+        for key in sorted(url_key(u) for u in m3u8_list):
+            h.update(key.encode())
+        return h.hexdigest()[:16]
+
+    def get_job(self, job_id):
+        rows = self._execute(
+            "SELECT status, final_path FROM jobs WHERE job_id = ?", (job_id,))
+        return {'status': rows[0][0], 'final_path': rows[0][1]} if rows else None
+
+    def start_job(self, job_id, title):
+        self._execute(
+            "INSERT INTO jobs (job_id, title, status, updated_at) VALUES (?, ?, 'running', ?) "
+            "ON CONFLICT(job_id) DO UPDATE SET status = 'running', updated_at = excluded.updated_at",
+            (job_id, title, time.time()))
+
+    def finish_job(self, job_id, final_path, status='done'):
+        self._execute(
+            "UPDATE jobs SET status = ?, final_path = ?, updated_at = ? WHERE job_id = ?",
+            (status, final_path, time.time(), job_id))
+
+    def reset_job(self, job_id):
+        """저널 기록을 지우고 처음부터 다시 받기"""
+        for table in ('jobs', 'variants', 'fragments'):
+            self._execute(f"DELETE FROM {table} WHERE job_id = ?", (job_id,))
+
+    def planned_variants(self, job_id):
+        """이전 실행에서 고른 variant들의 url_key (순서대로)"""
+        rows = self._execute(
+            "SELECT url_key FROM variants WHERE job_id = ? ORDER BY position", (job_id,))
+        return [r[0] for r in rows]
+
+    def plan_variants(self, job_id, urls):
+        for position, url in enumerate(urls, 1):
+            self._execute(
+                "INSERT OR IGNORE INTO variants (job_id, url_key, position, status, updated_at) "
+                "VALUES (?, ?, ?, 'pending', ?)",
+                (job_id, url_key(url), position, time.time()))
+
+    def get_variant(self, job_id, url):
+        rows = self._execute(
+            "SELECT status, output_file FROM variants WHERE job_id = ? AND url_key = ?",
+            (job_id, url_key(url)))
+        return {'status': rows[0][0], 'output_file': rows[0][1]} if rows else None
+
+    def mark_variant(self, job_id, url, status, output_file=None):
+        self._execute(
+            "UPDATE variants SET status = ?, output_file = COALESCE(?, output_file), "
+            "updated_at = ? WHERE job_id = ? AND url_key = ?",
+            (status, output_file, time.time(), job_id, url_key(url)))
+
+    def record_fragment(self, job_id, url, idx, byte_offset, size, sha256=None):
+        self._execute(
+            "INSERT OR REPLACE INTO fragments (job_id, url_key, idx, byte_offset, size, sha256) "
+            "VALUES (?, ?, ?, ?, ?, ?)",
+            (job_id, url_key(url), idx, byte_offset, size, sha256))
+
+    def fragment_digest(self, job_id, url, idx):
+        """기록된 프래그먼트의 SHA-256 (없으면 None)"""
+        rows = self._execute(
+            "SELECT sha256 FROM fragments WHERE job_id = ? AND url_key = ? AND idx = ?",
+            (job_id, url_key(url), idx))
+        return rows[0][0] if rows else None
+
+    def clear_fragments(self, job_id, url):
+        self._execute(
+            "DELETE FROM fragments WHERE job_id = ? AND url_key = ?",
+            (job_id, url_key(url)))
+
+    def completed_fragments(self, job_id, url):
+        """완료된 프래그먼트 {idx: (byte_offset, size)}"""
+        rows = self._execute(
+            "SELECT idx, byte_offset, size FROM fragments WHERE job_id = ? AND url_key = ?",
+            (job_id, url_key(url)))
+        return {idx: (offset, size) for idx, offset, size in rows}
+
+# 라이브러리 색인: 이미 받은 영상을 제목/매니페스트 지문/미디어 해시로 찾기
+def media_hash(path, sample=MEDIA_HASH_SAMPLE):
+    """파일 크기와 앞/가운데/끝 구간으로 만든 해시 (큰 파일도 전부 읽지 않음)"""
+    size = os.path.getsize(path)
+    h = hashlib.sha256(str(size).encode())
+    with open(path, 'rb') as f:
+        for offset in sorted({0, max(0, size // 2 - sample // 2), max(0, size - sample)}):
+            f.seek(offset)
+            h.update(f.read(sample))
+    return h.hexdigest()
+
+class Library:
+    """받은 파일 색인 (SQLite, 키마다 인덱스가 있어 디렉터리를 다시 훑지 않음)
+
+    파일을 옮기거나 지우면 조회할 때 크기/수정 시각으로 알아채고 그 항목만 지웁니다.
+    """
+
+    SCHEMA = """
+    CREATE TABLE IF NOT EXISTS files (
+        path TEXT PRIMARY KEY,
+        media_hash TEXT,
+        size INTEGER,
+        mtime REAL,
+        added_at REAL
+    );
+    CREATE INDEX IF NOT EXISTS files_media ON files (media_hash);
+    CREATE TABLE IF NOT EXISTS titles (
+        title_key TEXT PRIMARY KEY,
+        path TEXT
+    );
+    CREATE TABLE IF NOT EXISTS fingerprints (
+        fingerprint TEXT PRIMARY KEY,
+        path TEXT
+    );
+    """
+
+    def __init__(self, path=LIBRARY_FILE):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript(self.SCHEMA)
+
+    def _execute(self, sql, params=()):
+        with self.lock:
+            rows = self.conn.execute(sql, params).fetchall()
+            self.conn.commit()
+            return rows
+
+    @staticmethod
+    def title_key(title):
+        """저장 파일명과 같은 규칙으로 정리한 제목 (NFC/NFD, 대소문자 차이 무시)"""
+        return unicodedata.normalize('NFC', sanitize_filename(title)).casefold()
+
+    def _existing(self, rows):
+        """아직 그대로 있는 첫 파일 경로 (바뀐 항목은 색인에서 제거)"""
+        for path, size, mtime in rows:
+            try:
+                st = os.stat(path)
+                if st.st_size == size and abs(st.st_mtime - mtime) < 1:
+                    return path
+            except OSError:
+                pass
+            self.remove(path)
+        return None
 
-    print(f"\n[{index}/{total}] 다운로드 중...")
+    def _find(self, table, column, value):
+        return self._existing(self._execute(
+            f"SELECT f.path, f.size, f.mtime FROM {table} k "
+            f"JOIN files f ON f.path = k.path WHERE k.{column} = ?", (value,)))
+
+    def find_title(self, title):
+        return self._find('titles', 'title_key', self.title_key(title))
+
+    def find_fingerprint(self, fingerprint):
+        return self._find('fingerprints', 'fingerprint', fingerprint)
+
+    def find_media(self, digest):
+        return self._existing(self._execute(
+            "SELECT path, size, mtime FROM files WHERE media_hash = ?", (digest,)))
+
+    def add(self, path, title, digest, fingerprints=()):
+        """파일 하나와 그 파일을 가리키는 제목/지문 등록 (같은 파일에 여러 제목 가능)"""
+        path = os.path.abspath(path)
+        st = os.stat(path)
+        self._execute(
+            "INSERT OR REPLACE INTO files (path, media_hash, size, mtime, added_at) "
+            "VALUES (?, ?, ?, ?, ?)",
+            (path, digest, st.st_size, st.st_mtime, time.time()))
+        self._execute(
+            "INSERT OR REPLACE INTO titles (title_key, path) VALUES (?, ?)",
+            (self.title_key(title), path))
+        for fingerprint in fingerprints:
+            self._execute(
+                "INSERT OR REPLACE INTO fingerprints (fingerprint, path) VALUES (?, ?)",
+                (fingerprint, path))
+
+    def remove(self, path):
+        for table in ('titles', 'fingerprints', 'files'):
+            self._execute(f"DELETE FROM {table} WHERE path = ?", (path,))
+
+_library = None
+
+def add_to_library(path, title, fingerprints=(), keep_duplicate=False):
+    """받은 파일을 색인에 추가하고 최종 경로 반환
+
+    내용이 같은 파일이 이미 있으면 새 복사본을 지우고 기존 파일을 이 제목에도 연결합니다.
+    media_hash는 일부 구간만 보므로 지우기 전에 전체 내용을 비교하고, 다르면 둘 다 남깁니다.
+    """
+    digest = media_hash(path)
+    existing = _library.find_media(digest)
+    if existing and existing != os.path.abspath(path) and not keep_duplicate:
+        if filecmp.cmp(existing, path, shallow=False):
+            os.remove(path)
+            print(f"같은 내용의 파일이 이미 있어 새 파일을 지웠습니다: {existing}")
+            path = existing
+        else:
+            print(f"샘플 해시만 같고 내용은 다른 파일이 있어 둘 다 보관합니다: {existing}")
+    _library.add(path, title, digest, fingerprints)
+    return path
+
+# 호스트별 속도 제한: 모든 naver-dl/yt-dl 프로세스가 파일 잠금으로 공유하는 토큰 버킷 (dlcommon)
+_rate_limiter = HostRateLimiter()
+
+def set_rate_limits(request_rate=DEFAULT_REQUEST_RATE, bandwidth=None):
+    """모든 다운로드 경로가 공유하는 호스트별 한도 설정 (0/None은 제한 없음)"""
+    _rate_limiter.request_rate = request_rate or None
+    _rate_limiter.bandwidth = bandwidth or None
+
+# 진행 이벤트: 모든 엔진이 같은 필드(바이트, 조각, 순간/평균 속도, 재시도, ETA)로 보고
+PROGRESS_PREFIX = "[naver-dl] "
+YTDLP_RETRY_RE = re.compile(r'Retrying|재시도')
+YTDLP_LOG_LINES = 50        # 실패 시 보여줄 yt-dlp 출력 (최근 줄만 보관)
+
+_progress_targets = {}
+_progress_lock = threading.Lock()
+_progress_listeners = []
+_queue_leases = {}          # 공유 큐 워커가 처리 중인 작업 ID → QueueLease
+
+def check_lease(job_id):
+    """공유 큐에서 임대한 작업인데 임대를 잃었으면 LeaseLost (다른 노드가 이어받음)"""
+    lease = _queue_leases.get(job_id)
+    if lease:
+        lease.check()
+
+def report_progress(job_id, **fields):
+    """작업 진행 상황을 등록된 리스너(데몬 상태, 메트릭 파일 등)에 전달"""
+    for listener in list(_progress_listeners):
+        listener(job_id, fields)
+
+def variant_metrics_listener(exporter):
+    """variant별 진행 이벤트만 메트릭 파일로 전달하는 진행 리스너"""
+    def listener(job_id, fields):
+        if fields.get('variant') is not None:
+            exporter.on_progress((job_id or '', fields['variant']), fields)
+    return listener
+
+def new_progress_target(url, index, total, journal=None, job_id=None, start_bytes=None):
+    """다운로드 하나의 진행 상태 (저널을 넘기면 yt-dlp 프래그먼트를 기록)"""
+    done_fragments = journal.completed_fragments(job_id, url) if journal else {}
+    fragment_end = sum(size for _, size in done_fragments.values())
+    now = time.monotonic()
+    return {
+        'index': index, 'total': total, 'last_report': 0, 'last_event': 0,
+        'journal': journal, 'job_id': job_id, 'url': url,
+        'fragment': len(done_fragments) + 1,
+        'fragment_end': fragment_end,
+        'charged_bytes': 0, 'retries': 0,
+        # 이어받은 만큼은 평균 속도에서 제외
+        'started': now, 'start_bytes': fragment_end if start_bytes is None else start_bytes,
+        'last_time': now, 'last_bytes': fragment_end if start_bytes is None else start_bytes,
+    }
 
-    cmd = [
-        "yt-dlp",
-        "--enable-file-urls",
-    ]
+def show_progress(target, d):
+    """yt-dlp 형식의 진행 dict를 저널/진행 이벤트(1초)/콘솔(5초)로 전달"""
+    check_lease(target['job_id'])
+    status = d.get('status')
+    done = d.get('downloaded_bytes') or 0
+    with _progress_lock:
+        record_fragment_progress(target, d)
+        target['fragment_count'] = d.get('fragment_count') or target.get('fragment_count')
+        if _tracer and target.get('trace_start'):
+            # yt-dlp 엔진은 첫 진행 이벤트까지를 추출(매니페스트 받기/패치) 구간으로 봄
+            _tracer.add('extract', 'download', target.pop('trace_start'), time.perf_counter(),
+                        {'variant': target['index']})
+        now = time.monotonic()
+        if status == 'downloading' and now - target['last_event'] < 1:
+            return
+        target['last_event'] = now
+        speed = d.get('speed')
+        if speed is None and now > target['last_time']:
+            speed = max(0, done - target['last_bytes']) / (now - target['last_time'])
+        target['last_time'] = now
+        target['last_bytes'] = done
+        elapsed = now - target['started']
+        average = max(0, done - target['start_bytes']) / elapsed if elapsed > 0 else None
+        retries = target['retries']
+        show = status != 'downloading' or now - target['last_report'] >= 5
+        if show:
+            target['last_report'] = now
+
+    total = d.get('total_bytes') or d.get('total_bytes_estimate')
+    eta = d.get('eta')
+    if eta is None and total and speed:
+        eta = max(0, total - done) / speed
+    label = f"  [{target['index']}/{target['total']}]"
+
+    if status == 'finished':
+        report_progress(target['job_id'], variant=target['index'], downloaded_bytes=done,
+                        total_bytes=total or done, fragment_index=target['fragment_count'],
+                        speed=0, average_speed=average, retries=retries, eta=0)
+        print(f"{label} 받기 완료 ({format_size(total or done)})")
+        return
+    if status != 'downloading':
+        return
+    report_progress(target['job_id'], variant=target['index'], downloaded_bytes=done,
+                    total_bytes=total, fragment_index=d.get('fragment_index'),
+                    fragment_count=d.get('fragment_count'), speed=speed,
+                    average_speed=average, retries=retries, eta=eta)
+    if not show:
+        return
+
+    percent = f"{done * 100 / total:.1f}%" if total else format_size(done)
+    parts = [percent, f"{format_size(speed)}/s" if speed else "-"]
+    if average:
+        parts[-1] += f" (평균 {format_size(average)}/s)"
+    if d.get('fragment_count'):
+        parts.append(f"조각 {d.get('fragment_index') or 0}/{d['fragment_count']}")
+    if d.get('concurrency'):
+        parts.append(f"동시 {d['concurrency']}")
+    if retries:
+        parts.append(f"재시도 {retries}")
+    parts.append(f"남은 시간 {format_duration(eta) if eta else '-'}")
+    print(f"{label} {' | '.join(parts)}")
+
+def count_retry(target):
+    with _progress_lock:
+        target['retries'] += 1
+
+def record_fragment_progress(target, d):
+    """프래그먼트 번호가 바뀔 때 완료된 프래그먼트를 저널에 기록"""
+    journal = target.get('journal')
+    frag = d.get('fragment_index')
+    if not journal or frag is None:
+        return
+    done = d.get('downloaded_bytes') or 0
+    while target['fragment'] < frag:
+        offset = target['fragment_end']
+        journal.record_fragment(target['job_id'], target['url'], target['fragment'],
+                                offset, max(0, done - offset))
+        target['fragment'] += 1
+        target['fragment_end'] = max(offset, done)
+
+def run_ytdlp_subprocess(url, output_file, referer, cookie_file=None,
+                         index=1, total=1, journal=None, job_id=None):
+    """yt-dlp 프로세스로 다운로드 (성공 여부 반환)"""
+    target = new_progress_target(url, index, total, journal, job_id)
+    target['trace_start'] = time.perf_counter()
+    _rate_limiter.acquire(url)
+    # yt-dlp가 끝날 때 쿠키 파일에 다시 저장하므로 공유 캐시/쿠키 파일 대신 사본을 넘김
+    with private_cookie_file(cookie_file) as cookie_copy:
+        return _run_ytdlp_subprocess(url, output_file, referer, cookie_copy,
+                                     StreamMeter(_rate_limiter, url), target)
+
+def _run_ytdlp_subprocess(url, output_file, referer, cookie_file, meter, target):
+    cmd = ["yt-dlp"]
 
     if cookie_file and os.path.exists(cookie_file):
         cmd.extend(["--cookies", cookie_file])
@@ -94,32 +613,1471 @@ def download_url(url, index, total, referer, output_dir, cookie_file=None):
 
     cmd.extend([
         "--referer", referer,
-        "--user-agent", "Mozilla/5.0 (Macintosh; Intel Mac OS X 10.15; rv:146.0) Gecko/20100101 Firefox/146.0",
-        "--no-part",
+        "--user-agent", USER_AGENT,
+        "--continue",           # .part/.ytdl로 중단된 프래그먼트부터 이어받기
         "--restrict-filenames",
         "-N", "4",
+        # 진행 상황을 한 줄에 JSON 하나씩 받아 바로 처리
+        "--newline", "--progress",
+        "--progress-template", f"download:{PROGRESS_PREFIX}%(progress)j",
         "-o", output_file,
-        url
     ])
+    if meter.limit_rate():
+        cmd.extend(["--limit-rate", str(meter.limit_rate())])
+    cmd.append(url)
 
-    result = subprocess.run(cmd, capture_output=True, text=True)
+    log = collections.deque(maxlen=YTDLP_LOG_LINES)
+    try:
+        proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+                                text=True, encoding='utf-8', errors='replace')
+    except OSError as e:
+        print(f"  [{target['index']}/{target['total']}] yt-dlp 실행 실패: {e}")
+        return False
+    meter.attach(proc.stdout)
+    with proc:
+        try:
+            for line in proc.stdout:
+                line = line.rstrip()
+                if line.startswith(PROGRESS_PREFIX):
+                    try:
+                        d = json.loads(line[len(PROGRESS_PREFIX):])
+                    except ValueError:
+                        continue
+                    # 같은 호스트의 다른 다운로드와 한도를 나눠 씀 (기다리는 동안 yt-dlp도 멈춤)
+                    meter.update(d)
+                    show_progress(target, d)
+                    continue
+                if YTDLP_RETRY_RE.search(line):
+                    count_retry(target)
+                log.append(line)
+        except LeaseLost:
+            proc.kill()
+            raise
+
+    if proc.returncode != 0:
+        for line in list(log)[-5:]:
+            print(f"  [{target['index']}/{target['total']}] {line}")
+    return proc.returncode == 0
+
+# 인프로세스 엔진: YoutubeDL 인스턴스를 풀로 두고 배치(데몬이면 프로세스) 내내 재사용
+_ydl_idle = {}
+
+def ytdlp_progress_hook(d):
+    """yt-dlp 진행 상황 훅"""
+    with _progress_lock:
+        target = _progress_targets.get(d.get('filename'))
+        if target is None:
+            return
+        done = d.get('downloaded_bytes') or 0
+        received = done - target['charged_bytes']
+        target['charged_bytes'] = max(done, target['charged_bytes'])
+    # 훅은 다운로드 스레드에서 불리므로 여기서 기다리면 그만큼 속도가 제한됨
+    _rate_limiter.consume(target['url'], received)
+    show_progress(target, d)
+
+class RetryLogger:
+    """YoutubeDL 로거: 재시도 경고를 세어 빌려 쓰는 중인 다운로드의 진행 이벤트에 포함"""
+
+    def __init__(self):
+        self.target = None
+
+    def debug(self, msg):
+        pass
+
+    def info(self, msg):
+        pass
+
+    def warning(self, msg):
+        if self.target and YTDLP_RETRY_RE.search(msg):
+            count_retry(self.target)
+
+    def error(self, msg):
+        print(f"  {msg}")
+
+@contextlib.contextmanager
+def borrow_ydl(cookie_file=None):
+    """쉬고 있는 YoutubeDL 인스턴스를 빌려 씀 (없으면 생성, 작업이 끝나도 유지)"""
+    import yt_dlp
+
+    use_file = bool(cookie_file and os.path.exists(cookie_file))
+    key = cookie_file if use_file else None
+    with _progress_lock:
+        idle = _ydl_idle.setdefault(key, [])
+        ydl = idle.pop() if idle else None
+    if ydl is None:
+        params = {
+            'http_headers': {'User-Agent': USER_AGENT},
+            'continuedl': True,
+            'restrictfilenames': True,
+            'concurrent_fragment_downloads': 4,
+            'quiet': True,
+            'noprogress': True,
+            'logger': RetryLogger(),
+            'progress_hooks': [ytdlp_progress_hook],
+        }
+        if use_file:
+            # 인스턴스를 닫을 때 쿠키를 다시 저장하므로 인스턴스마다 개인 사본
+            params['cookiefile'] = copy_cookie_file(cookie_file)
+        else:
+            params['cookiesfrombrowser'] = ('firefox',)
+        ydl = yt_dlp.YoutubeDL(params)
+    try:
+        yield ydl
+    finally:
+        with _progress_lock:
+            _ydl_idle[key].append(ydl)
+
+def run_ytdlp_inprocess(url, output_file, referer, cookie_file=None,
+                        index=1, total=1, journal=None, job_id=None):
+    """재사용하는 YoutubeDL 인스턴스로 다운로드 (성공 여부 반환)"""
+    target = new_progress_target(url, index, total, journal, job_id)
+    target['trace_start'] = time.perf_counter()
+    with _progress_lock:
+        _progress_targets[output_file] = target
+    _rate_limiter.acquire(url)
+    try:
+        with borrow_ydl(cookie_file) as ydl:
+            # 빌린 동안에는 이 스레드만 쓰므로 params를 바꿔도 안전
+            ydl.params['http_headers']['Referer'] = referer
+            ydl.params['outtmpl']['default'] = output_file
+            ydl.params['logger'].target = target
+            return ydl.download([url]) == 0
+    except LeaseLost:
+        raise
+    except Exception as e:
+        print(f"  [{index}/{total}] {e}")
+        return False
+    finally:
+        with _progress_lock:
+            _progress_targets.pop(output_file, None)
+
+# 네이티브 HLS 다운로더: 호스트별 keep-alive 연결 풀 + 처리량/오류율에 따른 동시성 조절
+NATIVE_INITIAL_CONCURRENCY = 4
+NATIVE_MIN_CONCURRENCY = 1
+NATIVE_MAX_CONCURRENCY = 16
+SEGMENT_RETRIES = 5
+THROTTLE_STATUS = (429, 503)
+# 403은 _lsu_sa_ 토큰 만료/쿠키 오류라 다시 받아도 소용없으므로 재시도하지 않고 바로 실패
+RETRYABLE_STATUS = (408, 429, 500, 502, 503, 504)
+
+class HttpError(Exception):
+    def __init__(self, status, url):
+        super().__init__(f"HTTP {status}: {url[:80]}")
+        self.status = status
+
+class ConnectionPool:
+    """호스트별 keep-alive HTTP 연결 풀"""
+
+    def __init__(self, timeout=HTTP_TIMEOUT):
+        self.timeout = timeout
+        self.lock = threading.Lock()
+        self.idle = {}
+
+    def _connect(self, scheme, netloc):
+        cls = http.client.HTTPSConnection if scheme == 'https' else http.client.HTTPConnection
+        return cls(netloc, timeout=self.timeout)
+
+    def get(self, url, headers):
+        """GET 요청 후 (상태 코드, 본문) 반환 (리다이렉트는 따라감)"""
+        for _ in range(5):
+            parsed = urlparse(url)
+            key = (parsed.scheme, parsed.netloc)
+            path = (parsed.path or '/') + (f"?{parsed.query}" if parsed.query else '')
+
+            with self.lock:
+                idle = self.idle.setdefault(key, [])
+                conn = idle.pop() if idle else None
+            reused = conn is not None
+            while True:
+                if conn is None:
+                    conn = self._connect(*key)
+                try:
+                    conn.request('GET', path, headers=headers)
+                    resp = conn.getresponse()
+                    body = resp.read()
+                    break
+                except (http.client.HTTPException, OSError):
+                    conn.close()
+                    if not reused:
+                        raise
+                    # 서버가 닫아 버린 keep-alive 연결이면 새 연결로 한 번 더
+                    conn, reused = None, False
+
+            if resp.will_close:
+                conn.close()
+            else:
+                with self.lock:
+                    self.idle[key].append(conn)
+
+            location = resp.getheader('Location')
+            if resp.status in (301, 302, 303, 307, 308) and location:
+                url = urljoin(url, location)
+                continue
+            return resp.status, body
+        raise HttpError(310, url)
+
+    def close(self):
+        with self.lock:
+            for conns in self.idle.values():
+                for conn in conns:
+                    conn.close()
+            self.idle.clear()
+
+class AdaptiveConcurrency:
+    """세그먼트 처리량과 오류율로 동시 연결 수 조절
+
+    스로틀링(403/429/503)이나 오류가 잦으면 절반으로 줄이고, 한 단계 늘렸을 때
+    전체 처리량이 10% 이상 좋아지는 동안에만 하나씩 늘립니다.
+    """
+
+    def __init__(self, initial=NATIVE_INITIAL_CONCURRENCY, minimum=NATIVE_MIN_CONCURRENCY,
+                 maximum=NATIVE_MAX_CONCURRENCY):
+        self.limit = initial
+        self.minimum = minimum
+        self.maximum = maximum
+        self.active = 0
+        self.cond = threading.Condition()
+        self.level_throughput = {}
+        self.last_decrease = 0
+        self._reset_window(time.monotonic())
+
+    def _reset_window(self, now):
+        self.window_start = now
+        self.window_bytes = 0
+        self.window_count = 0
+        self.window_errors = 0
+
+    def acquire(self):
+        with self.cond:
+            while self.active >= self.limit:
+                self.cond.wait()
+            self.active += 1
+
+    def release(self, nbytes=0, error=False, throttled=False):
+        with self.cond:
+            self.active -= 1
+            now = time.monotonic()
+            if error:
+                self.window_errors += 1
+                attempts = self.window_count + self.window_errors
+                too_many = self.window_errors >= 3 and self.window_errors / attempts > 0.1
+                if (throttled or too_many) and now - self.last_decrease > 2:
+                    self.limit = max(self.minimum, self.limit // 2)
+                    self.last_decrease = now
+                    self._reset_window(now)
+            else:
+                self.window_bytes += nbytes
+                self.window_count += 1
+                elapsed = now - self.window_start
+                if self.window_count >= self.limit * 2 and elapsed > 0:
+                    throughput = self.window_bytes / elapsed
+                    self.level_throughput[self.limit] = throughput
+                    lower = self.level_throughput.get(self.limit - 1)
+                    if lower is None or throughput > lower * 1.1:
+                        self.limit = min(self.maximum, self.limit + 1)
+                    elif throughput < lower * 0.9:
+                        self.limit = max(self.minimum, self.limit - 1)
+                    self._reset_window(now)
+            self.cond.notify_all()
+
+def read_data_uri(uri):
+    """data: URI 본문 (nvpcon이 인라인한 키/init 세그먼트)"""
+    header, _, payload = uri.partition(',')
+    if header.endswith(';base64'):
+        return base64.b64decode(payload)
+    return unquote_to_bytes(payload)
+
+def aes128_cbc_decrypt(data, key, iv):
+    """AES-128-CBC 복호화 후 PKCS7 패딩 제거"""
+    try:
+        from Cryptodome.Cipher import AES
+    except ImportError:
+        try:
+            from Crypto.Cipher import AES
+        except ImportError:
+            AES = None
+    if AES is not None:
+        plain = AES.new(key, AES.MODE_CBC, iv).decrypt(data)
+    else:
+        from yt_dlp.aes import aes_cbc_decrypt_bytes
+        plain = aes_cbc_decrypt_bytes(data, key, iv)
+    if plain and 1 <= plain[-1] <= 16:
+        plain = plain[:-plain[-1]]
+    return plain
+
+def build_native_plan(url, referer, cookie_jar=None):
+    """매니페스트에서 받을 세그먼트 목록 구성 (지원하지 않는 형식이면 (None, 이유))"""
+    token = get_lsu_sa_token(url)
+    manifest = parse_m3u8(fetch_url(url, referer, cookie_jar).decode('utf-8', 'replace'), url)
+    bandwidth = None
+    if manifest['is_master']:
+        if manifest['audio_renditions']:
+            return None, '별도 오디오 트랙'
+        # yt-dlp 기본 동작처럼 가장 높은 variant
+        best = max(manifest['variants'],
+                   key=lambda v: (v.get('height') or 0, v.get('bandwidth') or 0))
+        bandwidth = best.get('bandwidth')
+        media_url = add_token(best['url'], token)
+        manifest = parse_m3u8(
+            fetch_url(media_url, referer, cookie_jar).decode('utf-8', 'replace'), media_url)
+
+    if not manifest['endlist']:
+        return None, '라이브 플레이리스트'
+    if manifest['byterange']:
+        return None, 'EXT-X-BYTERANGE'
+    if any(k and k['method'] != 'AES-128' for k in manifest['segment_keys']):
+        return None, '지원하지 않는 암호화'
+
+    pieces = []
+    if manifest['init_segment']:
+        pieces.append({'url': add_token(manifest['init_segment'], token), 'key': None})
+    for i, (segment, key) in enumerate(zip(manifest['segments'], manifest['segment_keys'])):
+        if key:
+            key = dict(key, uri=add_token(key['uri'], token))
+            if key['iv']:
+                key['iv'] = bytes.fromhex(key['iv'][2:].zfill(32))
+            else:
+                key['iv'] = (manifest['media_sequence'] + i).to_bytes(16, 'big')
+        pieces.append({'url': add_token(segment, token), 'key': key})
+
+    estimate = int(bandwidth / 8 * manifest['total_duration']) if bandwidth else None
+    return {'pieces': pieces, 'estimated_size': estimate}, None
+
+def preallocate(f, size):
+    """출력 파일 공간 미리 확보 (지원하지 않으면 무시)"""
+    try:
+        os.posix_fallocate(f.fileno(), 0, size)
+    except (AttributeError, OSError):
+        pass
+
+def remux_to_mp4(path):
+    """TS로 받은 결과를 ffmpeg로 MP4 컨테이너로 옮김 (yt-dlp FixupM3u8과 동일)
+
+    remux할 수 없으면 TS를 .mp4 이름으로 두지 않고 .ts로 바꿔 남김. 최종 파일 경로 반환.
+    """
+    with open(path, 'rb') as f:
+        if f.read(1) != b'\x47':
+            return path
+    ts_path = os.path.splitext(path)[0] + '.ts'
+    if not shutil.which('ffmpeg'):
+        print(f"  경고: ffmpeg가 없어 MP4로 remux하지 못했습니다. MPEG-TS 그대로 저장: "
+              f"{os.path.basename(ts_path)}")
+        os.replace(path, ts_path)
+        return ts_path
+    tmp_path = path + '.remux.mp4'
+    result = subprocess.run(
+        ["ffmpeg", "-y", "-v", "error", "-i", path, "-c", "copy",
+         "-movflags", "+faststart", "-f", "mp4", tmp_path],
+        capture_output=True)
+    if result.returncode == 0:
+        os.replace(tmp_path, path)
+        return path
+    if os.path.exists(tmp_path):
+        os.remove(tmp_path)
+    message = result.stderr.decode('utf-8', 'replace').strip()[-300:]
+    print(f"  경고: ffmpeg remux 실패 ({message or result.returncode}). MPEG-TS 그대로 저장: "
+          f"{os.path.basename(ts_path)}")
+    os.replace(path, ts_path)
+    return ts_path
+
+class StreamProbe:
+    """파이프로 흘려보내는 스트림의 앞/뒤 일부만 보관해 파일 없이 분석"""
+
+    def __init__(self):
+        # probe_ts가 읽는 범위와 같게, TS 패킷 경계에 맞춤
+        self.head_bytes = TS_SCAN_BYTES // TS_PACKET * TS_PACKET
+        self.tail_bytes = TS_TAIL_BYTES // TS_PACKET * TS_PACKET
+        self.head = bytearray()
+        self.tail = bytearray()
+
+    def feed(self, data):
+        room = self.head_bytes - len(self.head)
+        if room > 0:
+            self.head += data[:room]
+            data = data[room:]
+        if data:
+            self.tail += data
+            excess = len(self.tail) - self.tail_bytes
+            if excess > 0:
+                del self.tail[:-(-excess // TS_PACKET) * TS_PACKET]
+
+    def info(self):
+        return probe_buffer(bytes(self.head + self.tail))
+
+class RemuxPipe:
+    """받은 세그먼트를 ffmpeg stdin으로 바로 넘겨 MP4로 저장 (중간 TS 파일 없음)"""
+
+    def __init__(self, output_path):
+        self.probe = StreamProbe()
+        self.stderr = tempfile.TemporaryFile()
+        self.proc = subprocess.Popen(
+            ["ffmpeg", "-y", "-v", "error", "-i", "pipe:0", "-c", "copy",
+             "-movflags", "+faststart", "-f", "mp4", output_path],
+            stdin=subprocess.PIPE, stdout=subprocess.DEVNULL, stderr=self.stderr)
+
+    def _error(self):
+        self.stderr.seek(0)
+        message = self.stderr.read().decode('utf-8', 'replace').strip()
+        return OSError(f"ffmpeg remux 실패: {message[-300:] or self.proc.returncode}")
+
+    def write(self, data):
+        self.probe.feed(data)
+        try:
+            self.proc.stdin.write(data)
+        except BrokenPipeError:
+            self.proc.wait()
+            raise self._error() from None
 
-    if result.returncode != 0:
-        print(f"  [오류] 다운로드 실패")
-        return None
+    def __enter__(self):
+        return self
 
+    def __exit__(self, exc_type, exc, tb):
+        try:
+            if exc_type is None:
+                self.proc.stdin.close()
+                if self.proc.wait() != 0:
+                    raise self._error()
+            else:
+                self.proc.kill()
+                self.proc.wait()
+        finally:
+            self.stderr.close()
+
+# --stream-remux로 받은 파일은 스트림에서 분석한 결과를 analyze_file이 그대로 사용
+_stream_probes = {}
+
+def run_native_download(url, output_file, referer, cookie_file=None,
+                        index=1, total=1, journal=None, job_id=None, stream_remux=False):
+    """세그먼트를 직접 동시에 받아 순서대로 기록 (성공 여부 반환)
+
+    stream_remux면 .part 파일 대신 ffmpeg로 흘려보내 최종 MP4만 디스크에 씁니다.
+    """
+    label = f"  [{index}/{total}]"
+    if stream_remux and not shutil.which('ffmpeg'):
+        print(f"{label} ffmpeg가 없어 스트리밍 remux 없이 받습니다")
+        stream_remux = False
+    cookie_jar = load_cookie_jar(cookie_file)
+    try:
+        with trace_span('manifest', 'download', variant=index):
+            plan, reason = build_native_plan(url, referer, cookie_jar)
+    except Exception as e:
+        print(f"{label} 매니페스트 실패: {e}")
+        return False
+    if plan is None:
+        print(f"{label} 네이티브 엔진 미지원({reason}), yt-dlp로 받습니다")
+        return run_ytdlp_subprocess(url, output_file, referer, cookie_file, index, total,
+                                    journal, job_id)
+
+    pieces = plan['pieces']
+    part_file = output_file + '.part'
+
+    # 이어받기: 저널에 연속으로 기록된 프래그먼트까지는 건너뜀
+    # (ffmpeg로 흘려보내는 MP4는 중간부터 이어 쓸 수 없으므로 처음부터)
+    start, offset = 0, 0
+    if journal:
+        done = {}
+        if os.path.exists(part_file) and not stream_remux:
+            done = journal.completed_fragments(job_id, url)
+        while start in done and done[start][0] == offset:
+            offset += done[start][1]
+            start += 1
+        if start and journal.fragment_digest(job_id, url, start - 1):
+            # 마지막으로 기록된 세그먼트는 쓰다 끊겼을 수 있으므로 체크섬 확인
+            last_offset, last_size = done[start - 1]
+            with open(part_file, 'rb') as f:
+                f.seek(last_offset)
+                chunk = f.read(last_size)
+            if hashlib.sha256(chunk).hexdigest() != journal.fragment_digest(job_id, url, start - 1):
+                start, offset = start - 1, last_offset
+        if start == 0 or os.path.getsize(part_file) < offset:
+            start, offset = 0, 0
+            journal.clear_fragments(job_id, url)
+        else:
+            print(f"{label} 세그먼트 {start}/{len(pieces)}부터 이어받기")
+
+    headers = {'User-Agent': USER_AGENT, 'Referer': referer, 'Accept-Encoding': 'identity'}
+    cookie_headers = {}
+    keys = {}
+    keys_lock = threading.Lock()
+    pool = ConnectionPool()
+    limiter = AdaptiveConcurrency()
+    # 프래그먼트는 아래에서 정확한 오프셋으로 직접 기록하므로 저널은 넘기지 않음
+    target = new_progress_target(url, index, total, job_id=job_id, start_bytes=offset)
+
+    def request(piece_url):
+        if piece_url.startswith('data:'):
+            return read_data_uri(piece_url)
+        netloc = urlparse(piece_url).netloc
+        if cookie_jar is not None and netloc not in cookie_headers:
+            req = urllib.request.Request(piece_url)
+            cookie_jar.add_cookie_header(req)
+            cookie_headers[netloc] = req.get_header('Cookie')
+        req_headers = dict(headers)
+        if cookie_headers.get(netloc):
+            req_headers['Cookie'] = cookie_headers[netloc]
+
+        last_error = None
+        for attempt in range(SEGMENT_RETRIES):
+            _rate_limiter.acquire(piece_url)
+            limiter.acquire()
+            try:
+                status, body = pool.get(piece_url, req_headers)
+                if status not in (200, 206):
+                    raise HttpError(status, piece_url)
+            except HttpError as e:
+                limiter.release(error=True, throttled=e.status in THROTTLE_STATUS)
+                if e.status not in RETRYABLE_STATUS:
+                    raise
+                last_error = e
+            except (http.client.HTTPException, OSError) as e:
+                limiter.release(error=True)
+                last_error = e
+            else:
+                limiter.release(nbytes=len(body))
+                _rate_limiter.consume(piece_url, len(body))
+                return body
+            count_retry(target)
+            time.sleep(min(0.5 * 2 ** attempt, 8))
+        raise last_error
+
+    def get_key(uri):
+        with keys_lock:
+            if uri not in keys:
+                keys[uri] = request(uri)
+            return keys[uri]
+
+    def fetch(i):
+        """세그먼트를 받아 검사하고 (데이터, SHA-256) 반환, 손상되었으면 그 세그먼트만 다시 받음"""
+        piece = pieces[i]
+        for attempt in range(SEGMENT_RETRIES):
+            with trace_span('segment', 'segment', variant=index, segment=i) as span:
+                data = request(piece['url'])
+                span['bytes'] = len(data)
+            if piece['key']:
+                data = aes128_cbc_decrypt(data, get_key(piece['key']['uri']), piece['key']['iv'])
+            problem = validate_segment(data)
+            if problem is None:
+                return data, hashlib.sha256(data).hexdigest()
+            print(f"{label} 세그먼트 {i} 손상 ({problem}), 다시 받습니다")
+            count_retry(target)
+        raise OSError(f"세그먼트 {i} 손상: {problem}")
+
+    window = NATIVE_MAX_CONCURRENCY * 2
+    estimate = plan['estimated_size']
+    sink = None
+    try:
+        with contextlib.ExitStack() as stack:
+            if stream_remux:
+                out = sink = stack.enter_context(RemuxPipe(part_file))
+            else:
+                out = stack.enter_context(open(part_file, 'r+b' if start else 'wb'))
+                if not start and estimate:
+                    preallocate(out, estimate)
+                out.seek(offset)
+            executor = stack.enter_context(
+                ThreadPoolExecutor(max_workers=NATIVE_MAX_CONCURRENCY))
+
+            # 앞쪽 window개만 미리 받고, 받은 순서와 관계없이 파일에는 순서대로 기록
+            futures = {}
+            next_submit = start
+            try:
+                for i in range(start, len(pieces)):
+                    while next_submit < len(pieces) and next_submit < i + window:
+                        futures[next_submit] = executor.submit(fetch, next_submit)
+                        next_submit += 1
+                    data, digest = futures.pop(i).result()
+                    out.write(data)
+                    if journal:
+                        journal.record_fragment(job_id, url, i, offset, len(data), digest)
+                    offset += len(data)
+                    show_progress(target, {
+                        'status': 'downloading', 'downloaded_bytes': offset,
+                        # 세그먼트 크기가 고르다고 보고 받은 비율로 전체 크기 추정
+                        'total_bytes_estimate': offset * len(pieces) // (i + 1),
+                        'fragment_index': i + 1, 'fragment_count': len(pieces),
+                        'concurrency': limiter.limit,
+                    })
+            except BaseException:
+                for future in futures.values():
+                    future.cancel()
+                raise
+            if not stream_remux:
+                out.truncate(offset)
+    except LeaseLost:
+        # 임대를 잃은 작업은 실패로 기록하지 않고 execute_job까지 올려 보내야 함
+        raise
+    except HttpError as e:
+        reason = http_failure(e.status, '세그먼트') or f"세그먼트 다운로드 실패: {e}"
+        expiry = token_expiry(url)
+        if e.status in (401, 403) and expiry and expiry <= time.time():
+            reason += f" (토큰 만료: {time.strftime('%Y-%m-%d %H:%M', time.localtime(expiry))})"
+        print(f"{label} {reason}")
+        return False
+    except Exception as e:
+        print(f"{label} 세그먼트 다운로드 실패: {e}")
+        return False
+    finally:
+        pool.close()
+
+    os.replace(part_file, output_file)
+    show_progress(target, {'status': 'finished', 'downloaded_bytes': offset})
+    if sink:
+        _stream_probes[output_file] = sink.probe.info()
+    else:
+        remux_to_mp4(output_file)
+    return True
+
+def find_output_file(output_file):
+    """yt-dlp가 실제로 저장한 파일 경로"""
     if os.path.exists(output_file):
         return output_file
 
-    pattern = f"download_{index:02d}_{base_name[:8]}*"
-    matches = list(Path(output_dir).glob(pattern))
+    output_dir, name = os.path.split(output_file)
+    pattern = glob.escape(os.path.splitext(name)[0]) + "*"
+    matches = [m for m in Path(output_dir).glob(pattern)
+               if not m.name.endswith(('.part', '.ytdl')) and '.part-Frag' not in m.name]
     if matches:
         return str(matches[0])
 
     return None
 
+def download_url(url, index, total, referer, output_dir, cookie_file=None,
+                 engine='subprocess', journal=None, job_id=None, stream_remux=False):
+    """단일 URL 다운로드 (저널에 완료 기록이 있으면 건너뜀)"""
+    check_lease(job_id)
+    parsed = urlparse(url)
+    base_name = os.path.splitext(os.path.basename(parsed.path))[0]
+    # 같은 디렉터리에서 여러 작업(데몬 워커, 공유 큐 노드)이 동시에 받아도 겹치지 않도록 작업 ID 포함
+    prefix = f"download_{job_id[:8]}_" if job_id else "download_"
+    output_file = os.path.join(output_dir, f"{prefix}{index:02d}_{base_name[:8]}.mp4")
+
+    if journal:
+        variant = journal.get_variant(job_id, url)
+        if variant and variant['status'] == 'done' and variant['output_file'] \
+                and os.path.exists(variant['output_file']):
+            print(f"\n[{index}/{total}] 이미 받은 파일: {os.path.basename(variant['output_file'])}")
+            return variant['output_file']
+        journal.mark_variant(job_id, url, 'downloading', output_file)
+
+    print(f"\n[{index}/{total}] 다운로드 중...")
+    report_progress(job_id, variant=index, status='downloading')
+
+    with trace_span(f'variant {index}', 'download', url=url_key(url), engine=engine) as span:
+        if engine == 'inprocess':
+            ok = run_ytdlp_inprocess(url, output_file, referer, cookie_file, index, total,
+                                     journal, job_id)
+        elif engine == 'native':
+            ok = run_native_download(url, output_file, referer, cookie_file, index, total,
+                                     journal, job_id, stream_remux)
+        else:
+            ok = run_ytdlp_subprocess(url, output_file, referer, cookie_file, index, total,
+                                      journal, job_id)
+        span['ok'] = ok
+    if not ok:
+        # yt-dlp가 훅에서 올라온 LeaseLost를 자체 오류로 감쌌을 수 있으므로 실패 기록 전에 다시 확인
+        check_lease(job_id)
+
+    filepath = find_output_file(output_file) if ok else None
+    if journal:
+        journal.mark_variant(job_id, url, 'done' if filepath else 'failed', filepath)
+    report_progress(job_id, variant=index, status='done' if filepath else 'failed')
+
+    if not ok:
+        print(f"  [오류] 다운로드 실패")
+    return filepath
+
+def set_max_downloads(limit):
+    """모든 작업에 걸친 동시 다운로드 상한 설정"""
+    global _download_slots
+    _download_slots = threading.BoundedSemaphore(max(1, limit))
+
+def download_all(m3u8_list, referer, output_dir, cookie_file=None,
+                 concurrency=DEFAULT_CONCURRENCY, engine='subprocess',
+                 journal=None, job_id=None, stream_remux=False):
+    """여러 URL 동시 다운로드 (결과는 입력 순서대로 반환)"""
+    total = len(m3u8_list)
+
+    def worker(index, url):
+        with _download_slots:
+            return download_url(url, index, total, referer, output_dir, cookie_file,
+                                engine, journal, job_id, stream_remux)
+
+    with ThreadPoolExecutor(max_workers=max(1, concurrency)) as pool:
+        futures = [pool.submit(worker, i, url) for i, url in enumerate(m3u8_list, 1)]
+        return [f.result() for f in futures]
+
+_cookie_jars = {}
+
+def load_cookie_jar(cookie_file):
+    """Netscape 쿠키 파일을 CookieJar로 로드 (파일이 바뀌기 전까지 재사용, 실패 시 None)"""
+    if not cookie_file or not os.path.exists(cookie_file):
+        return None
+    key = (cookie_file, os.path.getmtime(cookie_file))
+    if key not in _cookie_jars:
+        jar = MozillaCookieJar(cookie_file)
+        try:
+            jar.load(ignore_discard=True, ignore_expires=True)
+        except Exception:
+            return None
+        _cookie_jars[key] = jar
+    return _cookie_jars[key]
+
+def fetch_url(url, referer, cookie_jar=None, max_bytes=None, timeout=HTTP_TIMEOUT):
+    """HTTP GET (리퍼러/UA/쿠키 포함), max_bytes 지정 시 앞부분만 읽음"""
+    req = urllib.request.Request(url, headers={
+        'User-Agent': USER_AGENT,
+        'Referer': referer,
+    })
+    if max_bytes:
+        req.add_header('Range', f'bytes=0-{max_bytes - 1}')
+    if cookie_jar is not None:
+        cookie_jar.add_cookie_header(req)
+    _rate_limiter.acquire(url)
+    with urllib.request.urlopen(req, timeout=timeout) as resp:
+        return resp.read(max_bytes) if max_bytes else resp.read()
+
+def get_lsu_sa_token(url):
+    """URL에서 _lsu_sa_ 토큰 추출"""
+    return parse_qs(urlparse(url).query).get('_lsu_sa_', [None])[0]
+
+def add_token(url, token):
+    """세그먼트 URL에 _lsu_sa_ 토큰 추가 (nvpcon과 같은 규칙)"""
+    if not token or '_lsu_sa_=' in url:
+        return url
+    separator = '&' if '?' in url else '?'
+    return f"{url}{separator}_lsu_sa_={token}"
+
+def parse_m3u8_attributes(text):
+    """#EXT-X-...: 뒤의 속성 목록 파싱"""
+    attrs = {}
+    for key, value in re.findall(r'([A-Z0-9-]+)=("[^"]*"|[^,]*)', text):
+        attrs[key] = value.strip('"')
+    return attrs
+
+def parse_m3u8(content, base_url):
+    """m3u8 매니페스트 파싱 (master/media 공통)"""
+    manifest = {
+        'is_master': False,
+        'variants': [],
+        'segments': [],
+        'durations': [],
+        'segment_keys': [],
+        'init_segment': None,
+        'target_duration': None,
+        'total_duration': 0.0,
+        'media_sequence': 0,
+        'endlist': False,
+        'audio_renditions': False,
+        'byterange': False,
+    }
+    pending_variant = None
+    current_key = None
+    for line in content.splitlines():
+        line = line.strip()
+        if not line:
+            continue
+        if line.startswith('#EXT-X-STREAM-INF:'):
+            attrs = parse_m3u8_attributes(line.split(':', 1)[1])
+            width, height = None, None
+            resolution = attrs.get('RESOLUTION', '')
+            if 'x' in resolution:
+                width, height = (int(n) for n in resolution.split('x', 1))
+            bandwidth = attrs.get('BANDWIDTH')
+            pending_variant = {
+                'width': width,
+                'height': height,
+                'bandwidth': int(bandwidth) if bandwidth and bandwidth.isdigit() else None,
+            }
+            manifest['is_master'] = True
+        elif line.startswith('#EXTINF:'):
+            value = line.split(':', 1)[1].split(',', 1)[0]
+            try:
+                manifest['durations'].append(float(value))
+            except ValueError:
+                manifest['durations'].append(0.0)
+        elif line.startswith('#EXT-X-TARGETDURATION:'):
+            try:
+                manifest['target_duration'] = float(line.split(':', 1)[1])
+            except ValueError:
+                pass
+        elif line.startswith('#EXT-X-MEDIA-SEQUENCE:'):
+            try:
+                manifest['media_sequence'] = int(line.split(':', 1)[1])
+            except ValueError:
+                pass
+        elif line.startswith('#EXT-X-KEY:'):
+            attrs = parse_m3u8_attributes(line.split(':', 1)[1])
+            if attrs.get('METHOD', 'NONE') == 'NONE':
+                current_key = None
+            else:
+                current_key = {
+                    'method': attrs['METHOD'],
+                    'uri': urljoin(base_url, attrs.get('URI', '')),
+                    'iv': attrs.get('IV'),
+                }
+        elif line.startswith('#EXT-X-MAP:'):
+            uri = parse_m3u8_attributes(line.split(':', 1)[1]).get('URI')
+            if uri:
+                manifest['init_segment'] = urljoin(base_url, uri)
+        elif line.startswith('#EXT-X-MEDIA:'):
+            attrs = parse_m3u8_attributes(line.split(':', 1)[1])
+            if attrs.get('TYPE') == 'AUDIO' and attrs.get('URI'):
+                manifest['audio_renditions'] = True
+        elif line.startswith('#EXT-X-BYTERANGE'):
+            manifest['byterange'] = True
+        elif line.startswith('#EXT-X-ENDLIST'):
+            manifest['endlist'] = True
+        elif not line.startswith('#'):
+            full_url = urljoin(base_url, line)
+            if pending_variant is not None:
+                pending_variant['url'] = full_url
+                manifest['variants'].append(pending_variant)
+                pending_variant = None
+            else:
+                manifest['segments'].append(full_url)
+                manifest['segment_keys'].append(current_key)
+    manifest['total_duration'] = sum(manifest['durations'])
+    return manifest
+
+def manifest_fingerprint(manifest):
+    """매니페스트 지문 (쿼리 제외 세그먼트 경로, target duration, 총 EXTINF)"""
+    h = hashlib.sha1()
+    if manifest['is_master']:
+        for v in manifest['variants']:
+            h.update(f"{urlparse(v['url']).path}|{v.get('width')}x{v.get('height')}|"
+                     f"{v.get('bandwidth')}\n".encode())
+    else:
+        h.update(f"{manifest['target_duration']}|{manifest['total_duration']:.3f}\n".encode())
+        if manifest['init_segment']:
+            h.update(f"{urlparse(manifest['init_segment']).path}\n".encode())
+        for seg in manifest['segments']:
+            h.update(f"{urlparse(seg).path}\n".encode())
+    return h.hexdigest()
+
+def probe_first_segment(manifest, token, referer, cookie_jar=None):
+    """첫 세그먼트(또는 init 세그먼트) 앞부분만 받아 해상도 확인"""
+    target = manifest['init_segment'] or (manifest['segments'] or [None])[0]
+    if not target:
+        return None
+    data = fetch_url(add_token(target, token), referer, cookie_jar, max_bytes=PROBE_BYTES)
+    suffix = '.mp4' if manifest['init_segment'] else '.ts'
+    fd, tmp_path = tempfile.mkstemp(prefix='naver-dl-probe-', suffix=suffix)
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        return analyze_file(tmp_path)
+    finally:
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+
+def inspect_manifest(url, referer, cookie_jar=None):
+    """매니페스트만 받아 해상도/길이 확인 (미디어는 받지 않음)"""
+    info = {
+        'type': 'manifest',
+        'url': url,
+        'width': None,
+        'height': None,
+        'bandwidth': None,
+        'duration': None,
+        'manifest': None,
+        'fingerprint': None,
+        'error': None,
+    }
+    try:
+        with trace_span('manifest', 'preflight', url=url_key(url)):
+            content = fetch_url(url, referer, cookie_jar).decode('utf-8', 'replace')
+            manifest = parse_m3u8(content, url)
+        info['manifest'] = manifest
+        info['fingerprint'] = manifest_fingerprint(manifest)
+
+        if manifest['is_master']:
+            # master는 yt-dlp 기본 동작처럼 가장 높은 variant 기준
+            best = max(manifest['variants'],
+                       key=lambda v: (v.get('height') or 0, v.get('bandwidth') or 0))
+            info['width'] = best.get('width')
+            info['height'] = best.get('height')
+            info['bandwidth'] = best.get('bandwidth')
+        else:
+            info['duration'] = manifest['total_duration'] or None
+            with trace_span('probe_segment', 'preflight', url=url_key(url)):
+                probe = probe_first_segment(manifest, get_lsu_sa_token(url), referer, cookie_jar)
+            if probe and probe.get('type') == 'video':
+                info['width'] = probe.get('width')
+                info['height'] = probe.get('height')
+    except Exception as e:
+        info['error'] = str(e)
+    return info
+
+def preflight_variants(m3u8_list, referer, cookie_file=None,
+                       concurrency=DEFAULT_CONCURRENCY):
+    """모든 m3u8의 매니페스트를 동시에 확인 (입력 순서 유지)"""
+    cookie_jar = load_cookie_jar(cookie_file)
+    with ThreadPoolExecutor(max_workers=max(1, concurrency)) as pool:
+        futures = [pool.submit(inspect_manifest, url, referer, cookie_jar)
+                   for url in m3u8_list]
+        return [f.result() for f in futures]
+
+def dedupe_variants(candidates):
+    """같은 rendition을 가리키는 URL 병합 (첫 번째만 남김)"""
+    seen = {}
+    unique = []
+    for c in candidates:
+        fp = c.get('fingerprint')
+        if fp and fp in seen:
+            print(f"  중복 제외: {c['url'][:60]}... (= {seen[fp]['url'][:40]}...)")
+            continue
+        if fp:
+            seen[fp] = c
+        unique.append(c)
+    return unique
+
+def choose_variants(candidates):
+    """사전 확인 결과로 받을 URL 선택 (판단 불가한 URL은 그대로 포함)"""
+    known = [c for c in candidates if c.get('height')]
+    if not known:
+        return [c['url'] for c in candidates]
+
+    best = min(known, key=resolution_sort_key)
+    chosen = [c for c in candidates if c is best or not c.get('height')]
+    for c in candidates:
+        resolution = f"{c['width']}x{c['height']}" if c.get('height') else "N/A"
+        duration = format_duration(c.get('duration'))
+        reason = f" | 확인 실패: {c['error']}" if c.get('error') else ""
+        mark = " (선택)" if any(c is x for x in chosen) else ""
+        print(f"  {resolution} | {duration}{reason}{mark}")
+
+    return [c['url'] for c in chosen]
+
+# 다운로드 전 검증: 토큰 만료와 첫/마지막 세그먼트 접근만 빠르게 확인
+TOKEN_EXPIRY_PARAMS = ('expires', 'expire', 'exp', 'Expires')
+
+class PreflightError(Exception):
+    """받기 시작해도 실패할 작업 (메시지가 실패 이유)"""
+
+def token_expiry(url):
+    """URL 쿼리나 토큰에서 읽을 수 있는 만료 시각 (unix 초, 알 수 없으면 None)"""
+    query = parse_qs(urlparse(url).query)
+    for name in TOKEN_EXPIRY_PARAMS:
+        value = (query.get(name) or [''])[0]
+        if value.isdigit():
+            return int(value)
+    token = get_lsu_sa_token(url)
+    if not token:
+        return None
+    # JWT처럼 base64url JSON 조각에 exp가 들어 있는 토큰
+    for part in re.split(r'[.~]', unquote(token)):
+        if len(part) < 8:
+            continue
+        try:
+            payload = json.loads(base64.urlsafe_b64decode(part + '=' * (-len(part) % 4)))
+        except ValueError:
+            continue
+        if isinstance(payload, dict):
+            for name in ('exp', 'expires', 'expire'):
+                if isinstance(payload.get(name), (int, float)):
+                    return int(payload[name])
+    return None
+
+def probe_status(url, referer, cookie_jar=None):
+    """1바이트 범위 GET으로 접근 가능한지만 확인 (HTTP 상태, Content-Type)"""
+    req = urllib.request.Request(url, headers={
+        'User-Agent': USER_AGENT,
+        'Referer': referer,
+        'Range': 'bytes=0-0',
+    })
+    if cookie_jar is not None:
+        cookie_jar.add_cookie_header(req)
+    _rate_limiter.acquire(url)
+    try:
+        with urllib.request.urlopen(req, timeout=VALIDATE_TIMEOUT) as resp:
+            resp.read(1)
+            return resp.status, resp.headers.get('Content-Type', '')
+    except urllib.error.HTTPError as e:
+        return e.code, e.headers.get('Content-Type', '') if e.headers else ''
+
+def http_failure(status, what):
+    """다운로드해도 소용없는 HTTP 상태면 이유 문자열 (일시적인 오류는 None)"""
+    if status in (401, 403):
+        return f"{what} 접근 거부 (HTTP {status}): _lsu_sa_ 토큰 만료 또는 쿠키 오류"
+    if status in (404, 410):
+        return f"{what} 없음 (HTTP {status}): URL이 잘못되었거나 삭제된 영상"
+    return None
+
+def validate_variant(url, referer, cookie_jar=None, manifest=None):
+    """variant 하나 검증: 토큰 만료, 매니페스트, 첫/마지막 세그먼트와 AES 키 접근
+
+    {'url', 'error', 'warnings'}를 반환하며, error가 있으면 받아도 실패할 variant입니다.
+    타임아웃/5xx 같은 일시적인 문제는 경고로만 남깁니다.
+    """
+    result = {'url': url, 'error': None, 'warnings': []}
+    expiry = token_expiry(url)
+    if expiry and expiry <= time.time():
+        result['error'] = f"토큰 만료 ({time.strftime('%Y-%m-%d %H:%M', time.localtime(expiry))})"
+        return result
+
+    token = get_lsu_sa_token(url)
+    what = '매니페스트'
+    try:
+        if manifest is None:
+            content = fetch_url(url, referer, cookie_jar, timeout=VALIDATE_TIMEOUT)
+            manifest = parse_m3u8(content.decode('utf-8', 'replace'), url)
+        if manifest['is_master'] and manifest['variants']:
+            # yt-dlp가 고를 가장 높은 variant의 플레이리스트 기준
+            best = max(manifest['variants'],
+                       key=lambda v: (v.get('height') or 0, v.get('bandwidth') or 0))
+            what = 'variant 플레이리스트'
+            content = fetch_url(add_token(best['url'], token), referer, cookie_jar,
+                                timeout=VALIDATE_TIMEOUT)
+            manifest = parse_m3u8(content.decode('utf-8', 'replace'), best['url'])
+        if not manifest['segments']:
+            result['error'] = "세그먼트가 없는 매니페스트 (로그인/오류 페이지를 받았을 수 있음)"
+            return result
+
+        targets = [('첫 세그먼트', manifest['init_segment'] or manifest['segments'][0]),
+                   ('마지막 세그먼트', manifest['segments'][-1])]
+        key = manifest['segment_keys'][0]
+        if key and key['uri'].startswith(('http://', 'https://')):
+            targets.append(('AES 키', key['uri']))
+        for what, target in targets:
+            status, content_type = probe_status(add_token(target, token), referer, cookie_jar)
+            reason = http_failure(status, what)
+            if reason:
+                result['error'] = reason
+                return result
+            if status >= 400:
+                result['warnings'].append(f"{what}: HTTP {status}")
+            elif 'text/html' in content_type:
+                result['error'] = f"{what} 대신 HTML 응답 (로그인/오류 페이지)"
+                return result
+    except urllib.error.HTTPError as e:
+        result['error'] = http_failure(e.code, what)
+        if not result['error']:
+            result['warnings'].append(f"{what}: HTTP {e.code}")
+    except urllib.error.URLError as e:
+        # 연결 타임아웃도 URLError로 감싸져 오므로 일시적인 문제로 취급
+        if isinstance(e.reason, (TimeoutError, socket.timeout)):
+            result['warnings'].append(f"{what}: 응답 시간 초과")
+        else:
+            result['error'] = f"{what} 연결 실패: {e.reason}"
+    except (OSError, ValueError) as e:
+        result['warnings'].append(f"{what}: {e}")
+    return result
+
+def validate_variants(m3u8_list, referer, cookie_file=None, manifests=None,
+                      concurrency=DEFAULT_CONCURRENCY):
+    """모든 variant를 동시에 검증 (입력 순서 유지, 사전 확인에서 받은 매니페스트는 재사용)"""
+    cookie_jar = load_cookie_jar(cookie_file)
+    manifests = manifests or {}
+    with ThreadPoolExecutor(max_workers=max(1, concurrency)) as pool:
+        futures = [pool.submit(validate_variant, url, referer, cookie_jar, manifests.get(url))
+                   for url in m3u8_list]
+        return [f.result() for f in futures]
+
+# ffprobe 없이 MP4/MPEG-TS 헤더만 읽어 분석
+MP4_CODECS = {
+    b'avc1': 'h264', b'avc3': 'h264', b'hvc1': 'hevc', b'hev1': 'hevc',
+    b'av01': 'av1', b'vp09': 'vp9', b'mp4a': 'aac', b'ac-3': 'ac3',
+    b'ec-3': 'eac3', b'Opus': 'opus',
+}
+TS_VIDEO_TYPES = {0x1b: 'h264', 0x24: 'hevc', 0x02: 'mpeg2video'}
+TS_AUDIO_TYPES = {0x0f: 'aac', 0x11: 'aac_latm', 0x03: 'mp3', 0x04: 'mp3',
+                  0x81: 'ac3', 0x87: 'eac3'}
+TS_PACKET = 188
+TS_SCAN_BYTES = 4 * 1024 * 1024     # 앞부분에서 PAT/PMT/SPS를 찾을 범위
+TS_TAIL_BYTES = 1024 * 1024         # 마지막 PTS를 찾을 범위
+
+class BitReader:
+    """H.264 SPS용 비트 리더 (Exp-Golomb 지원)"""
+
+    def __init__(self, data):
+        self.data = data
+        self.pos = 0
+
+    def u(self, n):
+        value = 0
+        for _ in range(n):
+            byte = self.data[self.pos >> 3]
+            value = (value << 1) | ((byte >> (7 - (self.pos & 7))) & 1)
+            self.pos += 1
+        return value
+
+    def ue(self):
+        zeros = 0
+        while self.u(1) == 0:
+            zeros += 1
+        return (1 << zeros) - 1 + self.u(zeros)
+
+    def se(self):
+        value = self.ue()
+        return (value + 1) // 2 if value & 1 else -(value // 2)
+
+def parse_h264_sps(nal):
+    """H.264 SPS NAL에서 (width, height) 추출"""
+    # emulation prevention 바이트(00 00 03) 제거
+    rbsp = re.sub(b'\x00\x00\x03', b'\x00\x00', bytes(nal[1:]))
+    profile_idc = rbsp[0]
+    br = BitReader(rbsp[3:])
+    br.ue()  # seq_parameter_set_id
+    chroma_format_idc = 1
+    separate_colour_plane = 0
+    if profile_idc in (100, 110, 122, 244, 44, 83, 86, 118, 128, 138, 139, 134, 135):
+        chroma_format_idc = br.ue()
+        if chroma_format_idc == 3:
+            separate_colour_plane = br.u(1)
+        br.ue()  # bit_depth_luma_minus8
+        br.ue()  # bit_depth_chroma_minus8
+        br.u(1)  # qpprime_y_zero_transform_bypass_flag
+        if br.u(1):  # seq_scaling_matrix_present_flag
+            for i in range(8 if chroma_format_idc != 3 else 12):
+                if br.u(1):
+                    last_scale = next_scale = 8
+                    for _ in range(16 if i < 6 else 64):
+                        if next_scale:
+                            next_scale = (last_scale + br.se() + 256) % 256
+                        last_scale = next_scale or last_scale
+    br.ue()  # log2_max_frame_num_minus4
+    poc_type = br.ue()
+    if poc_type == 0:
+        br.ue()
+    elif poc_type == 1:
+        br.u(1)
+        br.se()
+        br.se()
+        for _ in range(br.ue()):
+            br.se()
+    br.ue()  # max_num_ref_frames
+    br.u(1)  # gaps_in_frame_num_value_allowed_flag
+    width_mbs = br.ue() + 1
+    height_map_units = br.ue() + 1
+    frame_mbs_only = br.u(1)
+    if not frame_mbs_only:
+        br.u(1)  # mb_adaptive_frame_field_flag
+    br.u(1)  # direct_8x8_inference_flag
+
+    width = width_mbs * 16
+    height = (2 - frame_mbs_only) * height_map_units * 16
+    if br.u(1):  # frame_cropping_flag
+        left, right, top, bottom = br.ue(), br.ue(), br.ue(), br.ue()
+        if chroma_format_idc == 0 or separate_colour_plane:
+            crop_x, crop_y = 1, 2 - frame_mbs_only
+        else:
+            crop_x = 2 if chroma_format_idc in (1, 2) else 1
+            crop_y = (2 if chroma_format_idc == 1 else 1) * (2 - frame_mbs_only)
+        width -= (left + right) * crop_x
+        height -= (top + bottom) * crop_y
+    return width, height
+
+def iter_mp4_boxes(buf, start, end):
+    """[start, end) 범위의 MP4 박스 (type, payload 시작, 끝)"""
+    pos = start
+    while pos + 8 <= end:
+        size, box_type = struct.unpack('>I4s', buf[pos:pos + 8])
+        header = 8
+        if size == 1:
+            size = struct.unpack('>Q', buf[pos + 8:pos + 16])[0]
+            header = 16
+        elif size == 0:
+            size = end - pos
+        if size < header or pos + size > end:
+            return
+        yield box_type, pos + header, pos + size
+        pos += size
+
+def find_mp4_box(buf, start, end, path):
+    """경로(b'mdia/minf/...')를 따라 첫 번째 박스 찾기"""
+    for name in path.split(b'/'):
+        for box_type, body, box_end in iter_mp4_boxes(buf, start, end):
+            if box_type == name:
+                start, end = body, box_end
+                break
+        else:
+            return None
+    return start, end
+
+def probe_mp4(buf):
+    """moov의 mvhd/tkhd/mdhd/hdlr/stsd만 읽어 분석"""
+    moov = find_mp4_box(buf, 0, len(buf), b'moov')
+    if not moov:
+        return None
+
+    info = {'width': None, 'height': None, 'has_audio': False, 'duration': None,
+            'video_codec': None, 'audio_codec': None}
+    mvhd = find_mp4_box(buf, moov[0], moov[1], b'mvhd')
+    if mvhd:
+        body = mvhd[0]
+        if buf[body] == 1:
+            timescale, duration = struct.unpack('>IQ', buf[body + 20:body + 32])
+        else:
+            timescale, duration = struct.unpack('>II', buf[body + 12:body + 20])
+        if timescale and duration:
+            info['duration'] = duration / timescale
+
+    for box_type, body, box_end in iter_mp4_boxes(buf, moov[0], moov[1]):
+        if box_type != b'trak':
+            continue
+        hdlr = find_mp4_box(buf, body, box_end, b'mdia/hdlr')
+        stsd = find_mp4_box(buf, body, box_end, b'mdia/minf/stbl/stsd')
+        if not hdlr or not stsd:
+            continue
+        handler = bytes(buf[hdlr[0] + 8:hdlr[0] + 12])
+        fourcc = bytes(buf[stsd[0] + 12:stsd[0] + 16])
+        if handler == b'vide':
+            info['video_codec'] = MP4_CODECS.get(fourcc, fourcc.decode('latin-1').strip())
+            tkhd = find_mp4_box(buf, body, box_end, b'tkhd')
+            if tkhd:
+                # tkhd 마지막 8바이트가 16.16 고정소수점 width/height
+                width, height = struct.unpack('>II', buf[tkhd[1] - 8:tkhd[1]])
+                info['width'], info['height'] = width >> 16, height >> 16
+            if not info['width']:
+                entry = stsd[0] + 8
+                info['width'], info['height'] = struct.unpack(
+                    '>HH', buf[entry + 32:entry + 36])
+        elif handler == b'soun':
+            info['has_audio'] = True
+            info['audio_codec'] = MP4_CODECS.get(fourcc, fourcc.decode('latin-1').strip())
+
+        if info['duration'] is None:
+            mdhd = find_mp4_box(buf, body, box_end, b'mdia/mdhd')
+            if mdhd:
+                b = mdhd[0]
+                if buf[b] == 1:
+                    timescale, duration = struct.unpack('>IQ', buf[b + 20:b + 32])
+                else:
+                    timescale, duration = struct.unpack('>II', buf[b + 12:b + 20])
+                if timescale and duration:
+                    info['duration'] = duration / timescale
+
+    # moov는 있지만 쓸 수 있는 트랙이 없으면 (잘린 파일 등) ffprobe로 넘김 (probe_ts와 동일)
+    if info['video_codec'] is None and not info['has_audio']:
+        return None
+    if info['duration'] is None:
+        # fragmented MP4는 mvex/mehd에 전체 길이가 있음
+        mehd = find_mp4_box(buf, moov[0], moov[1], b'mvex/mehd')
+        mvhd_scale = None
+        if mvhd:
+            b = mvhd[0]
+            mvhd_scale = struct.unpack('>I', buf[b + 20:b + 24] if buf[b] == 1
+                                       else buf[b + 12:b + 16])[0]
+        if mehd and mvhd_scale:
+            b = mehd[0]
+            fmt = '>Q' if buf[b] == 1 else '>I'
+            length = 8 if buf[b] == 1 else 4
+            duration = struct.unpack(fmt, buf[b + 4:b + 4 + length])[0]
+            if duration:
+                info['duration'] = duration / mvhd_scale
+
+    return info
+
+def ts_packet_payload(packet):
+    """TS 패킷의 (PID, PUSI, payload)"""
+    pid = ((packet[1] & 0x1f) << 8) | packet[2]
+    pusi = bool(packet[1] & 0x40)
+    afc = (packet[3] >> 4) & 0x3
+    offset = 4
+    if afc & 0x2:
+        offset += 1 + packet[4]
+    if not afc & 0x1 or offset >= TS_PACKET:
+        return pid, pusi, b''
+    return pid, pusi, packet[offset:]
+
+def parse_timestamp(p):
+    """PES 헤더의 33비트 PTS/DTS 필드"""
+    return (((p[0] >> 1) & 0x07) << 30 | p[1] << 22 | (p[2] >> 1) << 15
+            | p[3] << 7 | p[4] >> 1)
+
+def parse_pes_pts(payload):
+    """PES 헤더의 PTS (없으면 None)"""
+    if len(payload) < 14 or payload[:3] != b'\x00\x00\x01' or not payload[7] & 0x80:
+        return None
+    return parse_timestamp(payload[9:14])
+
+def parse_pes_dts(payload):
+    """PES 헤더의 DTS (없으면 PTS)"""
+    if len(payload) >= 19 and payload[:3] == b'\x00\x00\x01' and payload[7] & 0xc0 == 0xc0:
+        return parse_timestamp(payload[14:19])
+    return parse_pes_pts(payload)
+
+def find_h264_sps(es):
+    """H.264 elementary stream에서 SPS NAL 찾기"""
+    pos = es.find(b'\x00\x00\x01')
+    while pos != -1:
+        start = pos + 3
+        nxt = es.find(b'\x00\x00\x01', start)
+        if start < len(es) and es[start] & 0x1f == 7:
+            return es[start:nxt if nxt != -1 else len(es)]
+        pos = nxt
+    return None
+
+def probe_ts(buf):
+    """PAT/PMT와 첫 SPS, 처음/마지막 PTS만 읽어 분석"""
+    size = len(buf)
+    if size < TS_PACKET * 2 or buf[0] != 0x47 or buf[TS_PACKET] != 0x47:
+        return None
+
+    info = {'width': None, 'height': None, 'has_audio': False, 'duration': None,
+            'video_codec': None, 'audio_codec': None}
+    pmt_pid = None
+    video_pid = None
+    video_es = bytearray()
+    collecting = False
+    first_pts = None
+
+    scan_end = min(size, TS_SCAN_BYTES) // TS_PACKET * TS_PACKET
+    for pos in range(0, scan_end, TS_PACKET):
+        packet = buf[pos:pos + TS_PACKET]
+        if packet[0] != 0x47:
+            return None
+        pid, pusi, payload = ts_packet_payload(packet)
+        if not payload:
+            continue
+        if pid == 0 and pusi and pmt_pid is None:
+            section = payload[1 + payload[0]:]
+            section_length = ((section[1] & 0x0f) << 8) | section[2]
+            for i in range(8, 3 + section_length - 4, 4):
+                program, entry_pid = struct.unpack('>HH', section[i:i + 4])
+                if program != 0:
+                    pmt_pid = entry_pid & 0x1fff
+                    break
+        elif pid == pmt_pid and pusi and video_pid is None and not info['has_audio']:
+            section = payload[1 + payload[0]:]
+            section_length = ((section[1] & 0x0f) << 8) | section[2]
+            i = 12 + (((section[10] & 0x0f) << 8) | section[11])
+            while i + 5 <= 3 + section_length - 4:
+                stream_type = section[i]
+                es_pid = ((section[i + 1] & 0x1f) << 8) | section[i + 2]
+                if stream_type in TS_VIDEO_TYPES and video_pid is None:
+                    video_pid = es_pid
+                    info['video_codec'] = TS_VIDEO_TYPES[stream_type]
+                elif stream_type in TS_AUDIO_TYPES and not info['has_audio']:
+                    info['has_audio'] = True
+                    info['audio_codec'] = TS_AUDIO_TYPES[stream_type]
+                i += 5 + (((section[i + 3] & 0x0f) << 8) | section[i + 4])
+        elif pid == video_pid:
+            if pusi:
+                if first_pts is None:
+                    first_pts = parse_pes_pts(payload)
+                if collecting and info['video_codec'] == 'h264':
+                    sps = find_h264_sps(bytes(video_es))
+                    if sps:
+                        info['width'], info['height'] = parse_h264_sps(sps)
+                        break
+                collecting = True
+                video_es.extend(payload[9 + payload[8]:] if len(payload) > 9 else b'')
+            elif collecting:
+                video_es.extend(payload)
+
+    if video_pid is None and not info['has_audio']:
+        return None
+    if info['video_codec'] == 'h264' and info['width'] is None and video_es:
+        sps = find_h264_sps(bytes(video_es))
+        if sps:
+            info['width'], info['height'] = parse_h264_sps(sps)
+
+    # 마지막 PTS는 파일 끝부분만 읽어서 확인
+    if first_pts is not None:
+        last_pts = None
+        tail_start = max(0, size - TS_TAIL_BYTES) // TS_PACKET * TS_PACKET
+        for pos in range(tail_start, size - TS_PACKET + 1, TS_PACKET):
+            packet = buf[pos:pos + TS_PACKET]
+            if packet[0] != 0x47:
+                continue
+            pid, pusi, payload = ts_packet_payload(packet)
+            if pid == video_pid and pusi:
+                pts = parse_pes_pts(payload)
+                if pts is not None:
+                    last_pts = pts if last_pts is None else max(last_pts, pts)
+        if last_pts is not None:
+            info['duration'] = ((last_pts - first_pts) % (1 << 33)) / 90000 or None
+
+    return info
+
+# 세그먼트 무결성 검사: 네이티브 엔진이 받는 즉시 확인하고 손상된 세그먼트만 다시 받음
+MP4_SEGMENT_BOXES = (b'ftyp', b'styp', b'moov', b'moof', b'sidx', b'emsg', b'prft')
+
+def validate_ts_segment(data):
+    """TS 동기 바이트/패킷 정렬, PID별 연속성 카운터와 DTS 순서 확인"""
+    if len(data) % TS_PACKET:
+        return f"길이가 {TS_PACKET}바이트 단위가 아님 ({len(data)})"
+    counters = {}
+    last_dts = {}
+    for n, pos in enumerate(range(0, len(data), TS_PACKET)):
+        packet = data[pos:pos + TS_PACKET]
+        if packet[0] != 0x47:
+            return f"동기 바이트 없음 (패킷 {n})"
+        pid = ((packet[1] & 0x1f) << 8) | packet[2]
+        if pid == 0x1fff:
+            continue  # null 패킷
+        afc = (packet[3] >> 4) & 0x3
+        if afc == 0:
+            return f"잘못된 adaptation field (패킷 {n})"
+        if afc & 0x1:
+            cc = packet[3] & 0x0f
+            prev = counters.get(pid)
+            discontinuity = afc & 0x2 and packet[4] and packet[5] & 0x80
+            # 같은 값은 중복 전송된 패킷이므로 허용
+            if prev is not None and not discontinuity and cc not in (prev, (prev + 1) & 0x0f):
+                return f"연속성 카운터 불연속 (PID {pid:#x}, 패킷 {n})"
+            counters[pid] = cc
+
+        _, pusi, payload = ts_packet_payload(packet)
+        if pusi and payload[:3] == b'\x00\x00\x01':
+            dts = parse_pes_dts(payload)
+            if dts is not None:
+                prev = last_dts.get(pid)
+                # 33비트 랩어라운드를 고려해 반 바퀴 이상 차이 나면 역행으로 판단
+                if prev is not None and (dts - prev) % (1 << 33) >= 1 << 32:
+                    return f"DTS 역행 (PID {pid:#x}, 패킷 {n})"
+                last_dts[pid] = dts
+    return None
+
+def validate_mp4_segment(data):
+    """fMP4 최상위 박스가 세그먼트 끝까지 빈틈없이 이어지는지 확인"""
+    end = 0
+    types = []
+    for box_type, _, box_end in iter_mp4_boxes(data, 0, len(data)):
+        types.append(box_type)
+        end = box_end
+    if end != len(data):
+        return f"박스 구조 손상 (오프셋 {end}/{len(data)})"
+    if b'moof' in types and b'mdat' not in types:
+        return "moof 뒤에 mdat 없음"
+    return None
+
+def validate_segment(data):
+    """세그먼트 검사 (문제가 있으면 이유, 없으면 None)"""
+    if not data:
+        return "빈 응답"
+    if data[0] == 0x47:
+        return validate_ts_segment(data)
+    if data[4:8] in MP4_SEGMENT_BOXES:
+        return validate_mp4_segment(data)
+    if data.lstrip()[:1] == b'<':
+        return "HTML/XML 응답"
+    return None  # ADTS 오디오 등 검사하지 않는 형식
+
+def probe_buffer(buf):
+    """MP4/TS 버퍼 분석 (실패 시 None)"""
+    try:
+        info = probe_ts(buf) if buf[0] == 0x47 else probe_mp4(buf)
+    except (ValueError, IndexError, struct.error):
+        return None
+    if not info or (info['video_codec'] and not info['width']):
+        return None
+    return info
+
+def probe_media(filepath):
+    """MP4/TS 헤더를 메모리 매핑으로 직접 분석 (실패 시 None)"""
+    try:
+        with open(filepath, 'rb') as f, \
+                mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buf:
+            return probe_buffer(buf)
+    except (OSError, ValueError):
+        return None
+
 def analyze_file(filepath):
-    """ffprobe로 파일 분석"""
+    """파일 분석 (헤더 직접 파싱, 실패 시 ffprobe)"""
     if not filepath or not os.path.exists(filepath):
         return None
 
@@ -140,6 +2098,17 @@ def analyze_file(filepath):
         except:
             pass
 
+    probed = _stream_probes.pop(filepath, None)
+    if not probed:
+        with trace_span('probe_header', 'analyze'):
+            probed = probe_media(filepath)
+    if probed:
+        info = {'type': 'video', 'size': file_size, 'filepath': filepath}
+        info.update(probed)
+        if info['width'] is None:
+            info['type'] = 'audio' if info['has_audio'] else 'unknown'
+        return info
+
     cmd = [
         "ffprobe",
         "-v", "quiet",
@@ -149,7 +2118,8 @@ def analyze_file(filepath):
         filepath
     ]
 
-    result = subprocess.run(cmd, capture_output=True, text=True)
+    with trace_span('ffprobe', 'analyze'):
+        result = subprocess.run(cmd, capture_output=True, text=True)
 
     if result.returncode != 0:
         return {'type': 'unknown', 'size': file_size, 'filepath': filepath}
@@ -244,8 +2214,19 @@ def process_json_input():
 
     return data
 
-def select_best_video(videos, title):
-    """여러 영상 중 보관할 파일 선택"""
+def resolution_sort_key(v):
+    """해상도 우선순위 (700~1000 적정)"""
+    h = v.get('height') or 0
+    # 700~1000 사이면 우선순위 높음
+    if 700 <= h <= 1000:
+        return (0, -h)  # 적정 범위 내에서는 높을수록 좋음
+    elif h > 1000:
+        return (1, h)   # 너무 큰 것은 후순위
+    else:
+        return (2, -h)  # 너무 작은 것도 후순위
+
+def select_best_video(videos, title, interactive=True):
+    """여러 영상 중 보관할 파일 선택 (interactive=False면 권장 파일 자동 선택)"""
     if not videos:
         return None
 
@@ -304,17 +2285,17 @@ def select_best_video(videos, title):
     print("=" * 60)
 
     # 해상도 기준 정렬 (700~1000 적정)
-    def sort_key(v):
-        h = v.get('height') or 0
-        # 700~1000 사이면 우선순위 높음
-        if 700 <= h <= 1000:
-            return (0, -h)  # 적정 범위 내에서는 높을수록 좋음
-        elif h > 1000:
-            return (1, h)   # 너무 큰 것은 후순위
-        else:
-            return (2, -h)  # 너무 작은 것도 후순위
+    unique_videos.sort(key=resolution_sort_key)
 
-    unique_videos.sort(key=sort_key)
+    if not interactive:
+        selected = unique_videos[0]
+        for v in unique_videos[1:]:
+            try:
+                os.remove(v['filepath'])
+                print(f"  삭제: {os.path.basename(v['filepath'])}")
+            except:
+                pass
+        return selected
 
     for i, v in enumerate(unique_videos, 1):
         resolution = f"{v['width']}x{v['height']}" if v.get('width') else "N/A"
@@ -364,7 +2345,562 @@ def select_best_video(videos, title):
 
         print("잘못된 입력입니다.")
 
+def resolve_cookie_file(cookies_netscape, args, job_id=None):
+    """작업에 사용할 쿠키 파일 결정 (배치 모드에서는 작업별 파일 사용)"""
+    cookie_file = args.cookies
+    if cookies_netscape:
+        # JSON에 쿠키가 포함된 경우 파일로 저장
+        # (배치 모드에서는 앞 작업이 쓰는 파일을 덮어쓰지 않도록 작업별로 저장)
+        # (작업별 파일은 다운로드가 끝나면 discard_job_cookies로 지움)
+        if job_id:
+            cookie_file = os.path.join(STATE_DIR, "cookies", f"{job_id}.txt")
+        else:
+            cookie_file = DEFAULT_COOKIE_FILE
+        write_atomic(cookie_file, cookies_netscape, mode=0o600)
+        print(f"쿠키: JSON에서 로드됨")
+    elif cookie_file:
+        print(f"쿠키: {cookie_file}")
+    elif os.path.exists(DEFAULT_COOKIE_FILE):
+        cookie_file = DEFAULT_COOKIE_FILE
+        print(f"쿠키: {cookie_file}")
+    else:
+        cookie_file = get_cached_cookie_file()
+        if cookie_file:
+            print(f"쿠키: Firefox 브라우저 (캐시: {cookie_file})")
+        else:
+            print(f"쿠키: Firefox 브라우저")
+    return cookie_file
+
+def discard_job_cookies(cookie_file):
+    """작업별 쿠키 파일 삭제 (그 파일로 만든 YoutubeDL 인스턴스도 닫음)"""
+    if not cookie_file:
+        return
+    with _progress_lock:
+        idle = _ydl_idle.pop(cookie_file, [])
+    for ydl in idle:
+        with contextlib.suppress(Exception):
+            ydl.close()
+        with contextlib.suppress(OSError, TypeError):
+            os.remove(ydl.params.get('cookiefile'))
+    with contextlib.suppress(FileNotFoundError):
+        os.remove(cookie_file)
+
+def discard_plan(plan):
+    """prepare_job 결과(None이나 예외일 수도 있음)의 작업별 쿠키 삭제 (여러 번 불러도 됨)"""
+    if isinstance(plan, dict):
+        discard_job_cookies(plan.get('job_cookie_file'))
+
+def prepare_job(data, args, journal=None, batch=False):
+    """다운로드 전 단계: 쿠키, 저널 확인, 매니페스트 사전 확인 (건너뛸 작업이면 None)"""
+    title = data.get('title', 'download')
+    referer = data.get('referer', 'https://contents.premium.naver.com/')
+    m3u8_list = data.get('m3u8_list', [])
+    cookies_netscape = data.get('cookies_netscape')
+
+    print(f"\n제목: {title}")
+    print(f"리퍼러: {referer[:60]}...")
+    print(f"m3u8 URL: {len(m3u8_list)}개")
+
+    # 라이브러리: 같은 제목으로 받은 파일이 있으면 네트워크 요청 없이 건너뛰기
+    if _library and not args.force:
+        existing = _library.find_title(title)
+        if existing:
+            print(f"\n이미 받은 영상입니다: {existing}")
+            print("다시 받으려면 --force 옵션을 사용하세요.")
+            return None
+
+    job_id = Journal.job_id(title, m3u8_list)
+    with trace_span('cookies', job=job_id):
+        cookie_file = resolve_cookie_file(cookies_netscape, args, job_id if batch else None)
+    job_cookie_file = cookie_file if cookies_netscape and batch else None
+    try:
+        # 저널: 완료된 작업은 건너뛰고, 중단된 작업은 이전에 고른 variant를 이어받기
+        resumed = False
+        if journal:
+            if args.restart:
+                journal.reset_job(job_id)
+            job = journal.get_job(job_id)
+            if job and job['status'] == 'done' and job['final_path'] \
+                    and os.path.exists(job['final_path']):
+                print(f"\n이미 완료된 작업입니다: {job['final_path']}")
+                print("다시 받으려면 --restart 옵션을 사용하세요.")
+                discard_job_cookies(job_cookie_file)
+                return None
+            planned = journal.planned_variants(job_id) if job else []
+            by_key = {}
+            for url in m3u8_list:
+                by_key.setdefault(url_key(url), url)
+            if planned and all(key in by_key for key in planned):
+                m3u8_list = [by_key[key] for key in planned]
+                resumed = True
+                print(f"\n이전 실행을 이어서 받습니다 (variant {len(m3u8_list)}개)")
+            journal.start_job(job_id, title)
+
+        # 매니페스트만 먼저 받아 다운로드할 variant 선택
+        fingerprints = []
+        manifests = {}
+        if not resumed and not args.no_preflight and len(m3u8_list) > 1:
+            print(f"\n매니페스트 확인 중...")
+            with trace_span('preflight', job=job_id, variants=len(m3u8_list)):
+                candidates = preflight_variants(m3u8_list, referer, cookie_file, args.concurrency)
+                fingerprints = [c['fingerprint'] for c in candidates if c.get('fingerprint')]
+                manifests = {c['url']: c['manifest'] for c in candidates if c.get('manifest')}
+                # 제목이 달라도 매니페스트가 같으면 이미 받은 영상
+                existing = None
+                if _library and not args.force:
+                    existing = next(filter(None, map(_library.find_fingerprint, fingerprints)), None)
+                if existing:
+                    print(f"\n같은 영상을 이미 받았습니다: {existing}")
+                    print("다시 받으려면 --force 옵션을 사용하세요.")
+                    if journal:
+                        journal.finish_job(job_id, existing)
+                    discard_job_cookies(job_cookie_file)
+                    return None
+                m3u8_list = choose_variants(dedupe_variants(candidates))
+            print(f"다운로드 대상: {len(m3u8_list)}개")
+
+        # 토큰/쿠키가 만료된 variant는 받기 전에 바로 제외 (모두 실패하면 작업 실패)
+        if not args.no_validate:
+            with trace_span('validate', job=job_id, variants=len(m3u8_list)):
+                checks = validate_variants(m3u8_list, referer, cookie_file, manifests,
+                                           args.concurrency)
+            for check in checks:
+                for warning in check['warnings']:
+                    print(f"  [경고] {url_key(check['url'])[-40:]}: {warning}")
+                if check['error']:
+                    print(f"  [검증 실패] {url_key(check['url'])[-40:]}: {check['error']}")
+            valid = [c['url'] for c in checks if not c['error']]
+            if not valid:
+                if journal:
+                    journal.finish_job(job_id, None, 'failed')
+                raise PreflightError(checks[0]['error'] if checks else "m3u8 URL이 없습니다.")
+            m3u8_list = valid
+
+        if journal and not resumed:
+            journal.plan_variants(job_id, m3u8_list)
+    except BaseException:
+        # 준비 중에 실패하면 호출한 쪽은 쿠키 파일 경로를 모르므로 여기서 삭제
+        discard_job_cookies(job_cookie_file)
+        raise
+
+    return {
+        'title': title,
+        'referer': referer,
+        'm3u8_list': m3u8_list,
+        'cookie_file': cookie_file,
+        'job_cookie_file': job_cookie_file,
+        'job_id': job_id,
+        'journal': journal,
+        'fingerprints': fingerprints,
+    }
+
+def execute_job(plan, args, interactive=True):
+    """다운로드 → 분석 → 선택 → 이름 변경 (최종 파일 경로 반환)"""
+    title = plan['title']
+    journal = plan['journal']
+    job_id = plan['job_id']
+
+    output_dir = os.getcwd()
+    print(f"저장 위치: {output_dir}")
+    print(f"\n다운로드를 시작합니다...")
+
+    # 다운로드 실행 (동시 실행, 결과는 입력 순서 유지)
+    report_progress(job_id, phase='downloading', variant_count=len(plan['m3u8_list']))
+    try:
+        with trace_span('download_all', job=job_id, engine=args.engine):
+            downloaded_files = download_all(plan['m3u8_list'], plan['referer'], output_dir,
+                                            plan['cookie_file'], args.concurrency, args.engine,
+                                            journal, job_id, args.stream_remux)
+    finally:
+        # 쿠키는 다운로드에만 쓰이므로 성공/실패와 관계없이 바로 삭제
+        discard_job_cookies(plan.get('job_cookie_file'))
+    # 엔진이 실패로 삼킨 경우에도 임대를 잃었으면 이름 변경/라이브러리 등록 전에 멈춤
+    check_lease(job_id)
+
+    # 파일 분석
+    print("\n파일 분석 중...")
+    report_progress(job_id, phase='analyzing')
+    results = []
+    for filepath in downloaded_files:
+        with trace_span('analyze', file=os.path.basename(filepath or '')):
+            info = analyze_file(filepath)
+        results.append(info)
+
+    # 최적 파일 선택
+    with trace_span('select', job=job_id):
+        selected = select_best_video(results, title, interactive)
+    final_path = None
+
+    if selected:
+        # 파일명 변경
+        safe_title = sanitize_filename(title)
+        # remux하지 못해 .ts로 남은 파일은 확장자를 그대로 유지
+        ext = os.path.splitext(selected['filepath'])[1] or '.mp4'
+        new_filename = f"{safe_title}{ext}"
+        new_filepath = os.path.join(output_dir, new_filename)
+
+        # 동일 파일명이 이미 존재하면 번호 추가
+        counter = 1
+        while os.path.exists(new_filepath):
+            new_filename = f"{safe_title}_{counter}{ext}"
+            new_filepath = os.path.join(output_dir, new_filename)
+            counter += 1
+
+        try:
+            with trace_span('rename', job=job_id):
+                os.rename(selected['filepath'], new_filepath)
+            final_path = new_filepath
+            print(f"\n최종 파일: {new_filename}")
+            print(f"  해상도: {selected.get('width')}x{selected.get('height')}")
+            print(f"  길이: {format_duration(selected.get('duration'))}")
+            print(f"  용량: {format_size(selected.get('size', 0))}")
+        except Exception as e:
+            print(f"파일명 변경 실패: {e}")
+            print(f"원본 파일: {selected['filepath']}")
+
+    if final_path and _library:
+        with trace_span('library', job=job_id):
+            try:
+                final_path = add_to_library(final_path, title, plan.get('fingerprints', ()),
+                                            keep_duplicate=args.force)
+            except OSError as e:
+                print(f"라이브러리 등록 실패: {e}")
+
+    if journal:
+        journal.finish_job(job_id, final_path, 'done' if final_path else 'failed')
+
+    return final_path
+
+def run_job(data, args, journal=None, interactive=True):
+    """JSON 작업 하나 처리"""
+    plan = prepare_job(data, args, journal)
+    if plan is None:
+        return None
+    try:
+        return execute_job(plan, args, interactive)
+    finally:
+        discard_plan(plan)
+
+def read_jsonl_jobs(source):
+    """JSONL 작업 목록 읽기 ('-'는 표준 입력), 한 줄씩 순서대로 반환"""
+    stream = sys.stdin if source == '-' else open(source, 'r', encoding='utf-8')
+    try:
+        for line_no, line in enumerate(stream, 1):
+            line = line.strip()
+            if not line or line.startswith('#'):
+                continue
+            try:
+                data = json.loads(line)
+            except json.JSONDecodeError as e:
+                print(f"[{line_no}행] JSON 파싱 실패: {e}")
+                continue
+            if 'm3u8_list' not in data:
+                print(f"[{line_no}행] 'm3u8_list' 필드가 없습니다.")
+                continue
+            yield data
+    finally:
+        if stream is not sys.stdin:
+            stream.close()
+
+def run_queue(source, args, journal=None):
+    """JSONL 작업을 무인으로 처리 (다음 작업의 매니페스트 확인을 미리 진행)"""
+    results = []
+    jobs = read_jsonl_jobs(source)
+    with ThreadPoolExecutor(max_workers=1) as prefetcher:
+        data = next(jobs, None)
+        pending = prefetcher.submit(prepare_job, data, args, journal, True) if data else None
+        try:
+            while pending is not None:
+                title = data.get('title', 'download')
+                try:
+                    plan = pending.result()
+                except Exception as e:
+                    plan = e
+
+                # 준비가 끝난 뒤로는 어떻게 끝나든(중단 포함) 작업별 쿠키를 지움
+                try:
+                    # 현재 작업을 받는 동안 다음 작업 준비
+                    data = next(jobs, None)
+                    pending = prefetcher.submit(prepare_job, data, args, journal, True) \
+                        if data else None
+
+                    if plan is None:
+                        results.append((title, 'skipped', None))
+                        continue
+                    if isinstance(plan, Exception):
+                        print(f"\n[오류] 작업 준비 실패: {title}: {plan}")
+                        results.append((title, 'failed', None))
+                        continue
+                    try:
+                        final_path = execute_job(plan, args, interactive=False)
+                    except Exception as e:
+                        print(f"\n[오류] 작업 실패: {title}: {e}")
+                        final_path = None
+                    results.append((title, 'done' if final_path else 'failed', final_path))
+                finally:
+                    discard_plan(plan)
+        finally:
+            # 중단되면 미리 준비해 둔 다음 작업은 실행되지 않으므로 그 쿠키도 지움
+            if pending is not None and not pending.cancel():
+                with contextlib.suppress(Exception):
+                    discard_plan(pending.result())
+
+    print("\n" + "=" * 60)
+    print(f"배치 결과: {sum(1 for r in results if r[1] == 'done')}/{len(results)} 완료")
+    print("=" * 60)
+    for title, status, final_path in results:
+        label = {'done': '완료', 'skipped': '건너뜀', 'failed': '실패'}[status]
+        print(f"  [{label}] {title}" + (f" → {os.path.basename(final_path)}" if final_path else ""))
+    return results
+
+# 공유 큐: 여러 머신의 워커가 공유 디렉터리에서 작업을 임대해 처리 (dlcommon.SharedQueue)
+def enqueue_jobs(queue_dir, jobs):
+    """작업을 공유 큐에 추가만 하고 받지는 않음"""
+    queue = SharedQueue(queue_dir)
+    for data in jobs:
+        title = data.get('title', 'download')
+        job_id = Journal.job_id(title, data.get('m3u8_list', []))
+        added = queue.enqueue(job_id, data)
+        print(f"  [{'추가' if added else '이미 있음'}] {title} ({job_id})")
+
+def run_worker(queue_dir, args, journal=None):
+    """공유 큐에서 작업을 하나씩 임대해 처리 (대기/임대 중인 작업이 모두 끝나면 종료)"""
+    queue = SharedQueue(queue_dir)
+    print(f"워커 {queue.node}: {queue_dir}")
+    results = []
+    while True:
+        lease = queue.claim()
+        if lease is None:
+            if not queue.active():
+                break
+            # 다른 노드가 처리 중: 끝나거나 임대가 만료될 때까지 대기
+            time.sleep(QUEUE_POLL_INTERVAL)
+            continue
+
+        data = lease.job['data']
+        title = data.get('title', 'download')
+        print(f"\n[queue] 작업 임대: {title} (시도 {lease.job['attempts']}/{QUEUE_MAX_ATTEMPTS})")
+        status, final_path, error = 'failed', None, None
+        plan = None
+        _queue_leases[lease.job_id] = lease
+        try:
+            plan = prepare_job(data, args, journal, batch=True)
+            if plan is None:
+                status = 'skipped'
+            else:
+                final_path = execute_job(plan, args, interactive=False)
+                status = 'done' if final_path else 'failed'
+        except LeaseLost as e:
+            print(f"\n[queue] {e}")
+        except Exception as e:
+            print(f"\n[오류] 작업 실패: {title}: {e}")
+            error = str(e)
+        finally:
+            _queue_leases.pop(lease.job_id, None)
+            discard_plan(plan)
+        lease.finish(status, final_path=final_path, error=error)
+        if lease.lost.is_set():
+            status = 'lost'
+        results.append((title, status, final_path))
+
+    print("\n" + "=" * 60)
+    print(f"워커 결과: {sum(1 for r in results if r[1] == 'done')}/{len(results)} 완료")
+    print("=" * 60)
+    for title, status, final_path in results:
+        label = {'done': '완료', 'skipped': '건너뜀', 'failed': '실패', 'lost': '임대 만료'}[status]
+        print(f"  [{label}] {title}" + (f" → {os.path.basename(final_path)}" if final_path else ""))
+    return results
+
+# 데몬 모드: 로컬 HTTP/Unix 소켓으로 작업을 받아 워커 풀에서 처리
+class JobService:
+    """데몬의 작업 큐와 작업별 상태/진행 상황"""
+
+    def __init__(self, args, journal=None, workers=DEFAULT_WORKERS):
+        self.args = args
+        self.journal = journal
+        self.lock = threading.Lock()
+        self.jobs = {}
+        self.pool = ThreadPoolExecutor(max_workers=max(1, workers))
+        _progress_listeners.append(self.on_progress)
+
+    def submit(self, data):
+        """작업 등록 (같은 작업이 대기/진행 중이면 기존 상태 반환)"""
+        title = data.get('title', 'download')
+        job_id = Journal.job_id(title, data.get('m3u8_list', []))
+        with self.lock:
+            job = self.jobs.get(job_id)
+            if job and job['state'] in ('queued', 'running'):
+                return dict(job)
+            job = self.jobs[job_id] = {
+                'id': job_id,
+                'title': title,
+                'state': 'queued',
+                'phase': None,
+                'variant_count': None,
+                'variants': {},
+                'final_path': None,
+                'error': None,
+                'submitted_at': time.time(),
+                'started_at': None,
+                'finished_at': None,
+            }
+        self.pool.submit(self.run, job_id, data)
+        return dict(job)
+
+    def run(self, job_id, data):
+        self.update(job_id, state='running', phase='preparing', started_at=time.time())
+        plan = None
+        try:
+            plan = prepare_job(data, self.args, self.journal, batch=True)
+            if plan is None:
+                self.update(job_id, state='skipped')
+            else:
+                final_path = execute_job(plan, self.args, interactive=False)
+                self.update(job_id, state='done' if final_path else 'failed',
+                            final_path=final_path)
+        except Exception as e:
+            self.update(job_id, state='failed', error=str(e))
+        finally:
+            discard_plan(plan)
+            self.update(job_id, phase=None, finished_at=time.time())
+            self.prune()
+
+    def prune(self, keep=KEEP_FINISHED_JOBS):
+        """끝난 작업은 최근 keep개만 남김 (대기/진행 중인 작업은 유지)"""
+        with self.lock:
+            finished = sorted((job for job in self.jobs.values() if job['finished_at']),
+                              key=lambda job: job['finished_at'])
+            for job in finished[:max(0, len(finished) - keep)]:
+                del self.jobs[job['id']]
+
+    def update(self, job_id, **fields):
+        with self.lock:
+            if job_id in self.jobs:
+                self.jobs[job_id].update(fields)
+
+    def on_progress(self, job_id, fields):
+        with self.lock:
+            job = self.jobs.get(job_id)
+            if not job:
+                return
+            fields = dict(fields)
+            variant = fields.pop('variant', None)
+            if variant is None:
+                job.update(fields)
+            else:
+                job['variants'].setdefault(str(variant), {}).update(
+                    {k: v for k, v in fields.items() if v is not None})
+
+    def get(self, job_id):
+        with self.lock:
+            job = self.jobs.get(job_id)
+            return json.loads(json.dumps(job)) if job else None
+
+    def list(self):
+        with self.lock:
+            return [{k: job[k] for k in ('id', 'title', 'state', 'phase', 'final_path')}
+                    for job in self.jobs.values()]
+
+class JobRequestHandler(BaseHTTPRequestHandler):
+    """POST /jobs, GET /jobs, GET /jobs/<id>
+
+    POST는 Content-Type: application/json만 받으므로 브라우저의 다른 사이트가 폼으로
+    작업을 넣을 수 없고, token이 있으면 모든 요청에 Authorization: Bearer 헤더를 요구합니다.
+    """
+
+    service = None
+    token = None
+
+    def send_json(self, status, body):
+        payload = json.dumps(body, ensure_ascii=False).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def authorized(self):
+        if not self.token:
+            return True
+        header = self.headers.get('Authorization', '')
+        if hmac.compare_digest(header.encode('utf-8'), f'Bearer {self.token}'.encode('utf-8')):
+            return True
+        self.send_json(401, {'error': '인증 토큰이 없거나 맞지 않습니다.'})
+        return False
+
+    def do_GET(self):
+        if not self.authorized():
+            return
+        path = urlparse(self.path).path.rstrip('/')
+        if path == '/jobs':
+            self.send_json(200, self.service.list())
+        elif path.startswith('/jobs/'):
+            job = self.service.get(path[len('/jobs/'):])
+            if job:
+                self.send_json(200, job)
+            else:
+                self.send_json(404, {'error': '작업을 찾을 수 없습니다.'})
+        else:
+            self.send_json(404, {'error': '지원하지 않는 경로입니다.'})
+
+    def do_POST(self):
+        if not self.authorized():
+            return
+        if urlparse(self.path).path.rstrip('/') != '/jobs':
+            self.send_json(404, {'error': '지원하지 않는 경로입니다.'})
+            return
+        content_type = self.headers.get('Content-Type', '').split(';')[0].strip().lower()
+        if content_type != 'application/json':
+            self.send_json(415, {'error': 'Content-Type: application/json으로 보내야 합니다.'})
+            return
+        length = int(self.headers.get('Content-Length') or 0)
+        try:
+            data = json.loads(self.rfile.read(length).decode('utf-8'))
+        except (UnicodeDecodeError, json.JSONDecodeError) as e:
+            self.send_json(400, {'error': f'JSON 파싱 실패: {e}'})
+            return
+        if not isinstance(data, dict) or 'm3u8_list' not in data:
+            self.send_json(400, {'error': "JSON에 'm3u8_list' 필드가 없습니다."})
+            return
+        self.send_json(202, self.service.submit(data))
+
+    def address_string(self):
+        # Unix 소켓은 client_address가 비어 있음
+        return self.client_address[0] if self.client_address else 'unix'
+
+    def log_message(self, format, *args):
+        print(f"[serve] {self.address_string()} {format % args}")
+
+class UnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+def serve(address, args, journal=None):
+    """데몬 실행 (address: HOST:PORT 또는 unix:/경로)"""
+    handler = type('Handler', (JobRequestHandler,), {
+        'service': JobService(args, journal, args.workers),
+        'token': args.serve_token,
+    })
+    if address.startswith('unix:'):
+        sock_path = address[len('unix:'):]
+        if os.path.exists(sock_path):
+            os.remove(sock_path)
+        server = UnixHTTPServer(sock_path, handler)
+    else:
+        host, _, port = address.rpartition(':')
+        server = ThreadingHTTPServer((host or '127.0.0.1', int(port)), handler)
+
+    print(f"naver-dl 데몬 실행 중: {address} (워커 {args.workers}개"
+          f"{', 토큰 인증' if args.serve_token else ''})")
+    print("  POST /jobs        작업 JSON 등록")
+    print("  GET  /jobs        작업 목록")
+    print("  GET  /jobs/<id>   작업 상태/진행 상황")
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+
 def main():
+    global _tracer, _library
     parser = argparse.ArgumentParser(
         description='네이버 프리미엄 m3u8 다운로더',
         formatter_class=argparse.RawDescriptionHelpFormatter,
@@ -374,6 +2910,19 @@ def main():
   naver-dl --export-cookies     # Firefox에서 쿠키 추출
   naver-dl --import-cookies     # 쿠키 가져오기 (클립보드)
   naver-dl --show-cookies       # 저장된 쿠키 출력
+  naver-dl -j 6                 # variant 6개까지 동시 다운로드
+  naver-dl --no-preflight       # 매니페스트 확인 없이 모든 variant 다운로드
+  naver-dl --engine inprocess   # yt-dlp를 프로세스 하나에서 재사용
+  naver-dl --engine native      # 세그먼트를 직접 받음 (동시 연결 수 자동 조절)
+  naver-dl --engine native --stream-remux  # ffmpeg로 바로 remux (MP4만 디스크에 씀)
+  naver-dl --bandwidth 8M       # 호스트당 8MB/s (다른 naver-dl/yt-dl과 공유)
+  naver-dl --metrics-file /var/lib/node_exporter/naver-dl.prom  # 진행 메트릭 기록
+  naver-dl --trace trace.json   # 단계별 소요 시간 기록 (Perfetto에서 열기)
+  naver-dl --queue jobs.jsonl   # JSONL 작업을 무인으로 처리 (-는 표준 입력)
+  naver-dl --force              # 이미 받은 영상도 다시 다운로드
+  naver-dl --serve              # 데몬 모드 (POST /jobs 로 작업 등록)
+  naver-dl --enqueue /mnt/q --queue jobs.jsonl  # 공유 큐에 작업 추가
+  naver-dl --worker /mnt/q      # 공유 큐의 작업 처리 (머신마다 실행)
 
 JSON 입력 형식:
 {
@@ -392,8 +2941,70 @@ JSON 입력 형식:
                         help='쿠키 가져오기 (클립보드)')
     parser.add_argument('--show-cookies', '-s', action='store_true',
                         help='저장된 쿠키 출력')
+    parser.add_argument('--concurrency', '-j', type=int, default=DEFAULT_CONCURRENCY,
+                        metavar='N',
+                        help=f'작업당 동시 다운로드 수 (기본: {DEFAULT_CONCURRENCY})')
+    parser.add_argument('--max-downloads', type=int, default=DEFAULT_MAX_DOWNLOADS,
+                        metavar='N',
+                        help=f'전체 동시 다운로드 상한 (기본: {DEFAULT_MAX_DOWNLOADS})')
+    parser.add_argument('--no-preflight', action='store_true',
+                        help='매니페스트 사전 확인 없이 모든 variant 다운로드')
+    parser.add_argument('--no-validate', action='store_true',
+                        help='다운로드 전 토큰/세그먼트 접근 검증 생략')
+    parser.add_argument('--queue', '-q', metavar='FILE',
+                        help='JSONL 작업 파일을 무인으로 처리 (-는 표준 입력)')
+    parser.add_argument('--enqueue', metavar='DIR',
+                        help='작업을 공유 큐 디렉터리에 추가만 함 (--queue 파일 또는 클립보드 JSON)')
+    parser.add_argument('--worker', metavar='DIR',
+                        help='공유 큐 디렉터리에서 작업을 임대해 처리 (여러 머신/프로세스에서 동시 실행)')
+    parser.add_argument('--serve', nargs='?', const=DEFAULT_SERVE_ADDRESS, metavar='ADDR',
+                        help='데몬 모드: HOST:PORT 또는 unix:/경로에서 작업 JSON을 받음 '
+                             f'(기본: {DEFAULT_SERVE_ADDRESS})')
+    parser.add_argument('--serve-token', metavar='TOKEN',
+                        default=os.environ.get('NAVER_DL_TOKEN'),
+                        help='데몬 요청에 Authorization: Bearer TOKEN 헤더를 요구 '
+                             '(기본: NAVER_DL_TOKEN 환경 변수)')
+    parser.add_argument('--workers', type=int, default=DEFAULT_WORKERS, metavar='N',
+                        help=f'데몬에서 동시에 처리할 작업 수 (기본: {DEFAULT_WORKERS})')
+    parser.add_argument('--restart', action='store_true',
+                        help='작업 저널을 무시하고 처음부터 다시 다운로드')
+    parser.add_argument('--no-journal', action='store_true',
+                        help='작업 저널을 사용하지 않음 (이어받기 불가)')
+    parser.add_argument('--force', action='store_true',
+                        help='라이브러리에 이미 있는 영상도 다시 다운로드')
+    parser.add_argument('--rate-limit', type=float, default=DEFAULT_REQUEST_RATE, metavar='N',
+                        help='호스트당 초당 요청 수 한도, 실행 중인 모든 naver-dl/yt-dl이 공유 '
+                             f'(0은 제한 없음, 기본: {DEFAULT_REQUEST_RATE:g})')
+    parser.add_argument('--bandwidth', type=parse_rate, default=None, metavar='RATE',
+                        help='호스트당 대역폭 한도 (예: 8M, 500K), 실행 중인 모든 다운로드가 공유')
+    parser.add_argument('--engine', choices=['subprocess', 'inprocess', 'native'],
+                        default='subprocess',
+                        help='다운로드 방식: URL마다 yt-dlp 프로세스 실행, 한 프로세스에서 '
+                             'yt-dlp Python API 재사용, 또는 세그먼트 직접 다운로드 '
+                             '(기본: subprocess)')
+    parser.add_argument('--metrics-file', metavar='FILE',
+                        help='다운로드 진행 메트릭을 기록할 파일 '
+                             '(.prom이면 Prometheus textfile, 그 밖에는 JSON)')
+    parser.add_argument('--trace', metavar='FILE',
+                        help='단계/variant별 소요 시간을 Chrome trace JSON으로 기록하고 '
+                             '끝날 때 요약 표 출력 (chrome://tracing, ui.perfetto.dev)')
+    parser.add_argument('--stream-remux', action='store_true',
+                        help='native 엔진에서 세그먼트를 ffmpeg로 바로 흘려 MP4만 저장 '
+                             '(중간 TS 파일 없음, 이어받기 불가)')
 
     args = parser.parse_args()
+    set_max_downloads(args.max_downloads)
+    set_rate_limits(args.rate_limit, args.bandwidth)
+
+    if args.stream_remux and args.engine != 'native':
+        parser.error('--stream-remux는 --engine native에서만 사용할 수 있습니다')
+
+    if args.engine == 'inprocess':
+        try:
+            import yt_dlp  # noqa: F401
+        except ImportError:
+            print("inprocess 엔진에는 yt-dlp 파이썬 패키지가 필요합니다 (pip install yt-dlp)")
+            sys.exit(1)
 
     if args.export_cookies:
         export_cookies()
@@ -411,86 +3022,52 @@ JSON 입력 형식:
             print(f"쿠키 파일이 없습니다: {DEFAULT_COOKIE_FILE}")
         return
 
-    # JSON 입력 처리
-    data = process_json_input()
-
-    if not data:
-        print("JSON 데이터가 없거나 잘못되었습니다.")
-        print("클립보드에 JSON을 복사한 후 다시 시도하세요.")
-        sys.exit(1)
-
-    title = data.get('title', 'download')
-    referer = data.get('referer', 'https://contents.premium.naver.com/')
-    m3u8_list = data.get('m3u8_list', [])
-    cookies_netscape = data.get('cookies_netscape')
+    journal = None if args.no_journal else Journal()
+    _library = Library()
 
-    print(f"\n제목: {title}")
-    print(f"리퍼러: {referer[:60]}...")
-    print(f"m3u8 URL: {len(m3u8_list)}개")
+    if args.trace:
+        _tracer = Tracer(args.trace)
+        atexit.register(finish_trace)
 
-    # 쿠키 처리
-    cookie_file = args.cookies
-    if cookies_netscape:
-        # JSON에 쿠키가 포함된 경우 임시 파일로 저장
-        cookie_file = DEFAULT_COOKIE_FILE
-        with open(cookie_file, 'w', encoding='utf-8') as f:
-            f.write(cookies_netscape)
-        print(f"쿠키: JSON에서 로드됨")
-    elif not cookie_file and os.path.exists(DEFAULT_COOKIE_FILE):
-        cookie_file = DEFAULT_COOKIE_FILE
-        print(f"쿠키: {cookie_file}")
-    else:
-        print(f"쿠키: Firefox 브라우저")
-
-    output_dir = os.getcwd()
-    print(f"저장 위치: {output_dir}")
-    print(f"\n다운로드를 시작합니다...")
+    if args.metrics_file:
+        exporter = MetricsExporter(args.metrics_file, 'naver_dl', ('job', 'variant'))
+        _progress_listeners.append(variant_metrics_listener(exporter))
+        atexit.register(exporter.flush)
 
-    # 다운로드 실행
-    downloaded_files = []
-    for i, url in enumerate(m3u8_list, 1):
-        filepath = download_url(url, i, len(m3u8_list), referer, output_dir, cookie_file)
-        downloaded_files.append(filepath)
+    if args.enqueue:
+        if args.queue:
+            jobs = read_jsonl_jobs(args.queue)
+        else:
+            data = process_json_input()
+            jobs = [data] if data else []
+        enqueue_jobs(args.enqueue, jobs)
+        return
 
-    # 파일 분석
-    print("\n파일 분석 중...")
-    results = []
-    for filepath in downloaded_files:
-        info = analyze_file(filepath)
-        results.append(info)
+    if args.serve:
+        serve(args.serve, args, journal)
+        return
 
-    # 최적 파일 선택
-    selected = select_best_video(results, title)
+    if args.worker:
+        results = run_worker(args.worker, args, journal)
+        sys.exit(0 if all(r[1] != 'failed' for r in results) else 1)
 
-    if selected:
-        # 파일명 변경
-        safe_title = sanitize_filename(title)
-        new_filename = f"{safe_title}.mp4"
-        new_filepath = os.path.join(output_dir, new_filename)
+    if args.queue:
+        results = run_queue(args.queue, args, journal)
+        sys.exit(0 if all(r[1] != 'failed' for r in results) else 1)
 
-        # 동일 파일명이 이미 존재하면 번호 추가
-        counter = 1
-        while os.path.exists(new_filepath):
-            new_filename = f"{safe_title}_{counter}.mp4"
-            new_filepath = os.path.join(output_dir, new_filename)
-            counter += 1
+    # JSON 입력 처리
+    data = process_json_input()
 
-        try:
-            os.rename(selected['filepath'], new_filepath)
-            print(f"\n최종 파일: {new_filename}")
-            print(f"  해상도: {selected.get('width')}x{selected.get('height')}")
-            print(f"  길이: {format_duration(selected.get('duration'))}")
-            print(f"  용량: {format_size(selected.get('size', 0))}")
-        except Exception as e:
-            print(f"파일명 변경 실패: {e}")
-            print(f"원본 파일: {selected['filepath']}")
+    if not data:
+        print("JSON 데이터가 없거나 잘못되었습니다.")
+        print("클립보드에 JSON을 복사한 후 다시 시도하세요.")
+        sys.exit(1)
 
-    # patched m3u8 파일 정리
-    for f in Path(output_dir).glob("patched_*.m3u8"):
-        try:
-            os.remove(f)
-        except:
-            pass
+    try:
+        run_job(data, args, journal)
+    except PreflightError as e:
+        print(f"\n[오류] 다운로드할 수 없습니다: {e}")
+        sys.exit(1)
 
     print("\n완료!")
 
@@ -498,5 +3075,5 @@ if __name__ == "__main__":
     try:
         main()
     except KeyboardInterrupt:
-        print("\n\n중단되었습니다.")
+        print("\n\n중단되었습니다. 같은 JSON으로 다시 실행하면 이어서 받습니다.")
         sys.exit(0)
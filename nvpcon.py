@@ -1,80 +1,426 @@
-# aaa.py (v3: 세그먼트 경로 처리 강화)
+# nvpcon.py (v5: 전용 추출기 NaverVodIE, GenericIE 패치 제거)
 
 import re
-import os
+import time
+import base64
+import itertools
+import threading
+from collections import OrderedDict, deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
 from urllib.parse import urlparse, parse_qs, urljoin
 
-# 기존 GenericIE 추출기를 가져옵니다.
-from yt_dlp.extractor.generic import GenericIE
+from yt_dlp.extractor.common import InfoExtractor
 from yt_dlp.utils import ExtractorError
 
-print('[DEBUG] Naver Premium Patcher (v3 - Robust Path) is running!')
-
-_original_real_extract = GenericIE._real_extract
-
-def _new_real_extract(self, url):
-    if 'b01-kr-naver-vod.pstatic.net' not in url:
-        return _original_real_extract(self, url)
-
-    print(f'[DEBUG] Patching URL: {url}')
-    
-    parsed_path = urlparse(url).path
-    video_id = os.path.splitext(os.path.basename(parsed_path))[0]
-    
-    parsed_url = urlparse(url)
-    query_params = parse_qs(parsed_url.query)
-    lsu_sa_token = query_params.get('_lsu_sa_', [None])[0]
-
-    if not lsu_sa_token:
-        raise ExtractorError('URL에서 _lsu_sa_ 토큰을 찾을 수 없습니다.', expected=True)
-
-    # 1. 원본 매니페스트 다운로드
-    manifest_content = self._download_webpage(
-        url, video_id, note='Downloading M3U8 manifest')
-
-    # 2. 매니페스트 내용 수정 (urljoin 사용으로 경로 문제 해결)
-    def build_full_url(match):
-        path = match.group(1).strip()
-        
-        # 이미 완전한 URL인 경우
-        if path.startswith(('http://', 'https://')):
-            full_path = path
+# URI="..." 속성을 가진 HLS 태그
+_URI_TAGS = (
+    '#EXT-X-KEY', '#EXT-X-SESSION-KEY', '#EXT-X-MAP', '#EXT-X-MEDIA',
+    '#EXT-X-I-FRAME-STREAM-INF', '#EXT-X-PART', '#EXT-X-PRELOAD-HINT',
+    '#EXT-X-RENDITION-REPORT', '#EXT-X-SESSION-DATA',
+)
+_URI_ATTR_RE = re.compile(r'URI="([^"]*)"')
+
+# 같은 영상의 variant/재시도 간에 공유하는 AES 키와 init 세그먼트
+_RESOURCE_CACHE = OrderedDict()
+_RESOURCE_CACHE_SIZE = 256
+_INLINE_MAX_BYTES = 1024 * 1024
+
+# ENDLIST가 없는(아직 자라는) 플레이리스트를 로컬 서버로 중계
+_HEADER_TAGS = (
+    '#EXTM3U', '#EXT-X-VERSION', '#EXT-X-TARGETDURATION', '#EXT-X-MEDIA-SEQUENCE',
+    '#EXT-X-DISCONTINUITY-SEQUENCE', '#EXT-X-PLAYLIST-TYPE', '#EXT-X-INDEPENDENT-SEGMENTS',
+    '#EXT-X-START', '#EXT-X-ALLOW-CACHE',
+)
+_LIVE_IDLE_TIMEOUT = 120    # 새 세그먼트가 이만큼(초) 없으면 방송이 끝난 것으로 봄
+_LIVE_MAX_ERRORS = 5        # 연속으로 이만큼 새로 고침에 실패하면 중단
+_LIVE_LINGER = 30           # 끝난 뒤 다운로더가 ENDLIST를 받아 갈 때까지 등록을 유지하는 최대 시간(초)
+_live_server = None
+_live_playlists = {}
+_live_ids = itertools.count()
+_live_lock = threading.Lock()
+
+
+def add_token(url, base_url, token):
+    """상대 경로를 절대 URL로 바꾸고 _lsu_sa_ 토큰 추가"""
+    # urljoin을 사용하여 상대 경로를 절대 경로로 안전하게 변환
+    # (이미 완전한 URL이면 그대로 유지됨)
+    full_url = urljoin(base_url, url.strip())
+    if not full_url.startswith(('http://', 'https://')):
+        # data:, skd:// 등은 건드리지 않음
+        return full_url
+
+    # 이미 토큰이 있는지 확인하여 중복 방지
+    if '_lsu_sa_=' in full_url:
+        return full_url
+
+    separator = '&' if '?' in full_url else '?'
+    return f"{full_url}{separator}_lsu_sa_={token}"
+
+
+def rewrite_playlist(content, base_url, token, resolve_tag_uri=None):
+    """m3u8을 한 줄씩 읽으며 URI 줄과 태그의 URI 속성에 토큰 추가"""
+    lines = []
+    for line in content.splitlines():
+        stripped = line.strip()
+        if not stripped:
+            lines.append(line)
+        elif stripped.startswith('#'):
+            tag = stripped.split(':', 1)[0]
+            if tag in _URI_TAGS:
+                def replace_uri(match):
+                    uri = add_token(match.group(1), base_url, token)
+                    if resolve_tag_uri:
+                        uri = resolve_tag_uri(tag, stripped, uri)
+                    return f'URI="{uri}"'
+                stripped = _URI_ATTR_RE.sub(replace_uri, stripped)
+            lines.append(stripped)
+        else:
+            lines.append(add_token(stripped, base_url, token))
+    return '\n'.join(lines) + '\n'
+
+
+def child_playlist_urls(patched_master):
+    """패치된 master에서 variant/미디어 플레이리스트 URL 목록"""
+    urls = []
+    expect_uri = False
+    for line in patched_master.splitlines():
+        line = line.strip()
+        if line.startswith('#EXT-X-STREAM-INF:'):
+            expect_uri = True
+        elif line.startswith('#EXT-X-MEDIA:'):
+            match = _URI_ATTR_RE.search(line)
+            if match:
+                urls.append(match.group(1))
+        elif line and not line.startswith('#') and expect_uri:
+            urls.append(line)
+            expect_uri = False
+    return list(dict.fromkeys(urls))
+
+
+def _cache_key(video_id, url):
+    """캐시 키 (쿼리 문자열은 토큰마다 달라지므로 제외)"""
+    return video_id, urlparse(url).path
+
+
+def _fetch_inline_resource(ie, video_id, url, note):
+    """키/init 세그먼트를 한 번만 받아 data: URI로 반환 (실패 시 None)"""
+    key = _cache_key(video_id, url)
+    if key in _RESOURCE_CACHE:
+        _RESOURCE_CACHE.move_to_end(key)
+        return _RESOURCE_CACHE[key]
+
+    urlh = ie._request_webpage(url, video_id, note=note, fatal=False)
+    if not urlh:
+        return None
+    data = urlh.read()
+    if len(data) > _INLINE_MAX_BYTES:
+        return None
+
+    data_uri = 'data:application/octet-stream;base64,' + base64.b64encode(data).decode()
+    _RESOURCE_CACHE[key] = data_uri
+    while len(_RESOURCE_CACHE) > _RESOURCE_CACHE_SIZE:
+        _RESOURCE_CACHE.popitem(last=False)
+    return data_uri
+
+
+def patch_playlist(ie, video_id, url, token, content=None):
+    """플레이리스트를 받아 토큰을 추가하고 키/init 세그먼트를 인라인"""
+    if content is None:
+        content = ie._download_webpage(url, video_id, note='Downloading M3U8 manifest')
+
+    def resolve_tag_uri(tag, line, uri):
+        if tag == '#EXT-X-KEY' and 'METHOD=AES-128' in line:
+            return _fetch_inline_resource(ie, video_id, uri, 'Downloading AES key') or uri
+        if tag == '#EXT-X-MAP':
+            return _fetch_inline_resource(ie, video_id, uri, 'Downloading init segment') or uri
+        return uri
+
+    return rewrite_playlist(content, url, token, resolve_tag_uri)
+
+
+def is_live_playlist(content):
+    """아직 자라는 미디어 플레이리스트인지 (ENDLIST 없음, VOD 아님)"""
+    return ('#EXT-X-STREAM-INF' not in content and '#EXT-X-ENDLIST' not in content
+            and '#EXT-X-PLAYLIST-TYPE:VOD' not in content)
+
+
+class LivePlaylist:
+    """자라는 플레이리스트를 target duration마다 다시 받아 새 세그먼트에만 토큰 추가
+
+    이미 처리한 위치를 커서로 기억합니다. EVENT 플레이리스트는 앞부분이 바뀌지 않으므로
+    바이트 오프셋 이후만 읽고, 슬라이딩 윈도우 라이브는 media sequence로 이미 본 세그먼트를
+    정규식 없이 건너뛰므로 새로 고침 비용이 플레이리스트 전체 길이와 무관합니다.
+    """
+
+    def __init__(self, ie, video_id, url, token, content):
+        self.ie = ie
+        self.video_id = video_id
+        self.source_url = url
+        self.token = token
+        self.path = None            # 로컬 서버 경로 (start_live_playlist가 등록)
+        self.lock = threading.Lock()
+        self.header = []
+        self.segments = deque()     # (media sequence, 직전 KEY/MAP 줄, 패치된 블록, DISCONTINUITY 여부)
+        self.discontinuity_seq = None
+        self.block = []             # URI 줄을 아직 못 만난 세그먼트 태그
+        self.key_line = None
+        self.map_line = None
+        self.next_seq = 0
+        self.cursor = 0
+        self.event = '#EXT-X-PLAYLIST-TYPE:EVENT' in content
+        self.target_duration = 6.0
+        self.ended = False
+        self.last_growth = time.monotonic()
+        self.last_served = time.monotonic()
+        self.final_served = threading.Event()
+        self.document = None
+        self._parse_header(content)
+        self._consume(content)
+
+    def _parse_header(self, content):
+        head = content[:content.find('#EXTINF')] if '#EXTINF' in content else content
+        for line in head.splitlines():
+            line = line.strip()
+            tag = line.split(':', 1)[0]
+            if tag == '#EXT-X-TARGETDURATION':
+                self.target_duration = float(line.split(':', 1)[1] or 6)
+            elif tag == '#EXT-X-MEDIA-SEQUENCE':
+                self.next_seq = int(line.split(':', 1)[1] or 0)
+            elif tag == '#EXT-X-DISCONTINUITY-SEQUENCE':
+                # 윈도우 앞에서 빠진 DISCONTINUITY 수: render에서 다시 쓰고, 빠질 때마다 늘림
+                self.discontinuity_seq = int(line.split(':', 1)[1] or 0)
+            if tag in _HEADER_TAGS and tag not in ('#EXT-X-MEDIA-SEQUENCE', '#EXT-X-DISCONTINUITY-SEQUENCE'):
+                self.header.append(line)
+
+    def _consume(self, content):
+        """새로 받은 플레이리스트에서 처음 보는 세그먼트만 패치"""
+        if self.event:
+            if len(content) < self.cursor:
+                return 0  # 서버가 잘린 문서를 보냄: 다음 새로 고침에서 다시 확인
+            # 완성된 줄까지만 읽고 나머지는 다음 새로 고침에서 이어 읽음
+            end = len(content) if content[-64:].rstrip().endswith('#EXT-X-ENDLIST') \
+                else content.rfind('\n') + 1
+            text, seq = content[self.cursor:end], self.next_seq
+            self.cursor = max(self.cursor, end)
+        else:
+            head = content[:content.find('#EXTINF')] if '#EXTINF' in content else content
+            match = re.search(r'#EXT-X-MEDIA-SEQUENCE:(\d+)', head)
+            text, seq = content, int(match.group(1)) if match else 0
+            self.block = []
+
+        added = 0
+        for line in text.splitlines():
+            stripped = line.strip()
+            if not stripped:
+                continue
+            if stripped.startswith('#'):
+                tag = stripped.split(':', 1)[0]
+                if tag == '#EXT-X-ENDLIST':
+                    self.ended = True
+                elif tag not in _HEADER_TAGS:
+                    self.block.append(stripped)
+                continue
+            if seq >= self.next_seq:
+                patched = rewrite_playlist('\n'.join(self.block + [stripped]),
+                                           self.source_url, self.token)
+                for block_line in patched.splitlines():
+                    if block_line.startswith('#EXT-X-KEY'):
+                        self.key_line = block_line
+                    elif block_line.startswith('#EXT-X-MAP'):
+                        self.map_line = block_line
+                self.segments.append((seq, self.key_line, self.map_line, patched,
+                                      '#EXT-X-DISCONTINUITY' in self.block))
+                self.next_seq = seq + 1
+                added += 1
+            self.block = []
+            seq += 1
+
+        if not self.event:
+            # 원본 윈도우에서 빠진 세그먼트는 중계 문서에서도 제거
+            first = int(match.group(1)) if match else 0
+            while self.segments and self.segments[0][0] < first:
+                if self.segments.popleft()[4]:
+                    self.discontinuity_seq = (self.discontinuity_seq or 0) + 1
+        if added or self.ended:
+            self.last_growth = time.monotonic()
+            self.document = None
+        return added
+
+    def refresh(self):
+        content = self.ie._download_webpage(
+            self.source_url, self.video_id, note=False, fatal=False)
+        if content is False:
+            return None
+        with self.lock:
+            return self._consume(content)
+
+    def run(self):
+        """target duration마다 새로 고침 (ENDLIST 또는 오랫동안 변화가 없으면 종료)
+
+        끝나면 다운로더가 ENDLIST가 든 마지막 문서를 받아 간 뒤 등록을 해제합니다.
+        다운로더가 오랫동안 요청하지 않으면(다운로드가 끝났거나 중단됨) 바로 해제합니다.
+        """
+        errors = 0
+        idle_timeout = max(_LIVE_IDLE_TIMEOUT, 3 * self.target_duration)
+        abandoned = False
+        while not self.ended:
+            time.sleep(self.target_duration)
+            added = self.refresh()
+            errors = errors + 1 if added is None else 0
+            abandoned = time.monotonic() - self.last_served > idle_timeout
+            if abandoned or errors >= _LIVE_MAX_ERRORS \
+                    or time.monotonic() - self.last_growth > idle_timeout:
+                if abandoned:
+                    self.ie.write_debug(f'Live playlist relay abandoned: {self.source_url}')
+                else:
+                    self.ie.report_warning(f'라이브 플레이리스트 새로 고침 중단: {self.source_url}')
+                with self.lock:
+                    self.ended = True
+                    self.document = None
+        if not abandoned:
+            self.final_served.wait(max(_LIVE_LINGER, 3 * self.target_duration))
+        stop_live_playlist(self.path)
+
+    def render(self):
+        """다운로더에 보낼 현재 플레이리스트 (보낸 시각과 마지막 문서를 보냈는지 기록)"""
+        with self.lock:
+            self.last_served = time.monotonic()
+            if self.ended:
+                self.final_served.set()
+            if self.document is None:
+                lines = list(self.header)
+                if self.segments:
+                    first_seq, key_line, map_line, first_block, _ = self.segments[0]
+                    lines.append(f'#EXT-X-MEDIA-SEQUENCE:{first_seq}')
+                    if self.discontinuity_seq is not None:
+                        lines.append(f'#EXT-X-DISCONTINUITY-SEQUENCE:{self.discontinuity_seq}')
+                    # 윈도우 앞에서 잘린 KEY/MAP은 첫 세그먼트 앞에 다시 넣음
+                    for state in (key_line, map_line):
+                        if state and state not in first_block:
+                            lines.append(state)
+                    lines.extend(block.rstrip('\n') for _, _, _, block, _ in self.segments)
+                if self.ended:
+                    lines.append('#EXT-X-ENDLIST')
+                self.document = '\n'.join(lines) + '\n'
+            return self.document
+
+
+class _LivePlaylistHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        playlist = _live_playlists.get(urlparse(self.path).path)
+        if playlist is None:
+            self.send_error(404)
+            return
+        body = playlist.render().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/vnd.apple.mpegurl')
+        self.send_header('Content-Length', str(len(body)))
+        self.send_header('Cache-Control', 'no-cache')
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_live_playlist(ie, video_id, url, token, content):
+    """로컬 서버에 중계 플레이리스트를 등록하고 새로 고침 스레드 시작 (로컬 URL 반환)"""
+    global _live_server
+    playlist = LivePlaylist(ie, video_id, url, token, content)
+    with _live_lock:
+        if _live_server is None:
+            _live_server = ThreadingHTTPServer(('127.0.0.1', 0), _LivePlaylistHandler)
+            _live_server.daemon_threads = True
+            threading.Thread(target=_live_server.serve_forever, daemon=True).start()
+        playlist.path = f'/live/{next(_live_ids)}/{video_id}.m3u8'
+        _live_playlists[playlist.path] = playlist
+        port = _live_server.server_address[1]
+    threading.Thread(target=playlist.run, daemon=True).start()
+    ie.write_debug(f'Live playlist relay: {url} -> {playlist.path}')
+    return f'http://127.0.0.1:{port}{playlist.path}'
+
+
+def stop_live_playlist(path):
+    """중계 플레이리스트 등록 해제 (남은 것이 없으면 로컬 서버도 종료)"""
+    global _live_server
+    with _live_lock:
+        _live_playlists.pop(path, None)
+        if _live_playlists or _live_server is None:
+            return
+        server, _live_server = _live_server, None
+    server.shutdown()
+    server.server_close()
+
+
+class NaverVodIE(InfoExtractor):
+    """네이버 VOD 서버의 m3u8을 토큰 패치 후 다운로드
+
+    _VALID_URL만으로 URL을 판별하므로 다른 추출기를 거치지 않고 바로 선택되며,
+    import 시 아무 동작도 하지 않습니다.
+    """
+    IE_NAME = 'naver:vod'
+    IE_DESC = '네이버 프리미엄 콘텐츠 VOD (b01-kr-naver-vod.pstatic.net)'
+    _VALID_URL = r'https?://b01-kr-naver-vod\.pstatic\.net/(?:[^/?#]+/)*(?P<id>[^/?#]+?)(?:\.m3u8)?(?:[?#]|$)'
+
+    def _real_extract(self, url):
+        video_id = self._match_id(url)
+        self.write_debug(f'Patching URL: {url}')
+
+        lsu_sa_token = parse_qs(urlparse(url).query).get('_lsu_sa_', [None])[0]
+        if not lsu_sa_token:
+            raise ExtractorError('URL에서 _lsu_sa_ 토큰을 찾을 수 없습니다.', expected=True)
+
+        # 1. 원본 매니페스트 다운로드
+        content = self._download_webpage(url, video_id, note='Downloading M3U8 manifest')
+        is_live = False
+
+        # 2. 패치된 매니페스트를 메모리에 둔 채 HLS 다운로더에 직접 전달
+        #    (파일 저장/file:// URL 없이 동시 실행해도 충돌하지 않음)
+        #    아직 자라는 플레이리스트는 로컬 서버가 새로 고침하며 중계 (ffmpeg가 폴링)
+        if '#EXT-X-STREAM-INF' not in content:
+            if is_live_playlist(content):
+                is_live = True
+                formats = [{
+                    'url': start_live_playlist(self, video_id, url, lsu_sa_token, content),
+                    'protocol': 'm3u8',
+                    'ext': 'mp4',
+                }]
+            else:
+                formats = [{
+                    'url': url,
+                    'protocol': 'm3u8_native',
+                    'ext': 'mp4',
+                    'hls_media_playlist_data': patch_playlist(
+                        self, video_id, url, lsu_sa_token, content),
+                }]
         else:
-            # urljoin을 사용하여 상대 경로를 절대 경로로 안전하게 변환
-            # url: 원본 m3u8의 URL (Base URL 역할)
-            full_path = urljoin(url, path)
-        
-        # 쿼리 파라미터(? 또는 &) 처리 및 토큰 추가
-        # 이미 토큰이 있는지 확인하여 중복 방지
-        if '_lsu_sa_=' in full_path:
-            return full_path
-            
-        separator = '&' if '?' in full_path else '?'
-        return f"{full_path}{separator}_lsu_sa_={lsu_sa_token}"
-
-    modified_manifest = re.sub(
-        r'^(?!#)(.+\.(ts|key|mp4|m3u8).*)$', build_full_url, manifest_content, flags=re.MULTILINE)
-
-    # 3. 로컬 파일로 저장
-    filename = f"patched_{video_id}.m3u8"
-    abs_path = os.path.abspath(filename)
-    
-    with open(abs_path, 'w', encoding='utf-8') as f:
-        f.write(modified_manifest)
-
-    print(f'[DEBUG] Saved patched manifest to: {abs_path}')
-
-    # 4. yt-dlp에게 file:// URL 전달
-    file_url = f'file://{abs_path}'
-
-    return {
-        'id': video_id,
-        'title': video_id,
-        'formats': [{
-            'url': file_url,
-            'protocol': 'm3u8_native',
-            'ext': 'mp4',
-        }],
-    }
-
-GenericIE._real_extract = _new_real_extract
+            # master: variant/미디어 플레이리스트도 각각 패치 (키는 캐시로 한 번만 받음)
+            manifest = patch_playlist(self, video_id, url, lsu_sa_token, content)
+            children = {}
+            for child_url in child_playlist_urls(manifest):
+                child = self._download_webpage(
+                    child_url, video_id, note='Downloading M3U8 manifest')
+                if is_live_playlist(child):
+                    is_live = True
+                    children[child_url] = {
+                        'url': start_live_playlist(self, video_id, child_url, lsu_sa_token, child),
+                        'protocol': 'm3u8',
+                    }
+                else:
+                    children[child_url] = {
+                        'hls_media_playlist_data': patch_playlist(
+                            self, video_id, child_url, lsu_sa_token, child),
+                    }
+
+            formats = self._parse_m3u8_formats(
+                manifest, url, ext='mp4', entry_protocol='m3u8_native')
+            for f in formats:
+                if f.get('url') in children:
+                    f.update(children[f['url']])
+
+        return {
+            'id': video_id,
+            'title': video_id,
+            'formats': formats,
+            'is_live': is_live,
+        }
@@ -0,0 +1,164 @@
+#!/usr/bin/env python3
+# queue-test: 여러 워커 프로세스로 dlcommon 공유 큐를 돌려 작업이 정확히 한 번만 끝나는지 확인
+# (실제 다운로드 대신 잠깐 기다리는 가짜 작업을 쓰므로 네트워크에 접속하지 않음)
+
+import os
+import sys
+import json
+import signal
+import argparse
+import subprocess
+import tempfile
+import time
+
+from dlcommon import LeaseLost, SharedQueue
+
+POLL_INTERVAL = 0.1
+
+def run_worker(root, node, ttl, work):
+    """가짜 작업 처리: work초 동안 임대를 확인하며 기다린 뒤 log에 완료를 남김"""
+    queue = SharedQueue(root, node=node, lease_ttl=ttl)
+    log_path = os.path.join(root, 'log.jsonl')
+    while True:
+        lease = queue.claim()
+        if lease is None:
+            if not queue.active():
+                return
+            time.sleep(POLL_INTERVAL)
+            continue
+        event = 'completed'
+        try:
+            deadline = time.monotonic() + lease.job['data'].get('work', work)
+            while time.monotonic() < deadline:
+                lease.check()
+                time.sleep(0.02)
+        except LeaseLost:
+            event = 'lost'
+        if event == 'completed':
+            # 작업을 마친 뒤 finish 전에 임대를 잃을 수도 있으므로 finish가 기록한 경우만 완료로 셈
+            event = 'completed' if lease.finish('done', node=node) else 'lost'
+        else:
+            lease.finish('failed')
+        # O_APPEND 한 줄 쓰기는 프로세스 사이에서 섞이지 않음
+        with open(log_path, 'a', encoding='utf-8') as f:
+            f.write(json.dumps({'job': lease.job_id, 'node': node, 'event': event}) + '\n')
+
+def spawn(root, node, ttl, work):
+    return subprocess.Popen([sys.executable, os.path.abspath(__file__), '--worker', root,
+                             '--node', node, '--ttl', str(ttl), '--work', str(work)])
+
+def read_log(root):
+    try:
+        with open(os.path.join(root, 'log.jsonl'), 'r', encoding='utf-8') as f:
+            return [json.loads(line) for line in f if line.strip()]
+    except FileNotFoundError:
+        return []
+
+def check_exactly_once(root, job_ids):
+    """모든 작업이 done/에 있고, 완료 기록이 작업마다 하나이며 done/ 파일의 노드와 같은지"""
+    errors = []
+    queue = SharedQueue(root)
+    for state in ('pending', 'leased', 'failed'):
+        if queue.names(state):
+            errors.append(f"{state}/에 남은 작업: {sorted(queue.names(state))}")
+    completed = {}
+    for entry in read_log(root):
+        if entry['event'] == 'completed':
+            completed.setdefault(entry['job'], []).append(entry['node'])
+    for job_id in job_ids:
+        nodes = completed.get(job_id, [])
+        if len(nodes) != 1:
+            errors.append(f"{job_id}: 완료 {len(nodes)}번 {nodes}")
+            continue
+        try:
+            with open(queue.path('done', f"{job_id}.json"), 'r', encoding='utf-8') as f:
+                job = json.load(f)
+        except (OSError, ValueError) as e:
+            errors.append(f"{job_id}: done/ 파일 없음 ({e})")
+            continue
+        if job.get('node') != nodes[0]:
+            errors.append(f"{job_id}: done/ 파일의 노드 {job.get('node')} != 완료한 노드 {nodes[0]}")
+    return errors
+
+def test_parallel(workers, jobs, ttl, work):
+    """워커 여러 개가 작업을 나눠 받음: 모든 작업이 정확히 한 번 완료"""
+    with tempfile.TemporaryDirectory(prefix='queue-test-') as root:
+        queue = SharedQueue(root)
+        job_ids = [f"job{i:03d}" for i in range(jobs)]
+        for job_id in job_ids:
+            queue.enqueue(job_id, {'url': job_id})
+        procs = [spawn(root, f"w{i}", ttl, work) for i in range(workers)]
+        for proc in procs:
+            proc.wait()
+        errors = check_exactly_once(root, job_ids)
+        nodes = {e['node'] for e in read_log(root)}
+        print(f"  병렬 처리: 작업 {jobs}개, 워커 {workers}개 중 {len(nodes)}개가 참여")
+        return errors
+
+def test_reclaim(ttl, work):
+    """멈춘 워커의 임대를 다른 워커가 회수: 깨어난 워커는 중단하고 결과를 덮어쓰지 않음"""
+    with tempfile.TemporaryDirectory(prefix='queue-test-') as root:
+        queue = SharedQueue(root)
+        # 멈췄다 깨어난 뒤에도 작업이 남아 있어야 check()로 중단하는 경로를 탐
+        queue.enqueue('slow', {'url': 'slow', 'work': ttl * 3})
+        stalled = spawn(root, 'stalled', ttl, work)
+        # 임대를 가져갈 때까지 기다렸다가 하트비트가 끊기도록 프로세스를 멈춤
+        deadline = time.monotonic() + 10
+        while not queue.names('leased') and time.monotonic() < deadline:
+            time.sleep(0.02)
+        os.kill(stalled.pid, signal.SIGSTOP)
+        try:
+            rescuer = spawn(root, 'rescuer', ttl, work)
+            deadline = time.monotonic() + ttl * 3 + 10
+            while not any(n.endswith('.rescuer.json') for n in queue.names('leased')) \
+                    and not queue.names('done') and time.monotonic() < deadline:
+                time.sleep(0.02)
+        finally:
+            os.kill(stalled.pid, signal.SIGCONT)
+        stalled.wait()
+        rescuer.wait()
+        errors = check_exactly_once(root, ['slow'])
+        events = {(e['node'], e['event']) for e in read_log(root)}
+        if ('stalled', 'lost') not in events:
+            errors.append(f"멈췄던 워커가 임대를 잃은 것을 알아채지 못함: {sorted(events)}")
+        print(f"  임대 회수: {sorted(events)}")
+        return errors
+
+def main():
+    parser = argparse.ArgumentParser(description='dlcommon 공유 큐 다중 프로세스 테스트')
+    parser.add_argument('--workers', type=int, default=4, metavar='N',
+                        help='동시에 띄울 워커 프로세스 수 (기본: 4)')
+    parser.add_argument('--jobs', type=int, default=40, metavar='N',
+                        help='큐에 넣을 가짜 작업 수 (기본: 40)')
+    parser.add_argument('--ttl', type=float, default=1.0, metavar='SEC',
+                        help='임대 만료 시간 (기본: 1초)')
+    parser.add_argument('--work', type=float, default=0.2, metavar='SEC',
+                        help='가짜 작업 하나의 처리 시간 (기본: 0.2초)')
+    parser.add_argument('--worker', metavar='DIR', help=argparse.SUPPRESS)
+    parser.add_argument('--node', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        run_worker(args.worker, args.node, args.ttl, args.work)
+        return
+
+    print("공유 큐 테스트 중...")
+    errors = test_parallel(args.workers, args.jobs, args.ttl, args.work)
+    if hasattr(signal, 'SIGSTOP'):
+        errors += test_reclaim(args.ttl, args.work)
+    else:
+        print("  임대 회수: SIGSTOP이 없는 플랫폼이라 건너뜀")
+
+    print("\n" + "=" * 50)
+    for error in errors:
+        print(f"  [실패] {error}")
+    print(f"  {'실패' if errors else '통과'}")
+    print("=" * 50)
+    sys.exit(1 if errors else 0)
+
+if __name__ == "__main__":
+    try:
+        main()
+    except KeyboardInterrupt:
+        print("\n\n중단되었습니다.")
+        sys.exit(0)
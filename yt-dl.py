@@ -5,6 +5,311 @@ import subprocess
 import os
 import sys
 import re
+import json
+import time
+import hashlib
+import sqlite3
+import tempfile
+import argparse
+import threading
+import contextlib
+import atexit
+import functools
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlparse, parse_qs
+
+# 쿠키 캐시, 속도 제한, 공유 큐, 메트릭 기록은 naver-dl.py와 공유 (같은 디렉터리의 dlcommon.py)
+from dlcommon import (
+    DEFAULT_REQUEST_RATE, QUEUE_POLL_INTERVAL, HostRateLimiter, LeaseLost,
+    MetricsExporter, SharedQueue, StreamMeter, copy_cookie_file, get_cached_cookie_file,
+    parse_rate, private_cookie_file, write_atomic,
+)
+
+FORMAT = "bestvideo[height<=1080]+bestaudio/best[height<=1080]"
+OUTPUT_TEMPLATE = "%(title)s.%(ext)s"
+STATE_DIR = os.path.expanduser("~/.yt-dl")
+LIBRARY_FILE = os.path.join(STATE_DIR, "library.sqlite")
+INFO_CACHE_DIR = os.path.join(STATE_DIR, "info_cache")
+INFO_CACHE_TTL = 3600       # format URL에서 만료 시각을 못 찾았을 때 캐시 유지 시간(초)
+INFO_CACHE_MARGIN = 600     # 만료 이만큼(초) 전부터는 캐시를 쓰지 않음 (받는 도중 만료 방지)
+INFO_EXPIRES_KEY = 'yt_dl_cache_expires'
+DEFAULT_PREFETCH = 4        # 동시에 미리 추출할 영상 수
+DEFAULT_CONCURRENCY = 3     # 동시에 받을 영상 수
+PLAYLIST_MAX_DEPTH = 2      # 채널 → 탭 → 재생목록처럼 중첩된 목록을 펼칠 깊이
+# 서명된 format URL의 만료 시각 (쿼리 expire= 또는 HLS/DASH 경로의 /expire/)
+EXPIRE_RE = re.compile(r'[/?&]expire[=/](\d+)')
+# watch?v=, youtu.be/, shorts/, embed/, live/ 주소의 11자리 영상 ID
+VIDEO_ID_RE = re.compile(r'(?:youtu\.be/|[?&]v=|/(?:shorts|embed|live|v)/)([\w-]{11})(?![\w-])')
+
+# inprocess 엔진: 다운로드 스레드마다 배치 전체에서 재사용하는 YoutubeDL 인스턴스와 그 상태
+_ydl_local = threading.local()
+
+# 진행 이벤트: subprocess/inprocess 모두 같은 필드로 콘솔과 메트릭 파일에 보고
+PROGRESS_PREFIX = "[yt-dl] "
+YTDLP_RETRY_RE = re.compile(r'Retrying|재시도')
+_metrics = None     # --metrics-file
+_library = None     # 받은 영상 색인 (영상 ID → 파일)
+_extract_local = threading.local()  # 미리 추출용 YoutubeDL (스레드마다 하나)
+
+# naver-dl.py와 같은 상태 파일을 쓰는 호스트별 속도 제한 (dlcommon)
+_rate_limiter = HostRateLimiter()
+
+# 라이브러리 색인: 영상 ID로 이미 받은 영상을 네트워크 요청 없이 찾기
+class Library:
+    """받은 파일 색인 (SQLite, 영상 ID가 기본 키라 디렉터리를 훑지 않음)
+
+    파일을 옮기거나 지우면 조회할 때 크기/수정 시각으로 알아채고 그 항목만 지웁니다.
+    """
+
+    SCHEMA = """
+    CREATE TABLE IF NOT EXISTS videos (
+        video_id TEXT PRIMARY KEY,
+        path TEXT,
+        size INTEGER,
+        mtime REAL,
+        added_at REAL
+    );
+    """
+
+    def __init__(self, path=LIBRARY_FILE):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # 동시 다운로드 스레드들이 연결 하나를 잠금으로 나눠 씀
+        self.conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self.lock = threading.Lock()
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.executescript(self.SCHEMA)
+
+    def find(self, video_id):
+        """아직 그대로 있는 파일 경로 (바뀌었으면 항목을 지우고 None)"""
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT path, size, mtime FROM videos WHERE video_id = ?", (video_id,)).fetchone()
+        if not row:
+            return None
+        path, size, mtime = row
+        try:
+            st = os.stat(path)
+            if st.st_size == size and abs(st.st_mtime - mtime) < 1:
+                return path
+        except OSError:
+            pass
+        with self.lock, self.conn:
+            self.conn.execute("DELETE FROM videos WHERE video_id = ?", (video_id,))
+        return None
+
+    def add(self, video_id, path):
+        path = os.path.abspath(path)
+        st = os.stat(path)
+        with self.lock, self.conn:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO videos (video_id, path, size, mtime, added_at) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (video_id, path, st.st_size, st.st_mtime, time.time()))
+
+def youtube_video_id(url):
+    """URL에서 바로 알 수 있는 영상 ID (재생목록/채널 등은 None)"""
+    match = VIDEO_ID_RE.search(url)
+    return match.group(1) if match else None
+
+def record_downloads(entries):
+    """다운로드한 (영상 ID, 파일) 목록을 라이브러리에 등록 (받은 영상의 추출 정보 캐시는 삭제)"""
+    for video_id, path in entries:
+        if not (video_id and path and os.path.exists(path)):
+            continue
+        with contextlib.suppress(OSError):
+            os.remove(info_cache_path(video_id))
+        if not _library:
+            continue
+        try:
+            _library.add(video_id, path)
+        except (OSError, sqlite3.Error) as e:
+            print(f"  라이브러리 등록 실패: {e}")
+
+# 공유 큐: 여러 머신의 워커가 공유 디렉터리에서 URL을 임대해 받기
+def queue_job_id(url):
+    """공유 큐 작업 ID (영상 ID가 있으면 그대로, 없으면 URL 해시)"""
+    return youtube_video_id(url) or hashlib.sha1(url.encode()).hexdigest()[:16]
+
+def run_worker(queue_dir, engine, cookie_file=None, force=False):
+    """공유 큐에서 URL을 하나씩 임대해 받기 (대기/임대 중인 작업이 모두 끝나면 종료)"""
+    queue = SharedQueue(queue_dir)
+    print(f"워커 {queue.node}: {queue_dir}")
+    success = total = lost = 0
+    while True:
+        lease = queue.claim()
+        if lease is None:
+            if not queue.active():
+                break
+            # 다른 노드가 처리 중: 끝나거나 임대가 만료될 때까지 대기
+            time.sleep(QUEUE_POLL_INTERVAL)
+            continue
+        total += 1
+        try:
+            status, detail = download_video(lease.job['data']['url'], total, '?', engine,
+                                            cookie_file, force, lease=lease)
+        except LeaseLost as e:
+            print(f"  [queue] {e}")
+            status, detail = 'failed', str(e)
+        except Exception as e:
+            print(f"  [오류] {e}")
+            status, detail = 'failed', str(e)
+        if status == 'failed':
+            lease.finish(status, error=detail)
+        else:
+            lease.finish(status)
+        if lease.lost.is_set():
+            # 다른 노드가 이어받은 작업은 성공/실패 어느 쪽에도 세지 않음
+            lost += 1
+        elif status != 'failed':
+            success += 1
+    print(f"\n워커 결과: {success}/{total - lost} 성공" + (f" (임대 만료 {lost}개)" if lost else ""))
+    return success == total - lost
+
+# 추출 정보 캐시: 영상 ID별 info JSON을 format URL이 만료될 때까지 재사용
+def info_cache_path(video_id):
+    return os.path.join(INFO_CACHE_DIR, f"{video_id}.info.json")
+
+def info_expiry(info):
+    """받을 format URL들 중 가장 이른 만료 시각 (없으면 기본 TTL)"""
+    formats = info.get('requested_formats') or info.get('formats') or []
+    expires = [int(m.group(1)) for f in formats
+               for m in [EXPIRE_RE.search(f.get('url') or '')] if m]
+    return min(expires) if expires else time.time() + INFO_CACHE_TTL
+
+def cached_info(video_id):
+    """아직 유효한 캐시 info JSON 경로 (없거나 곧 만료되면 지우고 None)"""
+    path = info_cache_path(video_id)
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            expires = json.load(f).get(INFO_EXPIRES_KEY, 0)
+    except (OSError, ValueError):
+        return None
+    if expires - INFO_CACHE_MARGIN > time.time():
+        return path
+    with contextlib.suppress(OSError):
+        os.remove(path)
+    return None
+
+def extract_info(url, engine='subprocess', cookie_file=None, flat=False):
+    """다운로드 없이 info dict만 추출 (flat이면 재생목록 항목을 풀지 않음, 실패 시 None)"""
+    _rate_limiter.acquire(url)
+    failure = "목록 추출 실패" if flat else "미리 추출 실패"
+    if engine == 'inprocess':
+        key = 'flat_ydl' if flat else 'ydl'
+        ydl = getattr(_extract_local, key, None)
+        if ydl is None:
+            import yt_dlp
+            params = {'quiet': True, 'noprogress': True, 'logger': RetryLogger()}
+            if flat:
+                params['extract_flat'] = 'in_playlist'
+            else:
+                params.update(format=FORMAT, noplaylist=True)
+            # 인스턴스가 끝날 때 쿠키를 다시 저장하므로 공유 캐시 대신 개인 사본을 넘김
+            cookie_copy = copy_cookie_file(cookie_file)
+            if cookie_copy:
+                params['cookiefile'] = cookie_copy
+            else:
+                params['cookiesfrombrowser'] = ('firefox',)
+            ydl = yt_dlp.YoutubeDL(params)
+            setattr(_extract_local, key, ydl)
+        try:
+            return ydl.sanitize_info(ydl.extract_info(url, download=False))
+        except Exception as e:
+            print(f"  [{failure}] {url[:60]}: {e}")
+            return None
+
+    try:
+        with private_cookie_file(cookie_file) as cookie_copy:
+            if flat:
+                cmd = ["yt-dlp", *cookie_args(cookie_copy), "--flat-playlist", "-J", url]
+            else:
+                cmd = ["yt-dlp", *cookie_args(cookie_copy), "-f", FORMAT, "--no-playlist",
+                       "-J", url]
+            result = subprocess.run(cmd, capture_output=True, text=True, encoding='utf-8',
+                                    errors='replace')
+    except OSError as e:
+        print(f"  [{failure}] yt-dlp 실행 실패: {e}")
+        return None
+    if result.returncode != 0:
+        reason = (result.stderr.strip().splitlines() or ['알 수 없는 오류'])[-1]
+        print(f"  [{failure}] {url[:60]}: {reason}")
+        return None
+    try:
+        return json.loads(result.stdout)
+    except ValueError:
+        return None
+
+def prefetch_info(url, video_id, engine='subprocess', cookie_file=None):
+    """캐시에 없으면 추출해서 저장 (다운로드에 넘길 info JSON 경로, 실패 시 None)"""
+    path = cached_info(video_id)
+    if path:
+        return path
+    info = extract_info(url, engine, cookie_file)
+    if not info or info.get('id') != video_id:
+        return None
+    info[INFO_EXPIRES_KEY] = info_expiry(info)
+    path = info_cache_path(video_id)
+    try:
+        # format별 쿠키가 들어 있으므로 본인만 읽을 수 있게 저장
+        write_atomic(path, json.dumps(info, ensure_ascii=False), mode=0o600)
+    except OSError as e:
+        print(f"  [캐시 저장 실패] {e}")
+        return None
+    return path
+
+# 재생목록/채널 펼치기: 항목 정보 없이 목록만 받아(--flat-playlist) 영상별 작업으로 나눔
+def is_collection_url(url):
+    """재생목록/채널처럼 펼쳐야 하는 URL인지 (watch?v=...&list=...도 재생목록 전체)"""
+    return not youtube_video_id(url) or 'list' in parse_qs(urlparse(url).query)
+
+def playlist_entries(info, engine='subprocess', cookie_file=None, depth=0):
+    """flat 추출 결과의 항목을 (영상 URL, 제목) 목록으로 (채널 탭 등 하위 목록은 다시 펼침)"""
+    entries = []
+    for entry in info.get('entries') or []:
+        if not entry:
+            continue  # 비공개/삭제된 항목
+        if entry.get('entries') is not None:
+            entries.extend(playlist_entries(entry, engine, cookie_file, depth + 1))
+        elif entry.get('ie_key') == 'Youtube' and entry.get('id'):
+            entries.append((f"https://www.youtube.com/watch?v={entry['id']}", entry.get('title')))
+        elif entry.get('url'):
+            if depth < PLAYLIST_MAX_DEPTH:
+                entries.extend(expand_url(entry['url'], engine, cookie_file, depth + 1))
+            else:
+                entries.append((entry['url'], entry.get('title')))
+    return entries
+
+def expand_url(url, engine='subprocess', cookie_file=None, depth=0):
+    """재생목록/채널 URL을 (영상 URL, 제목) 목록으로 (영상 URL이거나 추출에 실패하면 그대로)"""
+    if not is_collection_url(url):
+        return [(url, None)]
+    info = extract_info(url, engine, cookie_file, flat=True)
+    if not info:
+        return [(url, None)]
+    if info.get('_type') not in ('playlist', 'multi_video'):
+        return [(info.get('webpage_url') or url, info.get('title'))]
+    return playlist_entries(info, engine, cookie_file, depth)
+
+def expand_playlists(urls, engine='subprocess', cookie_file=None, workers=DEFAULT_CONCURRENCY):
+    """URL들을 동시에 펼쳐 영상 ID가 겹치지 않는 (URL, 제목) 작업 목록으로 (입력 순서 유지)"""
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+        expanded = list(pool.map(lambda url: expand_url(url, engine, cookie_file), urls))
+    jobs = []
+    seen = set()
+    duplicates = 0
+    for url, entries in zip(urls, expanded):
+        if is_collection_url(url) and entries != [(url, None)]:
+            print(f"  [펼침] {url[:60]}: 영상 {len(entries)}개")
+        for entry in entries:
+            key = youtube_video_id(entry[0]) or entry[0]
+            if key in seen:
+                duplicates += 1
+                continue
+            seen.add(key)
+            jobs.append(entry)
+    if duplicates:
+        print(f"  중복 영상 {duplicates}개 제외")
+    return jobs
 
 def get_urls_from_input():
     """URL 입력받기"""
@@ -31,35 +336,334 @@ def get_urls_from_input():
 
     return urls
 
-def download_video(url, index, total):
-    """단일 영상 다운로드"""
-    print(f"\n[{index}/{total}] 다운로드 중...")
-    print(f"  URL: {url[:60]}...")
+def report_progress(url, **fields):
+    if _metrics:
+        _metrics.on_progress((url,), fields)
 
-    cmd = [
-        "yt-dlp",
-        "--cookies-from-browser", "firefox",
-        "-f", "bestvideo[height<=1080]+bestaudio/best[height<=1080]",
-        "--merge-output-format", "mp4",
-        "--no-part",
-        "--restrict-filenames",
-        "-o", "%(title)s.%(ext)s",
-        url
-    ]
+def new_progress_target(url, label='', lease=None):
+    """영상 하나의 진행 상태 (label은 동시에 받는 영상들의 출력을 구분하는 '[3/300]' 등,
+    lease는 공유 큐 워커가 임대한 작업이면 그 QueueLease)"""
+    now = time.monotonic()
+    return {'url': url, 'label': label, 'retries': 0, 'started': now, 'last_time': now,
+            'last_bytes': 0, 'last_event': 0, 'last_report': 0, 'files': {}, 'error': None,
+            'lease': lease}
 
-    result = subprocess.run(cmd)
+def show_progress(target, d):
+    """yt-dlp 진행 dict를 메트릭(1초)/콘솔(5초)로 전달"""
+    if target['lease']:
+        # 임대를 잃었으면 다른 노드가 이어받으므로 바로 멈춤
+        target['lease'].check()
+    status = d.get('status')
+    done = d.get('downloaded_bytes') or 0
+    # 영상/오디오를 차례로 받으므로 파일별 바이트를 합쳐서 계산
+    target['files'][d.get('filename')] = done
+    received = sum(target['files'].values())
+    target['fragment_count'] = d.get('fragment_count') or target.get('fragment_count')
+    total = d.get('total_bytes') or d.get('total_bytes_estimate')
+    now = time.monotonic()
+    if status == 'downloading' and now - target['last_event'] < 1:
+        return
+    target['last_event'] = now
+    speed = d.get('speed')
+    if speed is None and now > target['last_time']:
+        speed = max(0, received - target['last_bytes']) / (now - target['last_time'])
+    target['last_time'] = now
+    target['last_bytes'] = received
+    elapsed = now - target['started']
+    average = received / elapsed if elapsed > 0 else None
+    eta = d.get('eta')
+    if eta is None and total and speed:
+        eta = max(0, total - done) / speed
 
-    if result.returncode != 0:
-        print(f"  [오류] 다운로드 실패")
+    if status == 'finished':
+        report_progress(target['url'], downloaded_bytes=received,
+                        fragment_index=target['fragment_count'], speed=0,
+                        average_speed=average, retries=target['retries'], eta=0)
+        print(f"  {target['label']} 받기 완료: {os.path.basename(d.get('filename') or '')}")
+        return
+    if status != 'downloading':
+        return
+    report_progress(target['url'], downloaded_bytes=received, total_bytes=total,
+                    fragment_index=d.get('fragment_index'),
+                    fragment_count=d.get('fragment_count'), speed=speed,
+                    average_speed=average, retries=target['retries'], eta=eta)
+    if now - target['last_report'] < 5:
+        return
+    target['last_report'] = now
+
+    percent = f"{done * 100 / total:.1f}%" if total else f"{done / 1048576:.1f}MB"
+    parts = [percent, f"{speed / 1048576:.1f}MB/s" if speed else "-"]
+    if average:
+        parts[-1] += f" (평균 {average / 1048576:.1f}MB/s)"
+    if d.get('fragment_count'):
+        parts.append(f"조각 {d.get('fragment_index') or 0}/{d['fragment_count']}")
+    if target['retries']:
+        parts.append(f"재시도 {target['retries']}")
+    parts.append(f"남은 시간 {int(eta)}초" if eta is not None else "남은 시간 -")
+    print(f"  {target['label']} {' | '.join(parts)}")
+
+class RetryLogger:
+    """YoutubeDL 로거: 재시도 경고를 세어 진행 이벤트에 포함하고 마지막 오류를 기록"""
+
+    def __init__(self, state=None):
+        self.state = state if state is not None else {}
+
+    def debug(self, msg):
+        pass
+
+    def info(self, msg):
+        pass
+
+    def warning(self, msg):
+        current = self.state.get('current')
+        if current and YTDLP_RETRY_RE.search(msg):
+            current['retries'] += 1
+
+    def error(self, msg):
+        current = self.state.get('current')
+        if not current:
+            print(f"  {msg}")
+            return
+        current['error'] = msg
+        print(f"  {current['label']} {msg}")
+
+def postprocessor_hook(d, state):
+    """파일이 최종 위치로 옮겨지면 라이브러리에 등록할 목록에 추가"""
+    if d.get('status') == 'finished' and d.get('postprocessor') == 'MoveFiles':
+        info = d.get('info_dict') or {}
+        state['moved'].append((info.get('id'), info.get('filepath')))
+
+def progress_hook(d, state):
+    """yt-dlp 진행 상황 훅"""
+    page_url = (d.get('info_dict') or {}).get('webpage_url') or 'https://youtube.com/'
+    filename = d.get('filename')
+    charged = state['charged']
+    done = d.get('downloaded_bytes') or 0
+    received = done - charged.get(filename, 0)
+    charged[filename] = max(done, charged.get(filename, 0))
+    # 훅은 다운로드 스레드에서 불리므로 여기서 기다리면 그만큼 속도가 제한됨
+    _rate_limiter.consume(page_url, received)
+    if state['current']:
+        show_progress(state['current'], d)
+
+def cookie_args(cookie_file):
+    """yt-dlp 쿠키 옵션 (캐시가 없으면 브라우저에서 직접 읽음)
+
+    yt-dlp가 끝날 때 이 파일에 쿠키를 다시 저장하므로 private_cookie_file 사본을 넘깁니다.
+    """
+    if cookie_file:
+        return ["--cookies", cookie_file]
+    return ["--cookies-from-browser", "firefox"]
+
+def get_ydl(cookie_file=None):
+    """이 스레드가 배치 전체에서 재사용하는 YoutubeDL 인스턴스와 그 훅 상태
+
+    YoutubeDL은 스레드 사이에 공유할 수 없으므로 동시 다운로드 스레드마다 하나씩 만듭니다.
+    """
+    ydl = getattr(_ydl_local, 'ydl', None)
+    if ydl is None:
+        import yt_dlp
+        # current: 받고 있는 영상의 진행 상태, moved: 최종 위치로 옮겨진 (영상 ID, 파일) 목록
+        state = {'current': None, 'moved': [], 'charged': {}}
+        params = {
+            'format': FORMAT,
+            'merge_output_format': 'mp4',
+            'continuedl': True,
+            'restrictfilenames': True,
+            'noplaylist': True,
+            'outtmpl': OUTPUT_TEMPLATE,
+            'quiet': True,
+            'noprogress': True,
+            'logger': RetryLogger(state),
+            'progress_hooks': [functools.partial(progress_hook, state=state)],
+            'postprocessor_hooks': [functools.partial(postprocessor_hook, state=state)],
+        }
+        cookie_copy = copy_cookie_file(cookie_file)
+        if cookie_copy:
+            params['cookiefile'] = cookie_copy
+        else:
+            params['cookiesfrombrowser'] = ('firefox',)
+        ydl = _ydl_local.ydl = yt_dlp.YoutubeDL(params)
+        _ydl_local.state = state
+    return ydl, _ydl_local.state
+
+def run_streaming(cmd, target, meter):
+    """yt-dlp 출력을 한 줄씩 읽어 진행 JSON은 처리하고 나머지는 그대로 출력"""
+    try:
+        proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+                                text=True, encoding='utf-8', errors='replace')
+    except OSError as e:
+        print(f"  {target['label']} yt-dlp 실행 실패: {e}")
+        target['error'] = f"yt-dlp 실행 실패: {e}"
         return False
+    meter.attach(proc.stdout)
+    with proc:
+        try:
+            for line in proc.stdout:
+                line = line.rstrip()
+                if line.startswith(PROGRESS_PREFIX):
+                    try:
+                        d = json.loads(line[len(PROGRESS_PREFIX):])
+                    except ValueError:
+                        continue
+                    # 같은 호스트의 다른 다운로드와 한도를 나눠 씀 (기다리는 동안 yt-dlp도 멈춤)
+                    meter.update(d)
+                    show_progress(target, d)
+                    continue
+                if YTDLP_RETRY_RE.search(line):
+                    target['retries'] += 1
+                if line.startswith('ERROR:'):
+                    target['error'] = line
+                print(f"{target['label']} {line}" if target['label'] else line)
+        except LeaseLost:
+            proc.kill()
+            raise
+    return proc.returncode == 0
+
+def download_video(url, index, total, engine='subprocess', cookie_file=None, force=False,
+                   info_future=None, lease=None):
+    """단일 영상 다운로드 (미리 추출했거나 캐시된 info JSON이 있으면 추출 생략)
+
+    ('done' | 'skipped' | 'failed', 실패 이유 또는 이미 받은 파일) 반환,
+    공유 큐 작업(lease)의 임대를 잃으면 LeaseLost
+    """
+    label = f"[{index}/{total}]"
+    print(f"\n{label} 다운로드 중: {url[:60]}")
 
-    print(f"  완료!")
-    return True
+    video_id = youtube_video_id(url)
+    existing = _library.find(video_id) if _library and video_id and not force else None
+    if existing:
+        print(f"  {label} 이미 받은 영상입니다: {existing}")
+        return 'skipped', existing
+
+    # 미리 추출한 정보도 앞 영상들을 받는 동안 만료됐을 수 있으므로 받기 직전에 다시 확인
+    if info_future:
+        info_future.result()
+    info_path = cached_info(video_id) if video_id else None
+
+    target = new_progress_target(url, label, lease)
+    report_progress(url, status='downloading')
+
+    if engine == 'inprocess':
+        moved = []
+        try:
+            _rate_limiter.acquire(url)
+            ydl, state = get_ydl(cookie_file)
+            state.update(current=target, moved=moved)
+            if info_path:
+                # format URL이 그새 만료됐으면 yt-dlp가 webpage_url로 다시 추출함
+                ok = ydl.download_with_info_file(info_path) == 0
+            else:
+                ok = ydl.download([url]) == 0
+        except Exception as e:
+            print(f"  {label} {e}")
+            target['error'] = target['error'] or str(e)
+            ok = False
+        record_downloads(moved)
+        if lease:
+            # 훅에서 낸 LeaseLost는 yt-dlp가 다운로드 실패로 바꾸므로 다시 확인
+            lease.check()
+    else:
+        cmd = [
+            "yt-dlp",
+            "-f", FORMAT,
+            "--merge-output-format", "mp4",
+            "--continue",       # 중단된 .part 파일 이어받기
+            "--restrict-filenames",
+            "--no-playlist",    # 재생목록은 미리 펼쳐서 영상마다 작업 하나
+            # 진행 상황을 한 줄에 JSON 하나씩 받아 바로 처리
+            "--newline", "--progress",
+            "--progress-template", f"download:{PROGRESS_PREFIX}%(progress)j",
+            "-o", OUTPUT_TEMPLATE,
+        ]
+        # 최종 파일 경로는 별도 파일로 받음 (--print는 일반 출력을 숨김)
+        fd, moved_list = tempfile.mkstemp(prefix='yt-dl-moved-', suffix='.txt')
+        os.close(fd)
+        cmd.extend(["--print-to-file", "after_move:%(id)s\t%(filepath)s", moved_list])
+        try:
+            meter = StreamMeter(_rate_limiter, url)
+            if meter.limit_rate():
+                cmd.extend(["--limit-rate", str(meter.limit_rate())])
+            cmd.extend(["--load-info-json", info_path] if info_path else [url])
+            _rate_limiter.acquire(url)
+            with private_cookie_file(cookie_file) as cookie_copy:
+                ok = run_streaming([cmd[0], *cookie_args(cookie_copy), *cmd[1:]], target, meter)
+            with open(moved_list, 'r', encoding='utf-8') as f:
+                record_downloads(line.rstrip('\n').split('\t', 1) for line in f if '\t' in line)
+        finally:
+            os.remove(moved_list)
+
+    report_progress(url, status='done' if ok else 'failed')
+    if not ok:
+        print(f"  {label} [오류] 다운로드 실패")
+        error = re.sub(r'^ERROR:\s*', '', target['error'] or '') or '다운로드 실패'
+        return 'failed', error
+
+    print(f"  {label} 완료!")
+    return 'done', None
+
+def print_report(jobs, results):
+    """작업별 결과 요약 (입력 순서대로)"""
+    print("\n" + "=" * 60)
+    print(f"결과: {sum(1 for status, _ in results if status == 'done')}/{len(results)} 완료, "
+          f"건너뜀 {sum(1 for status, _ in results if status == 'skipped')}, "
+          f"실패 {sum(1 for status, _ in results if status == 'failed')}")
+    print("=" * 60)
+    for (url, title), (status, detail) in zip(jobs, results):
+        label = {'done': '완료', 'skipped': '건너뜀', 'failed': '실패'}[status]
+        print(f"  [{label}] {title or url}" + (f" ({detail})" if status == 'failed' else ""))
 
 def main():
-    if len(sys.argv) > 1:
+    global _metrics, _library
+    parser = argparse.ArgumentParser(description='YouTube 다운로더 (Firefox 쿠키 사용)')
+    parser.add_argument('urls', nargs='*', metavar='URL',
+                        help='다운로드할 URL (없으면 대화형 입력)')
+    parser.add_argument('--engine', choices=['subprocess', 'inprocess'],
+                        default='subprocess',
+                        help='yt-dlp 실행 방식: URL마다 프로세스 실행 또는 '
+                             '한 프로세스에서 Python API로 재사용 (기본: subprocess)')
+    parser.add_argument('--rate-limit', type=float, default=DEFAULT_REQUEST_RATE, metavar='N',
+                        help='호스트당 초당 요청 수 한도, 실행 중인 모든 yt-dl/naver-dl이 공유 '
+                             f'(0은 제한 없음, 기본: {DEFAULT_REQUEST_RATE:g})')
+    parser.add_argument('--bandwidth', type=parse_rate, default=None, metavar='RATE',
+                        help='호스트당 대역폭 한도 (예: 8M, 500K), 실행 중인 모든 다운로드가 공유')
+    parser.add_argument('--metrics-file', metavar='FILE',
+                        help='다운로드 진행 메트릭을 기록할 파일 '
+                             '(.prom이면 Prometheus textfile, 그 밖에는 JSON)')
+    parser.add_argument('--force', action='store_true',
+                        help='라이브러리에 이미 있는 영상도 다시 다운로드')
+    parser.add_argument('--prefetch', type=int, default=DEFAULT_PREFETCH, metavar='N',
+                        help='앞 영상을 받는 동안 다음 영상 정보를 N개까지 동시에 미리 추출 '
+                             f'(0은 미리 추출 안 함, 기본: {DEFAULT_PREFETCH})')
+    parser.add_argument('--concurrency', '-j', type=int, default=DEFAULT_CONCURRENCY,
+                        metavar='N',
+                        help=f'동시에 받을 영상 수 (기본: {DEFAULT_CONCURRENCY})')
+    parser.add_argument('--enqueue', metavar='DIR',
+                        help='URL을 공유 큐 디렉터리에 추가만 함')
+    parser.add_argument('--worker', metavar='DIR',
+                        help='공유 큐 디렉터리에서 URL을 임대해 받기 (여러 머신/프로세스에서 동시 실행)')
+    args = parser.parse_args()
+    _library = Library()
+    if args.metrics_file:
+        _metrics = MetricsExporter(args.metrics_file, 'yt_dl', ('url',))
+        atexit.register(_metrics.flush)
+    _rate_limiter.request_rate = args.rate_limit or None
+    _rate_limiter.bandwidth = args.bandwidth
+
+    if args.engine == 'inprocess':
+        try:
+            import yt_dlp  # noqa: F401
+        except ImportError:
+            print("inprocess 엔진에는 yt-dlp 파이썬 패키지가 필요합니다 (pip install yt-dlp)")
+            sys.exit(1)
+
+    if args.worker:
+        cookie_file = get_cached_cookie_file()
+        sys.exit(0 if run_worker(args.worker, args.engine, cookie_file, args.force) else 1)
+
+    if args.urls:
         # 명령줄 인자로 URL 전달
-        urls = sys.argv[1:]
+        urls = args.urls
     else:
         # 대화형 입력
         urls = get_urls_from_input()
@@ -68,14 +672,51 @@ def main():
         print("URL이 입력되지 않았습니다.")
         sys.exit(1)
 
-    print(f"\n{len(urls)}개의 URL을 다운로드합니다.")
+    cookie_file = get_cached_cookie_file()
+    print(f"쿠키: Firefox 브라우저" + (f" (캐시: {cookie_file})" if cookie_file else ""))
 
-    success = 0
-    for i, url in enumerate(urls, 1):
-        if download_video(url, i, len(urls)):
-            success += 1
+    # 재생목록/채널은 영상별 작업으로 펼침 (큐에 넣을 때도 영상 단위)
+    jobs = expand_playlists(urls, args.engine, cookie_file, args.concurrency)
+
+    if args.enqueue:
+        queue = SharedQueue(args.enqueue)
+        for url, _ in jobs:
+            added = queue.enqueue(queue_job_id(url), {'url': url})
+            print(f"  [{'추가' if added else '이미 있음'}] {url}")
+        return
+
+    print(f"\n{len(jobs)}개의 영상을 다운로드합니다 (동시 {max(1, args.concurrency)}개).")
+
+    with ThreadPoolExecutor(max_workers=max(1, args.prefetch)) as prefetcher, \
+            ThreadPoolExecutor(max_workers=max(1, args.concurrency)) as downloader:
+        # 다운로드 순서대로 미리 추출 (라이브러리에 있거나 ID를 모르는 URL은 제외)
+        infos = {}
+        if args.prefetch > 0:
+            for url, _ in jobs:
+                video_id = youtube_video_id(url)
+                if not video_id or video_id in infos \
+                        or (_library.find(video_id) and not args.force):
+                    continue
+                infos[video_id] = prefetcher.submit(prefetch_info, url, video_id, args.engine,
+                                                    cookie_file)
+        futures = [downloader.submit(download_video, url, i, len(jobs), args.engine, cookie_file,
+                                     args.force, infos.get(youtube_video_id(url)))
+                   for i, (url, _) in enumerate(jobs, 1)]
+        results = []
+        try:
+            for future in futures:
+                try:
+                    results.append(future.result())
+                except Exception as e:
+                    results.append(('failed', str(e)))
+        except KeyboardInterrupt:
+            # 아직 시작하지 않은 작업은 버리고 받는 중인 것만 기다림
+            for future in futures + list(infos.values()):
+                future.cancel()
+            raise
 
-    print(f"\n완료: {success}/{len(urls)} 성공")
+    print_report(jobs, results)
+    sys.exit(0 if all(status != 'failed' for status, _ in results) else 1)
 
 if __name__ == "__main__":
     try: